@@ -57,6 +57,16 @@ class LibrarianFeedSwift(LaunchpadCronScript):
             "--num-instances", action="store", type=int, default=None,
             metavar="NUM_INSTANCES",
             help="Run NUM_INSTANCES parallel workers")
+        self.parser.add_option(
+            "-w", "--workers", action="store", type=int, default=1,
+            metavar="WORKERS",
+            help="Upload up to WORKERS files at once (default: 1)")
+        self.parser.add_option(
+            "--checkpoint", action="store", default=None,
+            metavar="PATH",
+            help=(
+                "Record progress in PATH, and resume from there on the "
+                "next run"))
 
     @property
     def lockfilename(self):
@@ -96,16 +106,24 @@ class LibrarianFeedSwift(LaunchpadCronScript):
                 "Must specify both or neither of --instance-id and "
                 "--num-instances")
 
+        if self.options.workers < 1:
+            self.parser.error("--workers must be at least 1")
+
         kwargs = {
             "instance_id": self.options.instance_id,
             "num_instances": self.options.num_instances,
             "remove_func": remove,
+            "workers": self.options.workers,
             }
 
         if self.options.ids and (self.options.start or self.options.end):
             self.parser.error(
                 "Cannot specify both individual file(s) and range")
 
+        elif self.options.ids and self.options.checkpoint:
+            self.parser.error(
+                "Cannot specify both individual file(s) and --checkpoint")
+
         elif self.options.ids:
             for lfc in self.options.ids:
                 swift.to_swift(
@@ -114,7 +132,8 @@ class LibrarianFeedSwift(LaunchpadCronScript):
         else:
             swift.to_swift(
                 self.logger, start_lfc_id=self.options.start,
-                end_lfc_id=self.options.end, **kwargs)
+                end_lfc_id=self.options.end,
+                checkpoint_path=self.options.checkpoint, **kwargs)
         self.logger.info('Done')
 
 
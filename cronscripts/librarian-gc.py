@@ -15,12 +15,16 @@ __metaclass__ = type
 import _pythonpath  # noqa: F401
 
 import logging
+import os
 
 from lp.services.config import config
 from lp.services.database.interfaces import IStore
 from lp.services.librarian.model import LibraryFileAlias
 from lp.services.librarianserver import librariangc
-from lp.services.scripts.base import LaunchpadCronScript
+from lp.services.scripts.base import (
+    LaunchpadCronScript,
+    LaunchpadScriptFailure,
+    )
 
 
 class LibrarianGC(LaunchpadCronScript):
@@ -56,10 +60,31 @@ class LibrarianGC(LaunchpadCronScript):
                 dest="skip_expiry",
                 help="Skip expiring aliases with an expiry date in the past."
                 )
+        self.parser.add_option(
+                '', "--dry-run", action="store_true", default=False,
+                dest="dry_run",
+                help="Only report the files on disk and in Swift that would "
+                     "be removed and the space that would be freed.  Other "
+                     "steps are skipped."
+                )
+        self.parser.add_option(
+                '', "--checkpoint-dir", dest="checkpoint_dir",
+                metavar="DIR",
+                help="Record the progress of file removal in DIR, and "
+                     "resume from there if a previous run was interrupted."
+                )
 
     def main(self):
         librariangc.log = self.logger
 
+        if self.options.dry_run and self.options.checkpoint_dir:
+            raise LaunchpadScriptFailure(
+                "--dry-run and --checkpoint-dir are mutually exclusive.")
+        if (self.options.checkpoint_dir and
+                not os.path.isdir(self.options.checkpoint_dir)):
+            raise LaunchpadScriptFailure(
+                "%s is not a directory." % self.options.checkpoint_dir)
+
         if self.options.loglevel <= logging.DEBUG:
             librariangc.debug = True
 
@@ -73,6 +98,10 @@ class LibrarianGC(LaunchpadCronScript):
         # librarian and the database.
         librariangc.confirm_no_clock_skew(store)
 
+        if self.options.dry_run:
+            librariangc.delete_unwanted_files(conn, dry_run=True)
+            return
+
         # Note that each of these next steps will issue commit commands
         # as appropriate to make this script transaction friendly
         if not self.options.skip_expiry:
@@ -90,7 +119,8 @@ class LibrarianGC(LaunchpadCronScript):
             # Second sweep.
             librariangc.delete_unreferenced_content(conn)
         if not self.options.skip_files:
-            librariangc.delete_unwanted_files(conn)
+            librariangc.delete_unwanted_files(
+                conn, checkpoint_dir=self.options.checkpoint_dir)
 
 
 if __name__ == '__main__':
@@ -5,13 +5,9 @@
 
 """Parse librarian apache logs to find out download counts for each file.
 
-Thanks to the *huge* number of different LibraryFileAlias objects this script
-will fetch when parsing multiple log files from scratch and the fact that we
-overwrite storm's cache with something that caches *everything*, this script
-may end up eating all your RAM. That shouldn't happen in general as we run
-it multiple times a day, but if we ever fail to run it for more than a week,
-we may need to add a hack (store._cache.clear()) to clear the cache after
-updating the counts of every LFA, in order to get through the backlog.
+Counts are written in bulk without loading the LibraryFileAlias objects
+themselves, so a backlog of many log files can be processed without
+eating all your RAM.
 """
 
 __metaclass__ = type
@@ -21,6 +17,7 @@ import _pythonpath  # noqa: F401
 from storm.sqlobject import SQLObjectNotFound
 from zope.component import getUtility
 
+from lp.app.errors import NotFoundError
 from lp.services.apachelogparser.script import ParseApacheLogs
 from lp.services.config import config
 from lp.services.librarian.interfaces import ILibraryFileAliasSet
@@ -28,14 +25,20 @@ from lp.services.librarianserver.apachelogparser import (
     DBUSER,
     get_library_file_id,
     )
+from lp.services.worlddata.interfaces.country import ICountrySet
 
 
 class ParseLibrarianApacheLogs(ParseApacheLogs):
     """An Apache log parser for LibraryFileAlias downloads."""
 
+    # Write download counts to the database in batches of this many.
+    flush_size = 1000
+
     def setUpUtilities(self):
         """See `ParseApacheLogs`."""
         self.libraryfilealias_set = getUtility(ILibraryFileAliasSet)
+        self.country_set = getUtility(ICountrySet)
+        self.country_ids = {}
 
     @property
     def root(self):
@@ -55,6 +58,38 @@ class ParseLibrarianApacheLogs(ParseApacheLogs):
             # try to store download counters for it.
             return None
 
+    def getCountryID(self, country_code):
+        """Return the ID of the country with this code, or None."""
+        if country_code not in self.country_ids:
+            try:
+                country_id = self.country_set[country_code].id
+            except NotFoundError:
+                # We don't know the country for the IP address where this
+                # request originated.
+                country_id = None
+            self.country_ids[country_code] = country_id
+        return self.country_ids[country_code]
+
+    def updateDownloadCounts(self, downloads):
+        """See `ParseApacheLogs`.
+
+        Counts are gathered into a flat dictionary keyed by (alias ID, day,
+        country ID) and written with a single query per batch, rather than
+        looking up each alias and updating its counts row by row.
+        """
+        counts = {}
+        while downloads:
+            file_id, daily_downloads = downloads.popitem()
+            alias_id = int(file_id)
+            for day, country_downloads in daily_downloads.items():
+                for country_code, count in country_downloads.items():
+                    key = (alias_id, day, self.getCountryID(country_code))
+                    counts[key] = counts.get(key, 0) + count
+            if len(counts) >= self.flush_size:
+                self.libraryfilealias_set.updateDownloadCounts(counts)
+                counts = {}
+        self.libraryfilealias_set.updateDownloadCounts(counts)
+
 
 if __name__ == '__main__':
     script = ParseLibrarianApacheLogs('parse-librarian-apache-logs', DBUSER)
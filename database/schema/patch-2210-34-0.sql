@@ -0,0 +1,34 @@
+-- Copyright 2021 Canonical Ltd.  This software is licensed under the
+-- GNU Affero General Public License version 3 (see the file LICENSE).
+
+SET client_min_messages=ERROR;
+
+-- The person related-software listings are batched by (date_uploaded, id)
+-- memos, so the indexes they use need to include the id tie-breaker for
+-- later batches to be fetched by an index scan rather than by filtering.
+-- The existing index names were truncated to 63 characters, so the new
+-- ones use a shorter prefix.
+
+-- Person.getLatestMaintainedPackages
+DROP INDEX latestpersonsourcepackagereleasecache__maintainer__date__non_pp;
+CREATE INDEX latestpersonsprc__maintainer__date__id__non_ppa__idx
+    ON LatestPersonSourcePackageReleaseCache (
+        maintainer, date_uploaded DESC, id DESC)
+    -- 2 == PPA
+    WHERE archive_purpose <> 2;
+
+-- Person.getLatestUploadedButNotMaintainedPackages
+DROP INDEX latestpersonsourcepackagereleasecache__creator__date__non_ppa__;
+CREATE INDEX latestpersonsprc__creator__date__id__non_ppa__idx
+    ON LatestPersonSourcePackageReleaseCache (
+        creator, date_uploaded DESC, id DESC)
+    -- 2 == PPA
+    WHERE archive_purpose <> 2;
+
+-- Person.getLatestUploadedPPAPackages
+DROP INDEX latestpersonsourcepackagereleasecache__creator__purpose__date__;
+CREATE INDEX latestpersonsprc__creator__purpose__date__id__idx
+    ON LatestPersonSourcePackageReleaseCache (
+        creator, archive_purpose, date_uploaded DESC, id DESC);
+
+INSERT INTO LaunchpadDatabaseRevision VALUES (2210, 34, 0);
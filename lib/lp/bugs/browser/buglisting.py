@@ -707,7 +707,7 @@ class BugListingBatchNavigator(TableBatchNavigator):
     """A specialised batch navigator to load smartly extra bug information."""
 
     def __init__(self, tasks, request, columns_to_show, size,
-                 target_context=None):
+                 target_context=None, approximate_counts=False):
         self.request = request
         self.target_context = target_context
         self.user = getUtility(ILaunchBag).user
@@ -728,7 +728,8 @@ class BugListingBatchNavigator(TableBatchNavigator):
         self.field_visibility = None
         self._setFieldVisibility()
         TableBatchNavigator.__init__(
-            self, tasks, request, columns_to_show=columns_to_show, size=size)
+            self, tasks, request, columns_to_show=columns_to_show, size=size,
+            approximate_counts=approximate_counts)
 
     @cachedproperty
     def bug_badge_properties(self):
@@ -1327,7 +1328,7 @@ class BugTaskSearchListingView(LaunchpadFormView, FeedsMixin, BugsInfoMixin):
         return BugListingBatchNavigator(
             tasks, self.request, columns_to_show=self.columns_to_show,
             size=config.malone.buglist_batch_size,
-            target_context=self.context)
+            target_context=self.context, approximate_counts=True)
 
     def buildBugTaskSearchParams(self, searchtext=None, extra_params=None):
         """Build the parameters to submit to the `searchTasks` method.
@@ -39,6 +39,7 @@ from lp.bugs.model.bug import Bug
 from lp.bugs.model.buglinktarget import BugLinkTargetMixin
 from lp.bugs.model.cvereference import CveReference
 from lp.services.database import bulk
+from lp.services.database.approximatecount import approximately_counted
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.enumcol import DBEnum
 from lp.services.database.interfaces import IStore
@@ -136,7 +137,8 @@ class CveSet:
 
     def getAll(self):
         """See ICveSet."""
-        return IStore(Cve).find(Cve).order_by(Desc(Cve.datemodified))
+        return approximately_counted(
+            IStore(Cve).find(Cve).order_by(Desc(Cve.datemodified)))
 
     def __iter__(self):
         """See ICveSet."""
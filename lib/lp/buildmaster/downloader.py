@@ -16,27 +16,102 @@ __all__ = [
     'RequestProxyTokenCommand',
     ]
 
+from concurrent import futures
+import gzip
 import os.path
 import tempfile
+import threading
+import time
 
 from ampoule.child import AMPChild
 from requests import (
     RequestException,
     Session,
     )
-from requests_toolbelt.downloadutils import stream
+from requests.exceptions import (
+    ChunkedEncodingError,
+    ConnectionError,
+    Timeout,
+    )
 from requests_toolbelt.exceptions import StreamingError
 from twisted.protocols import amp
 
 
+class IncompleteDownload(RequestException):
+    """The server closed the connection before sending the whole file."""
+
+
+# Errors after which it is worth trying to resume a download.
+RESUMABLE_ERRORS = (
+    ChunkedEncodingError,
+    ConnectionError,
+    IncompleteDownload,
+    Timeout,
+    )
+
+
+class GzipWriter:
+    """Compress data as it is written to a file.
+
+    `RequestProcess._fetchRange` positions every write with `seek`.  A
+    compressed stream can only be written in order, so this supports
+    seeking to the current position, or back to the start to begin again
+    when a server ignores a request to resume.
+    """
+
+    def __init__(self, f, filename):
+        self._f = f
+        self._filename = filename
+        self._start()
+
+    def _start(self):
+        self._f.seek(0)
+        self._f.truncate()
+        self._gzip = gzip.GzipFile(
+            filename=self._filename, mode="wb", fileobj=self._f)
+        self._offset = 0
+
+    def seek(self, offset):
+        if offset == self._offset:
+            return
+        if offset != 0:
+            raise ValueError("Cannot seek within a compressed stream")
+        self._gzip.close()
+        self._start()
+
+    def tell(self):
+        return self._offset
+
+    def truncate(self, size):
+        if size != self._offset:
+            raise ValueError("Cannot truncate a compressed stream")
+
+    def write(self, data):
+        self._gzip.write(data)
+        self._offset += len(data)
+
+    def close(self):
+        """Finish the compressed stream, leaving the file open."""
+        self._gzip.close()
+
+
 class DownloadCommand(amp.Command):
 
     arguments = [
         (b"file_url", amp.Unicode()),
         (b"path_to_write", amp.Unicode()),
         (b"timeout", amp.Integer()),
+        (b"attempts", amp.Integer(optional=True)),
+        (b"segments", amp.Integer(optional=True)),
+        (b"segment_threshold", amp.Integer(optional=True)),
+        (b"compress", amp.Boolean(optional=True)),
+        ]
+    response = [
+        (b"size", amp.Integer(optional=True)),
+        (b"duration", amp.Float(optional=True)),
+        (b"resumes", amp.Integer(optional=True)),
+        (b"segments", amp.Integer(optional=True)),
         ]
-    response = []
     errors = {
         RequestException: b"REQUEST_ERROR",
         StreamingError: b"STREAMING_ERROR",
@@ -63,17 +138,151 @@ class RequestProxyTokenCommand(amp.Command):
 class RequestProcess(AMPChild):
     """A subprocess that performs requests for buildd-manager."""
 
-    @DownloadCommand.responder
-    def downloadCommand(self, file_url, path_to_write, timeout):
+    def _makeSession(self):
         session = Session()
         session.trust_env = False
-        response = session.get(file_url, timeout=timeout, stream=True)
-        response.raise_for_status()
+        return session
+
+    def _fetchRange(self, session, file_url, f, start, end, timeout,
+                    attempts, lock=None):
+        """Fetch part of a file, resuming after transient failures.
+
+        :param f: The file object to write to.  Data is written at the
+            same offsets as in the remote file.
+        :param start: The offset of the first byte to fetch.
+        :param end: The offset just past the last byte to fetch, or None
+            to fetch to the end of the file.
+        :param attempts: The maximum number of requests to make.
+        :param lock: If not None, a lock to hold while writing to `f`;
+            used when several ranges are being fetched in parallel.
+        :return: The number of times the download was resumed.
+        """
+        offset = start
+        resumes = 0
+        while True:
+            # Ranges and Content-Length refer to the encoded body, so ask
+            # for it unencoded; otherwise requests would decode it and
+            # every download would look short.
+            headers = {"Accept-Encoding": "identity"}
+            if offset or end is not None:
+                headers["Range"] = "bytes=%d-%s" % (
+                    offset, "" if end is None else end - 1)
+            try:
+                response = session.get(
+                    file_url, headers=headers, timeout=timeout, stream=True)
+                try:
+                    response.raise_for_status()
+                    expected = response.headers.get("Content-Length")
+                    if response.headers.get(
+                            "Content-Encoding", "identity") != "identity":
+                        # The server encoded the body anyway.  The decoded
+                        # content is only usable if it is the whole file.
+                        if response.status_code == 206:
+                            raise StreamingError(
+                                "%s sent an encoded response to a range "
+                                "request" % file_url)
+                        expected = None
+                    if "Range" in headers and response.status_code != 206:
+                        # The server ignored our Range header.  If we only
+                        # wanted a suffix of the whole file, then we can
+                        # just start again; otherwise give up.
+                        if start != 0 or end is not None:
+                            raise StreamingError(
+                                "%s does not support range requests" %
+                                file_url)
+                        offset = 0
+                    received = 0
+                    for chunk in response.iter_content(
+                            chunk_size=64 * 1024):
+                        if lock is not None:
+                            with lock:
+                                f.seek(offset)
+                                f.write(chunk)
+                        else:
+                            f.seek(offset)
+                            f.write(chunk)
+                        offset += len(chunk)
+                        received += len(chunk)
+                    if expected is not None and received != int(expected):
+                        raise IncompleteDownload(
+                            "%s: expected %s bytes, got %d" % (
+                                file_url, expected, received))
+                    if end is not None and offset != end:
+                        raise IncompleteDownload(
+                            "%s: range ended at %d, expected %d" % (
+                                file_url, offset, end))
+                    if end is None and lock is None:
+                        f.truncate(offset)
+                    return resumes
+                finally:
+                    response.close()
+            except RESUMABLE_ERRORS:
+                resumes += 1
+                if resumes >= attempts:
+                    raise
+
+    def _fetchSegments(self, file_url, f, size, segments, timeout,
+                       attempts):
+        """Fetch a file of known size as several parallel ranges."""
+        f.truncate(size)
+        lock = threading.Lock()
+        segment_size = -(-size // segments)
+        bounds = [
+            (start, min(start + segment_size, size))
+            for start in range(0, size, segment_size)]
+        with futures.ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+            results = [
+                executor.submit(
+                    self._fetchRange, self._makeSession(), file_url, f,
+                    start, end, timeout, attempts, lock=lock)
+                for start, end in bounds]
+            return len(bounds), sum(result.result() for result in results)
+
+    @DownloadCommand.responder
+    def downloadCommand(self, file_url, path_to_write, timeout, attempts=1,
+                        segments=1, segment_threshold=None, compress=False):
+        """Download a file.
+
+        If `compress` is True, the file is written to `path_to_write`
+        compressed with gzip as it arrives, so that it never touches disk
+        uncompressed.  Compressed downloads are not split into segments.
+        The returned size is always that of the file as downloaded.
+        """
+        start_time = time.time()
+        session = self._makeSession()
         f = tempfile.NamedTemporaryFile(
             mode="wb", prefix=os.path.basename(path_to_write) + "_",
             dir=os.path.dirname(path_to_write), delete=False)
         try:
-            stream.stream_response_to_file(response, path=f)
+            used_segments = 1
+            size = None
+            if compress:
+                writer = GzipWriter(f, os.path.basename(path_to_write))
+            else:
+                writer = f
+            if (not compress and segments > 1 and
+                    segment_threshold is not None):
+                response = session.head(
+                    file_url, headers={"Accept-Encoding": "identity"},
+                    timeout=timeout)
+                response.raise_for_status()
+                try:
+                    size = int(response.headers["Content-Length"])
+                except (KeyError, ValueError):
+                    size = None
+                # An empty file has nothing to split.
+                if (size and size >= segment_threshold and
+                        response.headers.get("Accept-Ranges") == "bytes"):
+                    used_segments, resumes = self._fetchSegments(
+                        file_url, f, size, segments, timeout, attempts)
+                else:
+                    size = None
+            if size is None:
+                resumes = self._fetchRange(
+                    session, file_url, writer, 0, None, timeout, attempts)
+                size = writer.tell()
+            if compress:
+                writer.close()
         except Exception:
             f.close()
             os.unlink(f.name)
@@ -81,7 +290,12 @@ class RequestProcess(AMPChild):
         else:
             f.close()
             os.rename(f.name, path_to_write)
-        return {}
+        return {
+            "size": size,
+            "duration": time.time() - start_time,
+            "resumes": resumes,
+            "segments": used_segments,
+            }
 
     @RequestProxyTokenCommand.responder
     def requestProxyTokenCommand(self, url, auth_header, proxy_username):
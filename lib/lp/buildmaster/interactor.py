@@ -125,6 +125,21 @@ def shut_down_default_process_pool():
         _default_process_pool_shutdown = None
 
 
+def describe_download(result):
+    """Summarise the throughput metrics returned by `DownloadCommand`."""
+    size = result.get("size")
+    duration = result.get("duration")
+    if size is None or duration is None:
+        return "no metrics"
+    description = "%d bytes in %.1fs, %.1f KiB/s" % (
+        size, duration, size / 1024.0 / max(duration, 0.001))
+    if result.get("segments", 1) > 1:
+        description += ", %d segments" % result["segments"]
+    if result.get("resumes"):
+        description += ", resumed %d times" % result["resumes"]
+    return description
+
+
 class BuilderSlave(object):
     """Add in a few useful methods for the XMLRPC slave.
 
@@ -225,13 +240,15 @@ class BuilderSlave(object):
         return urlappend(self._file_cache_url, sha1)
 
     @defer.inlineCallbacks
-    def getFile(self, sha_sum, path_to_write, logger=None):
+    def getFile(self, sha_sum, path_to_write, logger=None, compress=False):
         """Fetch a file from the builder.
 
         :param sha_sum: The sha of the file (which is also its name on the
             builder)
         :param path_to_write: A file name to write the file to
         :param logger: An optional logger.
+        :param compress: If True, compress the file with gzip as it is
+            downloaded.
         :return: A Deferred that calls back when the download is done, or
             errback with the error string.
         """
@@ -243,12 +260,19 @@ class BuilderSlave(object):
             # keep up with incoming packets in time to avoid TCP timeouts
             # (perhaps because of too much synchronous work being done on the
             # reactor thread).
-            yield self.process_pool.doWork(
+            result = yield self.process_pool.doWork(
                 DownloadCommand,
                 file_url=file_url, path_to_write=path_to_write,
-                timeout=self.timeout)
+                timeout=self.timeout,
+                attempts=config.builddmaster.download_attempts,
+                segments=config.builddmaster.download_segments,
+                segment_threshold=(
+                    config.builddmaster.download_segment_threshold),
+                compress=compress)
             if logger is not None:
-                logger.info("Grabbed %s" % file_url)
+                logger.info(
+                    "Grabbed %s (%s)" % (
+                        file_url, describe_download(result)))
         except Exception as e:
             if logger is not None:
                 logger.info("Failed to grab %s: %s\n%s" % (
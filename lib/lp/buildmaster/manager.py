@@ -8,6 +8,7 @@ __metaclass__ = type
 __all__ = [
     'BuilddManager',
     'BUILDD_MANAGER_LOG_NAME',
+    'BuilderShard',
     'PrefetchedBuilderFactory',
     'SlaveScanner',
     ]
@@ -15,10 +16,13 @@ __all__ = [
 from collections import defaultdict
 import datetime
 import functools
+import hashlib
 import logging
 
+import pytz
 import six
 from storm.expr import (
+    And,
     Column,
     LeftJoin,
     Table,
@@ -32,6 +36,7 @@ from twisted.internet import (
 from twisted.internet.task import LoopingCall
 from twisted.python import log
 from zope.component import getUtility
+from zope.security.proxy import removeSecurityProxy
 
 from lp.buildmaster.enums import (
     BuilderCleanStatus,
@@ -55,6 +60,7 @@ from lp.buildmaster.interfaces.buildqueue import IBuildQueueSet
 from lp.buildmaster.interfaces.processor import IProcessorSet
 from lp.buildmaster.model.builder import Builder
 from lp.buildmaster.model.buildqueue import BuildQueue
+from lp.services.config import config
 from lp.services.database.bulk import dbify_value
 from lp.services.database.interfaces import IStore
 from lp.services.database.stormexpr import (
@@ -84,7 +90,18 @@ class PrefetchedBuildCandidates:
     by `prefetchForBuilder`.
     """
 
-    def __init__(self, all_vitals):
+    def __init__(self, all_vitals, competitors=1):
+        """Construct a set of build candidates.
+
+        :param all_vitals: The `BuilderVitals` of the builders that this
+            set will find candidates for.
+        :param competitors: The number of build managers that may be
+            trying to acquire the same candidates.  Each builder group
+            prefetches this many candidates per builder, so that there are
+            still some left after the other build managers have taken the
+            best ones.
+        """
+        self.competitors = competitors
         self.builder_groups = defaultdict(list)
         for vitals in all_vitals:
             for builder_group_key in self._getBuilderGroupKeys(vitals):
@@ -128,7 +145,8 @@ class PrefetchedBuildCandidates:
                 builder_group_key,
                 bq_set.findBuildCandidates(
                     processors_by_name[processor_name], virtualized,
-                    len(self.builder_groups[builder_group_key])))
+                    len(self.builder_groups[builder_group_key]) *
+                    self.competitors))
 
     def pop(self, vitals):
         """Return a suitable build candidate for this builder.
@@ -155,10 +173,66 @@ class PrefetchedBuildCandidates:
             return None
 
 
+class BuilderShard:
+    """A subset of the build farm, scanned by one buildd-manager process.
+
+    The build farm may be split between several buildd-manager processes,
+    each of which scans a disjoint shard of builders.  Builders are
+    assigned to shards using a stable hash of either their names or their
+    processors; the latter keeps builders that compete for the same build
+    candidates in the same process.  Every process must use the same
+    `count` and `key`.
+    """
+
+    def __init__(self, index=0, count=1, key="name"):
+        if key not in ("name", "processor"):
+            raise ValueError("Unknown builder shard key: %r" % key)
+        if not 0 <= index < count:
+            raise ValueError(
+                "Builder shard index %d out of range for %d shards" %
+                (index, count))
+        self.index = index
+        self.count = count
+        self.key = key
+
+    @classmethod
+    def fromConfig(cls):
+        """Return the shard configured in `config.builddmaster`."""
+        return cls(
+            index=config.builddmaster.shard_index,
+            count=config.builddmaster.shard_count,
+            key=config.builddmaster.shard_by)
+
+    def _getShardKey(self, vitals):
+        if self.key == "processor":
+            return " ".join(sorted(vitals.processor_names))
+        else:
+            return vitals.name
+
+    def __contains__(self, vitals):
+        """Is the builder described by these `BuilderVitals` in this shard?"""
+        if self.count == 1:
+            return True
+        digest = hashlib.sha1(
+            self._getShardKey(vitals).encode("UTF-8")).hexdigest()
+        return int(digest, 16) % self.count == self.index
+
+
 class BaseBuilderFactory:
 
     date_updated = None
 
+    def __init__(self, shard=None):
+        """Construct a builder factory.
+
+        :param shard: If not None, a `BuilderShard`; only builders in that
+            shard will be returned by `iterVitals`.
+        """
+        self.shard = shard
+
+    def _inShard(self, vitals):
+        return self.shard is None or vitals in self.shard
+
     def update(self):
         """Update the factory's view of the world."""
         raise NotImplementedError
@@ -183,26 +257,48 @@ class BaseBuilderFactory:
         """Find the next build candidate for this `BuilderVitals`, or None."""
         raise NotImplementedError
 
+    @staticmethod
+    def _lockBuildCandidate(candidate):
+        """Lock a build candidate's row, if it is still waiting.
+
+        Candidates whose rows are already locked by another transaction
+        are skipped rather than waited for, so that this never blocks the
+        reactor.
+
+        :return: True if the candidate is now locked by this transaction
+            and may be marked as building, otherwise False.
+        """
+        rows = IStore(BuildQueue).execute(
+            "SELECT status FROM BuildQueue WHERE id = ? "
+            "FOR UPDATE SKIP LOCKED", (candidate.id,)).get_all()
+        return rows == [(BuildQueueStatus.WAITING.value,)]
+
     def acquireBuildCandidate(self, vitals, builder):
         """Acquire and return a build candidate in an atomic fashion.
 
         If we succeed, mark it as building immediately so that it is not
         dispatched to another builder by the build manager.
 
-        We can consider this to be atomic, because although the build
-        manager is a Twisted app and gives the appearance of doing lots of
-        things at once, it's still single-threaded so no more than one
-        builder scan can be in this code at the same time (as long as we
-        don't yield).
-
-        If there's ever more than one build manager running at once, then
-        this code will need some sort of mutex.
+        Within a single build manager this would be atomic even without
+        help from the database: although it is a Twisted app and gives the
+        appearance of doing lots of things at once, it's still
+        single-threaded so no more than one builder scan can be in this
+        code at the same time (as long as we don't yield).  However,
+        several build managers may be running at once, each scanning its
+        own `BuilderShard`, so we lock the candidate's row before marking
+        it as building and move on to the next candidate if another build
+        manager got there first.
         """
-        candidate = self.findBuildCandidate(vitals)
-        if candidate is not None:
-            candidate.markAsBuilding(builder)
-            transaction.commit()
-        return candidate
+        skipped = set()
+        while True:
+            candidate = self.findBuildCandidate(vitals)
+            if candidate is None or candidate.id in skipped:
+                return None
+            if self._lockBuildCandidate(candidate):
+                candidate.markAsBuilding(builder)
+                transaction.commit()
+                return candidate
+            skipped.add(candidate.id)
 
 
 class BuilderFactory(BaseBuilderFactory):
@@ -235,8 +331,10 @@ class BuilderFactory(BaseBuilderFactory):
     def iterVitals(self):
         """See `BaseBuilderFactory`."""
         return (
-            extract_vitals_from_db(b)
-            for b in getUtility(IBuilderSet).__iter__())
+            vitals for vitals in (
+                extract_vitals_from_db(b)
+                for b in getUtility(IBuilderSet).__iter__())
+            if self._inShard(vitals))
 
     def findBuildCandidate(self, vitals):
         """See `BaseBuilderFactory`."""
@@ -266,11 +364,17 @@ class PrefetchedBuilderFactory(BaseBuilderFactory):
             ).find((Builder, BuildQueue)))
         getUtility(IBuilderSet).preloadProcessors(
             [b for b, _ in builders_and_current_bqs])
-        self.vitals_map = dict(
-            (b.name, extract_vitals_from_db(b, bq))
-            for b, bq in builders_and_current_bqs)
+        self.vitals_map = {
+            vitals.name: vitals for vitals in (
+                extract_vitals_from_db(b, bq)
+                for b, bq in builders_and_current_bqs)
+            if self._inShard(vitals)}
+        # Every build manager sees the same best candidates, so with
+        # several shards we need enough spares to cope with losing races
+        # for them in acquireBuildCandidate.
         self.candidates = PrefetchedBuildCandidates(
-            list(self.vitals_map.values()))
+            list(self.vitals_map.values()),
+            competitors=self.shard.count if self.shard is not None else 1)
         transaction.abort()
         self.date_updated = datetime.datetime.utcnow()
 
@@ -519,9 +623,14 @@ class SlaveScanner:
                 failure.getTraceback()))
 
         # Decide if we need to terminate the job or reset/fail the builder.
-        vitals = self.builder_factory.getVitals(self.builder_name)
+        vitals = self.manager.applyPendingBuilderUpdates(
+            self.builder_factory.getVitals(self.builder_name))
         builder = self.builder_factory[self.builder_name]
         try:
+            # Updates queued by earlier scans must be committed along with
+            # our judgement of the failure, or they might later clobber
+            # its outcome.
+            self.manager.claimBuilderUpdates(builder)
             builder.gotFailure()
             labels = {}
             if builder.current_build is not None:
@@ -596,8 +705,7 @@ class SlaveScanner:
         if version is not None:
             version = six.ensure_text(version)
         if version != vitals.version:
-            self.builder_factory[self.builder_name].version = version
-            transaction.commit()
+            self.manager.addBuilderUpdate(vitals, version=version)
 
     @defer.inlineCallbacks
     def scan(self):
@@ -605,8 +713,15 @@ class SlaveScanner:
 
         :return: A Deferred that fires when the scan is complete.
         """
+        # Dispatching checks the builder's clean status in the database,
+        # so a queued change to it must be written first.  That only
+        # happens once per build.  Other queued changes are just overlaid
+        # on our view of the builder, and are still written in bulk.
+        self.manager.flushBuilderUpdates(
+            [self.builder_name], if_changing=["clean_status"])
         self.builder_factory.prescanUpdate()
-        vitals = self.builder_factory.getVitals(self.builder_name)
+        vitals = self.manager.applyPendingBuilderUpdates(
+            self.builder_factory.getVitals(self.builder_name))
         interactor = self.interactor_factory()
         slave = self.slave_factory(vitals)
 
@@ -677,11 +792,11 @@ class SlaveScanner:
                     vitals, builder, slave, self.builder_factory)
                 d.addErrback(functools.partial(self._scanFailed, False))
                 yield d
-                if builder.currentjob is not None:
+                if (builder.currentjob is not None and
+                        vitals.failure_count != 0):
                     # After a successful dispatch we can reset the
                     # failure_count.
-                    builder.resetFailureCount()
-                    transaction.commit()
+                    self.manager.addBuilderUpdate(vitals, failure_count=0)
             else:
                 # Ask the BuilderInteractor to clean the slave. It might
                 # be immediately cleaned on return, in which case we go
@@ -690,10 +805,9 @@ class SlaveScanner:
                 done = yield interactor.cleanSlave(
                     vitals, slave, self.builder_factory)
                 if done:
-                    builder = self.builder_factory[self.builder_name]
-                    builder.setCleanStatus(BuilderCleanStatus.CLEAN)
+                    self.manager.addBuilderUpdate(
+                        vitals, clean_status=BuilderCleanStatus.CLEAN)
                     self.logger.debug('%s has been cleaned.', vitals.name)
-                    transaction.commit()
 
 
 class BuilddManager(service.Service):
@@ -705,17 +819,38 @@ class BuilddManager(service.Service):
     # How often to flush logtail updates, in seconds.
     FLUSH_LOGTAILS_INTERVAL = 15
 
-    def __init__(self, clock=None, builder_factory=None):
+    # How often to flush builder state updates, in seconds.
+    FLUSH_BUILDER_UPDATES_INTERVAL = 15
+
+    # Builder columns that SlaveScanners may update lazily via
+    # `addBuilderUpdate`, with their database types.
+    LAZY_BUILDER_COLUMNS = {
+        "clean_status": (Builder.clean_status, "integer"),
+        "date_clean_status_changed": (
+            Builder.date_clean_status_changed,
+            "timestamp without time zone"),
+        "failure_count": (Builder.failure_count, "integer"),
+        "version": (Builder.version, "text"),
+        }
+
+    # Pending builder update keys that are only written if the builder's
+    # clean status is still "old_clean_status".
+    CLEAN_STATUS_COLUMNS = (
+        "clean_status", "date_clean_status_changed", "old_clean_status")
+
+    def __init__(self, clock=None, builder_factory=None, shard=None):
         # Use the clock if provided, it's so that tests can
         # advance it.  Use the reactor by default.
         if clock is None:
             clock = reactor
         self._clock = clock
         self.builder_slaves = []
-        self.builder_factory = builder_factory or PrefetchedBuilderFactory()
+        self.builder_factory = (
+            builder_factory or PrefetchedBuilderFactory(shard=shard))
         self.logger = self._setupLogger()
         self.current_builders = []
         self.pending_logtails = {}
+        self.pending_builder_updates = {}
         self.statsd_client = getUtility(IStatsdClient)
 
     def _setupLogger(self):
@@ -748,6 +883,9 @@ class BuilddManager(service.Service):
     def scanBuilders(self):
         """Update builders from the database and start new polling loops."""
         self.logger.debug("Refreshing builders from the database.")
+        # Make sure that the refreshed view of the builders includes any
+        # state changes that our scanners have made.
+        self.flushBuilderUpdates()
         try:
             self.builder_factory.update()
             new_builders = self.checkForNewBuilders()
@@ -789,6 +927,149 @@ class BuilddManager(service.Service):
             transaction.abort()
         self.logger.debug("Flushing log tail updates complete.")
 
+    def addBuilderUpdate(self, vitals, **changes):
+        """Queue an update to a builder's state.
+
+        Updates are coalesced and written in bulk by
+        `flushBuilderUpdates`, so that the number of writes the manager
+        makes is roughly independent of the number of builders.  This
+        must only be used for changes that can safely be delayed until
+        the next flush; in particular, anything that protects the
+        isolation of builds must still be committed immediately.
+
+        A change to `clean_status` is only applied if the builder's
+        clean status is still the one in `vitals` when the update is
+        flushed, so that it can't overwrite a change made in the
+        meantime by somebody else.
+
+        :param vitals: The `BuilderVitals` of the builder to update.
+        :param changes: Column names from `LAZY_BUILDER_COLUMNS` mapped to
+            their new values.
+        """
+        unknown = set(changes) - set(self.LAZY_BUILDER_COLUMNS)
+        if unknown:
+            raise AssertionError(
+                "Cannot lazily update Builder.%s" % ", ".join(sorted(unknown)))
+        if "clean_status" in changes:
+            if changes["clean_status"] == vitals.clean_status:
+                del changes["clean_status"]
+            else:
+                changes["date_clean_status_changed"] = datetime.datetime.now(
+                    pytz.UTC)
+        if not changes:
+            return
+        pending = self.pending_builder_updates.setdefault(vitals.name, {})
+        if "clean_status" in changes:
+            pending.setdefault("old_clean_status", vitals.clean_status)
+        pending.update(changes)
+
+    def applyPendingBuilderUpdates(self, vitals):
+        """Return `vitals` with any queued updates to the builder applied.
+
+        Scanners use this to see their own changes without having to flush
+        them first.
+        """
+        changes = self.pending_builder_updates.get(vitals.name)
+        if not changes:
+            return vitals
+        return vitals._replace(**{
+            name: value for name, value in changes.items()
+            if name in vitals._fields})
+
+    def claimBuilderUpdates(self, builder):
+        """Move any queued updates to this builder into the transaction.
+
+        The updates are removed from the queue and set on `builder`, so
+        the caller must commit the current transaction.
+
+        :param builder: The `Builder` Storm object to update.
+        """
+        changes = self.pending_builder_updates.pop(builder.name, None)
+        if not changes:
+            return
+        naked_builder = removeSecurityProxy(builder)
+        old_clean_status = changes.pop("old_clean_status", None)
+        if (old_clean_status is not None and
+                naked_builder.clean_status != old_clean_status):
+            del changes["clean_status"]
+            del changes["date_clean_status_changed"]
+        for name, value in changes.items():
+            setattr(naked_builder, name, value)
+
+    def flushBuilderUpdates(self, builder_names=None, if_changing=None):
+        """Flush pending builder state updates to the database.
+
+        :param builder_names: If not None, only flush updates for these
+            builders.
+        :param if_changing: If not None, only flush updates for builders
+            with pending changes to any of these columns.
+        """
+        if builder_names is None:
+            builder_names = list(self.pending_builder_updates)
+        if if_changing is not None:
+            builder_names = [
+                name for name in builder_names
+                if not set(if_changing).isdisjoint(
+                    self.pending_builder_updates.get(name, ()))]
+        pending_updates = {
+            name: self.pending_builder_updates.pop(name)
+            for name in builder_names
+            if name in self.pending_builder_updates}
+        if not pending_updates:
+            return
+        self.logger.debug("Flushing builder updates.")
+        # Issue one bulk update for each distinct set of changed columns.
+        # In practice there are only a few such sets.  A clean status
+        # change is guarded by the builder's old clean status, so it goes
+        # in an update of its own; the builder's other columns must be
+        # written even if that guard fails.
+        updates_by_columns = defaultdict(list)
+        for name, changes in pending_updates.items():
+            clean_status_changes = {
+                column_name: changes.pop(column_name)
+                for column_name in self.CLEAN_STATUS_COLUMNS
+                if column_name in changes}
+            for group in (changes, clean_status_changes):
+                if group:
+                    updates_by_columns[tuple(sorted(group))].append(
+                        (name, group))
+        try:
+            store = IStore(Builder)
+            for column_names, updates in updates_by_columns.items():
+                new_builders = Table("new_builders")
+                cols = [("name", "text")]
+                rows = [
+                    [dbify_value(Builder.name, name)]
+                    for name, _ in updates]
+                for column_name in column_names:
+                    if column_name == "old_clean_status":
+                        column, db_type = self.LAZY_BUILDER_COLUMNS[
+                            "clean_status"]
+                    else:
+                        column, db_type = self.LAZY_BUILDER_COLUMNS[
+                            column_name]
+                    cols.append((column_name, db_type))
+                    for row, (_, changes) in zip(rows, updates):
+                        row.append(dbify_value(column, changes[column_name]))
+                where = [Builder.name == Column("name", new_builders)]
+                if "old_clean_status" in column_names:
+                    where.append(
+                        Builder.clean_status ==
+                        Column("old_clean_status", new_builders))
+                store.execute(BulkUpdate(
+                    {self.LAZY_BUILDER_COLUMNS[column_name][0]:
+                        Column(column_name, new_builders)
+                     for column_name in column_names
+                     if column_name != "old_clean_status"},
+                    table=Builder,
+                    values=Values(new_builders.name, cols, rows),
+                    where=And(*where)))
+            transaction.commit()
+        except Exception:
+            self.logger.exception("Failure while flushing builder updates:\n")
+            transaction.abort()
+        self.logger.debug("Flushing builder updates complete.")
+
     def _startLoop(self, interval, callback):
         """Schedule `callback` to run every `interval` seconds."""
         loop = LoopingCall(callback)
@@ -805,6 +1086,10 @@ class BuilddManager(service.Service):
         # Schedule bulk flushes for build queue logtail updates.
         self.flush_logtails_loop, self.flush_logtails_deferred = (
             self._startLoop(self.FLUSH_LOGTAILS_INTERVAL, self.flushLogTails))
+        # Schedule bulk flushes for builder state updates.
+        (self.flush_builder_updates_loop,
+         self.flush_builder_updates_deferred) = self._startLoop(
+            self.FLUSH_BUILDER_UPDATES_INTERVAL, self.flushBuilderUpdates)
 
     def stopService(self):
         """Callback for when we need to shut down."""
@@ -813,11 +1098,14 @@ class BuilddManager(service.Service):
         deferreds = [slave.stopping_deferred for slave in self.builder_slaves]
         deferreds.append(self.scan_builders_deferred)
         deferreds.append(self.flush_logtails_deferred)
+        deferreds.append(self.flush_builder_updates_deferred)
 
         self.flush_logtails_loop.stop()
+        self.flush_builder_updates_loop.stop()
         self.scan_builders_loop.stop()
         for slave in self.builder_slaves:
             slave.stopCycle()
+        self.flushBuilderUpdates()
 
         # The 'stopping_deferred's are called back when the loops are
         # stopped, so we can wait on them all at once here before
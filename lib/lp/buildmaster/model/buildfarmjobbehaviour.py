@@ -11,7 +11,6 @@ __all__ = [
 
 from collections import OrderedDict
 from datetime import datetime
-import gzip
 import logging
 import os
 import tempfile
@@ -34,7 +33,6 @@ from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.services.config import config
 from lp.services.helpers import filenameToContentType
 from lp.services.librarian.interfaces import ILibraryFileAliasSet
-from lp.services.librarian.utils import copy_and_close
 from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.services.utils import sanitise_urls
 from lp.services.webapp import canonical_url
@@ -195,36 +193,29 @@ class BuildFarmJobBehaviourBase:
         out_file_fd, out_file_name = tempfile.mkstemp(suffix=".buildlog")
         os.close(out_file_fd)
 
+        # The build log is compressed by the download process as it
+        # arrives, so it only touches local disk once, already compressed.
+        # It can't go straight to the librarian, which needs to know its
+        # size before the upload starts.
+        compress = file_sha1 == 'buildlog'
+        if compress:
+            filename += '.gz'
+
         def got_file(ignored, filename, out_file_name):
             try:
-                # If the requested file is the 'buildlog' compress it
-                # using gzip before storing in Librarian.
-                if file_sha1 == 'buildlog':
-                    out_file = open(out_file_name, 'rb')
-                    filename += '.gz'
-                    out_file_name += '.gz'
-                    gz_file = gzip.GzipFile(out_file_name, mode='wb')
-                    copy_and_close(out_file, gz_file)
-                    os.remove(out_file_name.replace('.gz', ''))
-
-                # Open the file, seek to its end position, count and seek to
-                # beginning, ready for adding to the Librarian.
-                out_file = open(out_file_name, 'rb')
-                out_file.seek(0, 2)
-                bytes_written = out_file.tell()
-                out_file.seek(0)
-
-                library_file = getUtility(ILibraryFileAliasSet).create(
-                    filename, bytes_written, out_file,
-                    contentType=filenameToContentType(filename),
-                    restricted=private)
+                with open(out_file_name, 'rb') as out_file:
+                    bytes_written = os.fstat(out_file.fileno()).st_size
+                    library_file = getUtility(ILibraryFileAliasSet).create(
+                        filename, bytes_written, out_file,
+                        contentType=filenameToContentType(filename),
+                        restricted=private)
             finally:
                 # Remove the temporary file.
                 os.remove(out_file_name)
 
             return library_file.id
 
-        d = self._slave.getFile(file_sha1, out_file_name)
+        d = self._slave.getFile(file_sha1, out_file_name, compress=compress)
         d.addCallback(got_file, filename, out_file_name)
         return d
 
@@ -17,6 +17,7 @@ from lp.buildmaster.interfaces.processor import (
     ProcessorNotFound,
     )
 from lp.services.database.interfaces import IStore
+from lp.services.database.referencecache import ReferenceCache
 from lp.services.database.sqlbase import SQLBase
 
 
@@ -50,10 +51,11 @@ class Processor(SQLBase):
 class ProcessorSet:
     """See `IProcessorSet`."""
 
+    _cache = ReferenceCache(Processor, 'name')
+
     def getByName(self, name):
         """See `IProcessorSet`."""
-        processor = IStore(Processor).find(
-            Processor, Processor.name == name).one()
+        processor = self._cache.get(name)
         if processor is None:
             raise ProcessorNotFound(name)
         return processor
@@ -22,6 +22,7 @@ __all__ = [
     ]
 
 from collections import OrderedDict
+import gzip
 import os
 import sys
 
@@ -52,6 +53,18 @@ def make_publisher():
     return SoyuzTestPublisher()
 
 
+def write_file(file_to_write, content, compress=False):
+    """Write a file as `BuilderSlave.getFile` would."""
+    if isinstance(file_to_write, six.string_types):
+        file_to_write = open(file_to_write, 'wb')
+    with file_to_write:
+        if compress:
+            with gzip.GzipFile(mode='wb', fileobj=file_to_write) as gz_file:
+                gz_file.write(content)
+        else:
+            file_to_write.write(content)
+
+
 class MockBuilder:
     """Emulates a IBuilder class."""
 
@@ -173,13 +186,10 @@ class BuildingSlave(OkSlave):
             'logtail': buildlog,
             })
 
-    def getFile(self, sum, file_to_write):
+    def getFile(self, sum, file_to_write, compress=False):
         self.call_log.append('getFile')
         if sum == "buildlog":
-            if isinstance(file_to_write, six.string_types):
-                file_to_write = open(file_to_write, 'wb')
-            file_to_write.write(b"This is a build log")
-            file_to_write.close()
+            write_file(file_to_write, b"This is a build log", compress)
         return defer.succeed(None)
 
 
@@ -212,18 +222,15 @@ class WaitingSlave(OkSlave):
             'dependencies': self.dependencies,
             })
 
-    def getFile(self, hash, file_to_write):
+    def getFile(self, hash, file_to_write, compress=False):
         self.call_log.append('getFile')
         if hash in self.valid_files:
-            if isinstance(file_to_write, six.string_types):
-                file_to_write = open(file_to_write, 'wb')
             if not self.valid_files[hash]:
                 content = ("This is a %s" % hash).encode("ASCII")
             else:
                 with open(self.valid_files[hash], 'rb') as source:
                     content = source.read()
-            file_to_write.write(content)
-            file_to_write.close()
+            write_file(file_to_write, content, compress)
             self._got_file_record.append(hash)
         return defer.succeed(None)
 
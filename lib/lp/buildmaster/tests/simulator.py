@@ -0,0 +1,474 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A simulated build farm for exercising and benchmarking buildd-manager.
+
+`SimulatedBuildFarm` runs a number of in-process stand-ins for
+launchpad-buildd, each speaking enough of its XML-RPC and file cache
+protocols for `BuilddManager` to dispatch builds to it and collect them
+again.  Builds take a configurable (random) amount of time and fail at a
+configurable rate.
+
+`BuilddManagerBenchmark` runs a real `BuilddManager` against such a farm
+until a given number of builds have been collected, and reports dispatch
+latency, completion-detection latency, reactor lag, and database queries
+per builder scan.  The database side (`Builder` rows pointing at the
+simulated builders, and a queue of builds for them) can be set up with
+`make_build_queue`.  utilities/buildd-manager-benchmark.py runs a
+benchmark of any size against a development database.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'BenchmarkReport',
+    'BuilddManagerBenchmark',
+    'SimulatedBuild',
+    'SimulatedBuildFarm',
+    'SimulatedBuilder',
+    'make_build_queue',
+    'skip_uploads',
+    ]
+
+import random
+
+import fixtures
+from six.moves import xmlrpc_client
+import transaction
+from twisted.internet import (
+    defer,
+    reactor as default_reactor,
+    )
+from twisted.internet.task import LoopingCall
+from twisted.web import (
+    resource,
+    server,
+    static,
+    xmlrpc,
+    )
+
+from lp.buildmaster.enums import BuildStatus
+from lp.buildmaster.manager import (
+    BuilddManager,
+    SlaveScanner,
+    )
+from lp.testing import StormStatementRecorder
+from lp.testing.sampledata import I386_ARCHITECTURE_NAME
+
+
+class SimulatedBuild:
+    """A record of a single build run by a `SimulatedBuilder`.
+
+    All times are in seconds as returned by the simulation's clock.
+    """
+
+    def __init__(self, build_id, date_available, date_dispatched, duration,
+                 status):
+        self.build_id = build_id
+        # When the builder became idle and clean before this build.
+        self.date_available = date_available
+        self.date_dispatched = date_dispatched
+        self.date_finished = date_dispatched + duration
+        self.status = status
+        # When buildd-manager first saw that the build had finished.
+        self.date_detected = None
+        # When buildd-manager cleaned the builder after this build.
+        self.date_cleaned = None
+
+    @property
+    def dispatch_latency(self):
+        """How long the builder sat idle before being given this build."""
+        return self.date_dispatched - self.date_available
+
+    @property
+    def detection_latency(self):
+        """How long it took to notice that this build had finished."""
+        if self.date_detected is None:
+            return None
+        return self.date_detected - self.date_finished
+
+
+class SimulatedBuilder(xmlrpc.XMLRPC):
+    """A stand-in for launchpad-buildd's XML-RPC interface.
+
+    The builder is always in one of the states that buildd-manager
+    understands: IDLE, BUILDING, WAITING (once the current build's
+    duration has elapsed), or back to IDLE after `clean`.
+    """
+
+    def __init__(self, name, arch_tag=I386_ARCHITECTURE_NAME,
+                 durations=(60, 600), failure_rate=0.0, rng=None,
+                 clock=None):
+        xmlrpc.XMLRPC.__init__(self, allowNone=True)
+        self.name = name
+        self.arch_tag = arch_tag
+        self.durations = durations
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.clock = clock or default_reactor
+        self.url = None
+        self.current = None
+        self.builds = []
+        self.date_available = self.clock.seconds()
+
+    @property
+    def builder_status(self):
+        if self.current is None:
+            return 'BuilderStatus.IDLE'
+        elif self.clock.seconds() < self.current.date_finished:
+            return 'BuilderStatus.BUILDING'
+        else:
+            return 'BuilderStatus.WAITING'
+
+    def getBuildLog(self):
+        """Return the build log of the current build."""
+        return ('Simulated build log for %s on %s\n' % (
+            self.current.build_id, self.name)).encode('UTF-8')
+
+    def xmlrpc_echo(self, *args):
+        return args
+
+    def xmlrpc_info(self):
+        return ('1.0', [self.arch_tag], ['binarypackage'])
+
+    def xmlrpc_ensurepresent(self, sha1sum, url, username=None,
+                             password=None):
+        return True, 'Download'
+
+    def xmlrpc_status(self):
+        builder_status = self.builder_status
+        status = {'builder_status': builder_status}
+        if builder_status == 'BuilderStatus.BUILDING':
+            status['build_id'] = self.current.build_id
+            status['logtail'] = xmlrpc_client.Binary(self.getBuildLog())
+        elif builder_status == 'BuilderStatus.WAITING':
+            if self.current.date_detected is None:
+                self.current.date_detected = self.clock.seconds()
+            status['build_id'] = self.current.build_id
+            status['build_status'] = self.current.status
+            status['filemap'] = {}
+            status['dependencies'] = None
+        return status
+
+    def xmlrpc_build(self, build_id, builder_type, chroot_sha1, filemap,
+                     args):
+        if self.current is not None:
+            raise xmlrpc.Fault(8003, '%s is busy' % self.name)
+        if self.rng.random() < self.failure_rate:
+            build_status = 'BuildStatus.PACKAGEFAIL'
+        else:
+            build_status = 'BuildStatus.OK'
+        self.current = SimulatedBuild(
+            build_id, self.date_available, self.clock.seconds(),
+            self.rng.uniform(*self.durations), build_status)
+        self.builds.append(self.current)
+        return 'BuilderStatus.BUILDING', build_id
+
+    def xmlrpc_abort(self):
+        if self.builder_status != 'BuilderStatus.BUILDING':
+            raise xmlrpc.Fault(8002, 'Could not abort')
+        self.current.date_finished = self.clock.seconds()
+        self.current.status = 'BuildStatus.ABORTED'
+        return 'BuilderStatus.ABORTING', self.current.build_id
+
+    def xmlrpc_clean(self):
+        if self.builder_status != 'BuilderStatus.WAITING':
+            raise xmlrpc.Fault(
+                8001, 'Cannot clean %s when %s' % (
+                    self.name, self.builder_status))
+        now = self.clock.seconds()
+        self.current.date_cleaned = now
+        self.current = None
+        self.date_available = now
+        return 'BuilderStatus.IDLE'
+
+
+class SimulatedFileCache(resource.Resource):
+    """The file cache of a `SimulatedBuilder`, which only has build logs."""
+
+    def __init__(self, builder):
+        resource.Resource.__init__(self)
+        self.builder = builder
+
+    def getChild(self, name, request):
+        if (name == b'buildlog' and
+                self.builder.builder_status == 'BuilderStatus.WAITING'):
+            return static.Data(self.builder.getBuildLog(), 'text/plain')
+        return resource.NoResource()
+
+
+class SimulatedBuildFarm(fixtures.Fixture):
+    """A number of `SimulatedBuilder`s, each listening on its own port.
+
+    Builder names and URLs are available from `builders` once the fixture
+    has been set up.
+    """
+
+    def __init__(self, builder_count, arch_tag=I386_ARCHITECTURE_NAME,
+                 durations=(60, 600), failure_rate=0.0, seed=None,
+                 name_prefix='simulated', clock=None):
+        """Construct a `SimulatedBuildFarm`.
+
+        :param builder_count: The number of builders to simulate.
+        :param arch_tag: The architecture tag the builders claim to have.
+        :param durations: A (minimum, maximum) tuple of build durations in
+            seconds; each build takes a uniformly random time in this range.
+        :param failure_rate: The probability that a build fails.
+        :param seed: Seed for the random number generator, for repeatable
+            simulations.
+        :param name_prefix: Prefix for builder names.
+        :param clock: The clock to use for build durations; defaults to the
+            reactor.
+        """
+        super(SimulatedBuildFarm, self).__init__()
+        self.builder_count = builder_count
+        self.arch_tag = arch_tag
+        self.durations = durations
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.name_prefix = name_prefix
+        self.clock = clock or default_reactor
+
+    def _setUp(self):
+        rng = random.Random(self.seed)
+        self.builders = []
+        for i in range(self.builder_count):
+            builder = SimulatedBuilder(
+                '%s-%03d' % (self.name_prefix, i), arch_tag=self.arch_tag,
+                durations=self.durations, failure_rate=self.failure_rate,
+                rng=rng, clock=self.clock)
+            root = resource.Resource()
+            root.putChild(b'rpc', builder)
+            root.putChild(b'filecache', SimulatedFileCache(builder))
+            port = default_reactor.listenTCP(
+                0, server.Site(root), interface='127.0.0.1')
+            self.addCleanup(port.stopListening)
+            builder.url = 'http://127.0.0.1:%d/' % port.getHost().port
+            self.builders.append(builder)
+
+    @property
+    def builds(self):
+        """All builds dispatched so far, in order of dispatch."""
+        return sorted(
+            (build for builder in self.builders for build in builder.builds),
+            key=lambda build: build.date_dispatched)
+
+    @property
+    def cleaned_count(self):
+        """The number of builds that have been collected and cleaned."""
+        return len([
+            build for build in self.builds if build.date_cleaned is not None])
+
+
+def make_build_queue(factory, farm, build_count):
+    """Create `Builder`s for a farm and queue builds for them.
+
+    :param factory: A `LaunchpadObjectFactory`.
+    :param farm: A `SimulatedBuildFarm` that has been set up.
+    :param build_count: The number of builds to queue.
+    :return: A list of the new builds, which have been committed.
+    """
+    das = factory.makeDistroArchSeries()
+    das.addOrUpdateChroot(factory.makeLibraryFileAlias(db_only=True))
+    for simulated in farm.builders:
+        factory.makeBuilder(
+            name=simulated.name, url=simulated.url,
+            processors=[das.processor], virtualized=False)
+    builds = [
+        factory.makeBinaryPackageBuild(distroarchseries=das)
+        for _ in range(build_count)]
+    for build in builds:
+        build.queueBuild()
+    transaction.commit()
+    return builds
+
+
+def skip_uploads():
+    """Return a fixture that stops successful builds being uploaded.
+
+    Simulated builds produce no files worth processing, so they go
+    straight to UPLOADING rather than into the upload queue.
+    """
+    def handleSuccess(self, slave_status, logger):
+        return BuildStatus.UPLOADING
+
+    return fixtures.MonkeyPatch(
+        'lp.soyuz.model.binarypackagebuildbehaviour.'
+        'BinaryPackageBuildBehaviour.handleSuccess', handleSuccess)
+
+
+def summarise(values):
+    """Return the count, mean, median, 95th percentile and maximum."""
+    values = sorted(values)
+    if not values:
+        return 0, None, None, None, None
+    count = len(values)
+    return (
+        count, sum(values) / count, values[count // 2],
+        values[min(count - 1, int(count * 0.95))], values[-1])
+
+
+class BenchmarkReport:
+    """The results of a `BuilddManagerBenchmark` run."""
+
+    def __init__(self, builds, reactor_lags, scan_count, query_count,
+                 elapsed, timed_out):
+        self.builds = builds
+        self.reactor_lags = reactor_lags
+        self.scan_count = scan_count
+        self.query_count = query_count
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def dispatch_latencies(self):
+        return [build.dispatch_latency for build in self.builds]
+
+    @property
+    def detection_latencies(self):
+        return [
+            build.detection_latency for build in self.builds
+            if build.detection_latency is not None]
+
+    @property
+    def queries_per_scan(self):
+        """The mean number of queries per builder scan.
+
+        `scan_count` counts individual `SlaveScanner.scan` calls, so this
+        includes the manager's own periodic queries spread across them.
+        """
+        if not self.scan_count:
+            return None
+        return float(self.query_count) / self.scan_count
+
+    def format(self):
+        """Format the report for humans."""
+        lines = [
+            'Elapsed: %.1fs%s' % (
+                self.elapsed, ' (timed out)' if self.timed_out else ''),
+            'Builds dispatched: %d' % len(self.builds),
+            'Builds collected: %d' % len([
+                build for build in self.builds
+                if build.date_cleaned is not None]),
+            ]
+        for label, values in (
+                ('Dispatch latency', self.dispatch_latencies),
+                ('Detection latency', self.detection_latencies),
+                ('Reactor lag', self.reactor_lags)):
+            count, mean, median, p95, maximum = summarise(values)
+            if count:
+                lines.append(
+                    '%s: n=%d mean=%.3fs median=%.3fs p95=%.3fs '
+                    'max=%.3fs' % (label, count, mean, median, p95, maximum))
+            else:
+                lines.append('%s: n=0' % label)
+        if self.scan_count:
+            lines.append(
+                'Builder scans: %d, queries: %d (%.1f per scan)' % (
+                    self.scan_count, self.query_count, self.queries_per_scan))
+        else:
+            lines.append('Builder scans: 0')
+        return '\n'.join(lines)
+
+
+class BuilddManagerBenchmark:
+    """Run a `BuilddManager` against a `SimulatedBuildFarm`."""
+
+    def __init__(self, farm, scan_interval=1, lag_interval=0.1,
+                 logger=None, clock=None):
+        """Construct a `BuilddManagerBenchmark`.
+
+        :param farm: A `SimulatedBuildFarm` that has been set up.
+        :param scan_interval: The interval in seconds at which to scan each
+            builder and to run the manager's other periodic tasks; this
+            replaces the production intervals so that simulations can use
+            short build durations.
+        :param lag_interval: The interval in seconds at which to sample
+            reactor lag.
+        :param logger: If not None, use this logger for the manager.
+        :param clock: The clock to run the manager with; defaults to the
+            reactor.
+        """
+        self.farm = farm
+        self.scan_interval = scan_interval
+        self.lag_interval = lag_interval
+        self.logger = logger
+        self.clock = clock or default_reactor
+
+    def _patchIntervals(self):
+        """Return fixtures patching the manager to use `scan_interval`."""
+        patches = [
+            fixtures.MonkeyPatch(
+                'lp.buildmaster.manager.SlaveScanner.SCAN_INTERVAL',
+                self.scan_interval),
+            ]
+        for name in (
+                'SCAN_BUILDERS_INTERVAL', 'FLUSH_LOGTAILS_INTERVAL',
+                'FLUSH_BUILDER_UPDATES_INTERVAL'):
+            patches.append(fixtures.MonkeyPatch(
+                'lp.buildmaster.manager.BuilddManager.%s' % name,
+                self.scan_interval))
+        original_scan = SlaveScanner.scan
+
+        def scan(scanner):
+            self.scan_count += 1
+            return original_scan(scanner)
+
+        patches.append(fixtures.MonkeyPatch(
+            'lp.buildmaster.manager.SlaveScanner.scan', scan))
+        return patches
+
+    @defer.inlineCallbacks
+    def run(self, build_count, timeout):
+        """Run the manager until `build_count` builds have been collected.
+
+        :param build_count: The number of builds to wait for.
+        :param timeout: Give up after this many seconds.
+        :return: A Deferred that fires with a `BenchmarkReport`.
+        """
+        self.scan_count = 0
+        reactor_lags = []
+        last_tick = [None]
+        finished = defer.Deferred()
+
+        def tick():
+            now = self.clock.seconds()
+            if last_tick[0] is not None:
+                reactor_lags.append(
+                    max(0, now - last_tick[0] - self.lag_interval))
+            last_tick[0] = now
+            if (self.farm.cleaned_count >= build_count and
+                    not finished.called):
+                finished.callback(False)
+
+        def time_out():
+            if not finished.called:
+                finished.callback(True)
+
+        patches = self._patchIntervals()
+        for patch in patches:
+            patch.setUp()
+        try:
+            with StormStatementRecorder() as recorder:
+                start = self.clock.seconds()
+                manager = BuilddManager(clock=self.clock)
+                if self.logger is not None:
+                    manager.logger = self.logger
+                lag_loop = LoopingCall(tick)
+                lag_loop.clock = self.clock
+                lag_loop.start(self.lag_interval)
+                timeout_call = self.clock.callLater(timeout, time_out)
+                manager.startService()
+                timed_out = yield finished
+                if timeout_call.active():
+                    timeout_call.cancel()
+                elapsed = self.clock.seconds() - start
+                lag_loop.stop()
+                yield manager.stopService()
+        finally:
+            for patch in reversed(patches):
+                patch.cleanUp()
+        defer.returnValue(BenchmarkReport(
+            self.farm.builds, reactor_lags, self.scan_count, recorder.count,
+            elapsed, timed_out))
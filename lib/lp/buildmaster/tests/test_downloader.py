@@ -0,0 +1,242 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test the buildd-manager download subprocess."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+
+import gzip
+import io
+import os.path
+import re
+import threading
+
+from fixtures import TempDir
+from requests import RequestException
+from six.moves.BaseHTTPServer import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+    )
+from testtools.matchers import MatchesRegex
+
+from lp.buildmaster.downloader import RequestProcess
+from lp.testing import TestCase
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+    """Serve `server.content`, optionally cutting off the first responses.
+
+    The server's `truncate` attribute is a list of byte counts; each
+    request consumes one item and sends only that many bytes of the
+    response body before closing the connection.  If the server's `encode`
+    attribute is True, responses for the whole file are gzip-encoded
+    whatever the client asked for.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parseRange(self):
+        content = self.server.content
+        header = self.headers.get("Range")
+        if header is None or not self.server.ranges:
+            return None
+        match = re.match(r"bytes=(\d+)-(\d*)$", header)
+        start = int(match.group(1))
+        end = int(match.group(2)) + 1 if match.group(2) else len(content)
+        return start, end
+
+    def _sendHeaders(self):
+        content = self.server.content
+        self.server.requests.append(self.headers.get("Range"))
+        self.server.accept_encodings.append(
+            self.headers.get("Accept-Encoding"))
+        byte_range = self._parseRange()
+        if byte_range is None:
+            body = content
+            self.send_response(200)
+            if self.server.encode:
+                encoded = io.BytesIO()
+                with gzip.GzipFile(mode="wb", fileobj=encoded) as gz:
+                    gz.write(body)
+                body = encoded.getvalue()
+                self.send_header("Content-Encoding", "gzip")
+        else:
+            start, end = byte_range
+            body = content[start:end]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                "bytes %d-%d/%d" % (start, end - 1, len(content)))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._sendHeaders()
+
+    def do_GET(self):
+        body = self._sendHeaders()
+        with self.server.lock:
+            truncate = (
+                self.server.truncate.pop(0) if self.server.truncate
+                else None)
+        if truncate is not None:
+            body = body[:truncate]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+class TestRequestProcess(TestCase):
+
+    def setUp(self):
+        super(TestRequestProcess, self).setUp()
+        self.tempdir = self.useFixture(TempDir()).path
+
+    def startServer(self, content, truncate=None, ranges=True, encode=False):
+        server = HTTPServer(("127.0.0.1", 0), FlakyFileHandler)
+        server.content = content
+        server.truncate = list(truncate or [])
+        server.ranges = ranges
+        server.encode = encode
+        server.requests = []
+        server.accept_encodings = []
+        server.lock = threading.Lock()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, "http://127.0.0.1:%d/file" % server.server_port
+
+    def download(self, url, **kwargs):
+        path = os.path.join(self.tempdir, "file")
+        result = RequestProcess().downloadCommand(
+            file_url=url, path_to_write=path, timeout=10, **kwargs)
+        with open(path, "rb") as f:
+            return result, f.read()
+
+    def test_download(self):
+        content = b"x" * 100000
+        server, url = self.startServer(content)
+        result, downloaded = self.download(url)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(len(content), result["size"])
+        self.assertEqual(0, result["resumes"])
+        self.assertEqual(1, result["segments"])
+        self.assertEqual([None], server.requests)
+        self.assertEqual(["identity"], server.accept_encodings)
+
+    def test_download_encoded(self):
+        # A server that encodes the whole file even though we asked it
+        # not to is tolerated; the file is stored decoded.
+        content = b"x" * 100000
+        server, url = self.startServer(content, encode=True)
+        result, downloaded = self.download(url)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(len(content), result["size"])
+        self.assertEqual(0, result["resumes"])
+
+    def test_download_empty_segmented(self):
+        # An empty file is fetched with a single request, even if it is
+        # over the segment threshold.
+        server, url = self.startServer(b"")
+        result, downloaded = self.download(
+            url, segments=4, segment_threshold=0)
+        self.assertEqual(b"", downloaded)
+        self.assertEqual(0, result["size"])
+        self.assertEqual(1, result["segments"])
+        self.assertEqual([None], server.requests)
+
+    def test_download_resumes(self):
+        # An interrupted download is resumed from where it left off.
+        content = b"".join(b"%06d" % i for i in range(100000))
+        server, url = self.startServer(content, truncate=[100000, 300000])
+        result, downloaded = self.download(url, attempts=5)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(2, result["resumes"])
+        self.assertEqual(3, len(server.requests))
+        self.assertIsNone(server.requests[0])
+        for request in server.requests[1:]:
+            self.assertThat(request, MatchesRegex(r"bytes=[1-9]\d*-$"))
+
+    def test_download_gives_up(self):
+        # A download that keeps failing eventually fails, and leaves no
+        # partial file behind.
+        server, url = self.startServer(
+            b"x" * 10000, truncate=[100, 100, 100])
+        self.assertRaises(
+            RequestException, self.download, url, attempts=3)
+        self.assertEqual(3, len(server.requests))
+        self.assertEqual([], os.listdir(self.tempdir))
+
+    def test_download_restarts_without_range_support(self):
+        # If the server doesn't support range requests, an interrupted
+        # download is restarted from the beginning.
+        content = b"".join(b"%06d" % i for i in range(20000))
+        server, url = self.startServer(
+            content, truncate=[1000], ranges=False)
+        result, downloaded = self.download(url, attempts=5)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(1, result["resumes"])
+
+    def test_download_segments(self):
+        # Large files may be downloaded using parallel range requests.
+        content = b"".join(b"%06d" % i for i in range(20000))
+        server, url = self.startServer(content)
+        result, downloaded = self.download(
+            url, segments=4, segment_threshold=1000)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(4, result["segments"])
+        self.assertContentEqual(
+            [None, "bytes=0-29999", "bytes=30000-59999",
+             "bytes=60000-89999", "bytes=90000-119999"],
+            server.requests)
+
+    def test_download_segments_below_threshold(self):
+        # Files smaller than the threshold are downloaded in one piece.
+        content = b"x" * 1000
+        server, url = self.startServer(content)
+        result, downloaded = self.download(
+            url, segments=4, segment_threshold=10000)
+        self.assertEqual(content, downloaded)
+        self.assertEqual(1, result["segments"])
+
+    def test_download_compress(self):
+        # A compressed download is written to disk gzipped.
+        content = b"".join(b"%06d" % i for i in range(20000))
+        server, url = self.startServer(content)
+        result, downloaded = self.download(
+            url, segments=4, segment_threshold=1000, compress=True)
+        self.assertEqual(content, gzip.GzipFile(
+            fileobj=io.BytesIO(downloaded)).read())
+        self.assertLess(len(downloaded), len(content))
+        self.assertEqual(len(content), result["size"])
+        # Compressed downloads are never split into segments.
+        self.assertEqual(1, result["segments"])
+        self.assertEqual([None], server.requests)
+
+    def test_download_compress_resumes(self):
+        # An interrupted compressed download carries on compressing from
+        # where it left off.
+        content = b"".join(b"%06d" % i for i in range(100000))
+        server, url = self.startServer(content, truncate=[100000, 300000])
+        result, downloaded = self.download(url, attempts=5, compress=True)
+        self.assertEqual(content, gzip.GzipFile(
+            fileobj=io.BytesIO(downloaded)).read())
+        self.assertEqual(2, result["resumes"])
+
+    def test_download_compress_restarts_without_range_support(self):
+        # If the server doesn't support range requests, an interrupted
+        # compressed download starts again with a new compressed stream.
+        content = b"".join(b"%06d" % i for i in range(20000))
+        server, url = self.startServer(
+            content, truncate=[1000], ranges=False)
+        result, downloaded = self.download(url, attempts=5, compress=True)
+        self.assertEqual(content, gzip.GzipFile(
+            fileobj=io.BytesIO(downloaded)).read())
+        self.assertEqual(1, result["resumes"])
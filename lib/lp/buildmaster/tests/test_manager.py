@@ -37,6 +37,7 @@ from lp.buildmaster.enums import (
 from lp.buildmaster.interactor import (
     BuilderInteractor,
     BuilderSlave,
+    BuilderVitals,
     extract_vitals_from_db,
     shut_down_default_process_pool,
     )
@@ -50,6 +51,7 @@ from lp.buildmaster.manager import (
     BuilddManager,
     BUILDER_FAILURE_THRESHOLD,
     BuilderFactory,
+    BuilderShard,
     JOB_RESET_THRESHOLD,
     judge_failure,
     PrefetchedBuilderFactory,
@@ -181,6 +183,7 @@ class TestSlaveScannerScan(StatsMixin, TestCaseWithFactory):
         switch_dbuser(config.builddmaster.dbuser)
         scanner = self._getScanner()
         yield scanner.scan()
+        scanner.manager.flushBuilderUpdates()
         self.assertEqual(0, builder.failure_count)
         self.assertTrue(builder.currentjob is not None)
 
@@ -574,6 +577,31 @@ class TestSlaveScannerScan(StatsMixin, TestCaseWithFactory):
         self.assertEqual(1, builder.failure_count)
         self.assertEqual(BuilderCleanStatus.DIRTY, builder.clean_status)
 
+    @defer.inlineCallbacks
+    def test_scanFailed_claims_pending_updates(self):
+        # A queued failure count reset is committed before the failure is
+        # counted, rather than flushed later over the top of it.
+        slave = OkSlave()
+        slave.resume = lambda: deferLater(
+            reactor, 0, defer.fail, Failure(('out', 'err', 1)))
+        builder = removeSecurityProxy(
+            getUtility(IBuilderSet)[BOB_THE_BUILDER_NAME])
+        self._resetBuilder(builder)
+        builder.setCleanStatus(BuilderCleanStatus.DIRTY)
+        builder.virtualized = True
+        builder.vm_host = "fake_vm_host"
+        builder.failure_count = 3
+        self.patch(BuilderSlave, 'makeBuilderSlave', FakeMethod(slave))
+        transaction.commit()
+        scanner = self._getScanner()
+        scanner.manager.addBuilderUpdate(
+            extract_vitals_from_db(builder), failure_count=0)
+
+        yield scanner.singleCycle()
+
+        self.assertEqual({}, scanner.manager.pending_builder_updates)
+        self.assertEqual(1, builder.failure_count)
+
     @defer.inlineCallbacks
     def test_isolation_error_means_death(self):
         # Certain failures immediately kill both the job and the
@@ -605,6 +633,29 @@ class TestSlaveScannerScan(StatsMixin, TestCaseWithFactory):
         self.patch(BuilderSlave, 'makeBuilderSlave', FakeMethod(slave))
         scanner = self._getScanner()
         yield scanner.scan()
+        scanner.manager.flushBuilderUpdates()
+        self.assertEqual("100", builder.version)
+
+    @defer.inlineCallbacks
+    def test_scan_does_not_flush_routine_updates(self):
+        # Scanning a builder doesn't flush its queued version update; the
+        # scanner sees it anyway, so doesn't queue it again.
+        slave = OkSlave(version=six.ensure_str("100"))
+        builder = getUtility(IBuilderSet)[BOB_THE_BUILDER_NAME]
+        builder.version = "99"
+        builder.manual = True
+        self._resetBuilder(builder)
+        self.patch(BuilderSlave, 'makeBuilderSlave', FakeMethod(slave))
+        scanner = self._getScanner()
+        with mock.patch.object(
+                scanner.manager, "addBuilderUpdate",
+                wraps=scanner.manager.addBuilderUpdate) as add_update:
+            yield scanner.scan()
+            yield scanner.scan()
+        transaction.abort()
+        self.assertEqual("99", builder.version)
+        self.assertEqual(1, add_update.call_count)
+        scanner.manager.flushBuilderUpdates()
         self.assertEqual("100", builder.version)
 
     def test_updateVersion_no_op(self):
@@ -723,6 +774,7 @@ class TestSlaveScannerWithLibrarian(TestCaseWithFactory):
         self.assertEqual(BuilderCleanStatus.DIRTY, builder.clean_status)
         yield scanner.scan()
         self.assertEqual(['resume', 'echo'], get_slave.result.method_log)
+        scanner.manager.flushBuilderUpdates()
         self.assertEqual(BuilderCleanStatus.CLEAN, builder.clean_status)
         self.assertIs(None, builder.currentjob)
 
@@ -773,6 +825,7 @@ class TestSlaveScannerWithLibrarian(TestCaseWithFactory):
         yield scanner.scan()
         self.assertEqual(['resume', 'echo'], get_slave.result.method_log)
         self.assertIs(None, builder.currentjob)
+        scanner.manager.flushBuilderUpdates()
         self.assertEqual(BuilderCleanStatus.CLEAN, builder.clean_status)
 
         # Now we can go round the loop again with a second build.  (We only
@@ -922,15 +975,177 @@ class TestPrefetchedBuilderFactory(TestCaseWithFactory):
             pbf.getVitals(builder.name), builder)
         self.assertEqual(BuildQueueStatus.RUNNING, candidate.status)
 
+    def test_acquireBuildCandidate_skips_acquired(self):
+        # If another build manager has acquired a candidate since we
+        # prefetched it, acquireBuildCandidate moves on to the next one.
+        das = self.factory.makeDistroArchSeries()
+        builders = [
+            self.factory.makeBuilder(
+                processors=[das.processor], virtualized=False)
+            for _ in range(2)]
+        for _ in range(2):
+            self.factory.makeBinaryPackageBuild(
+                distroarchseries=das).queueBuild()
+        transaction.commit()
+        pbf0 = PrefetchedBuilderFactory()
+        pbf0.update()
+        pbf1 = PrefetchedBuilderFactory()
+        pbf1.update()
+
+        candidate0 = pbf0.acquireBuildCandidate(
+            pbf0.getVitals(builders[0].name), builders[0])
+        candidate1 = pbf1.acquireBuildCandidate(
+            pbf1.getVitals(builders[1].name), builders[1])
+        self.assertIsNotNone(candidate1)
+        self.assertNotEqual(candidate0, candidate1)
+        self.assertEqual(builders[0], candidate0.builder)
+        self.assertEqual(builders[1], candidate1.builder)
+        # There's nothing left for a third attempt.
+        self.assertIsNone(pbf1.acquireBuildCandidate(
+            pbf1.getVitals(builders[1].name), builders[1]))
+
+    def test_prefetch_shard(self):
+        # With several shards, each build manager prefetches enough
+        # candidates for its builders to lose races to the other managers.
+        das = self.factory.makeDistroArchSeries()
+        builder = self.factory.makeBuilder(
+            processors=[das.processor], virtualized=False)
+        for _ in range(5):
+            self.factory.makeBinaryPackageBuild(
+                distroarchseries=das).queueBuild()
+        transaction.commit()
+        vitals = BuilderFactory().getVitals(builder.name)
+        [shard] = [
+            shard for shard in (
+                BuilderShard(index=index, count=3) for index in range(3))
+            if vitals in shard]
+        pbf = PrefetchedBuilderFactory(shard=shard)
+        pbf.update()
+        pbf.candidates.prefetchForBuilder(pbf.getVitals(builder.name))
+        self.assertEqual(
+            3, len(pbf.candidates.candidates[(das.processor.name, False)]))
+
+    def test_acquireBuildCandidate_shards_compete(self):
+        # Build managers for different shards prefetch the same best
+        # candidates, but each still finds a build for its builder.
+        das = self.factory.makeDistroArchSeries()
+        shards = [BuilderShard(index=index, count=2) for index in range(2)]
+        builders = []
+        for shard in shards:
+            while True:
+                builder = self.factory.makeBuilder(
+                    processors=[das.processor], virtualized=False)
+                if extract_vitals_from_db(builder) in shard:
+                    builders.append(builder)
+                    break
+        for _ in range(2):
+            self.factory.makeBinaryPackageBuild(
+                distroarchseries=das).queueBuild()
+        transaction.commit()
+        pbfs = [PrefetchedBuilderFactory(shard=shard) for shard in shards]
+        for pbf in pbfs:
+            pbf.update()
+
+        candidates = [
+            pbf.acquireBuildCandidate(pbf.getVitals(builder.name), builder)
+            for pbf, builder in zip(pbfs, builders)]
+        self.assertNotIn(None, candidates)
+        self.assertNotEqual(candidates[0], candidates[1])
+
+    def test_iterVitals_shard(self):
+        # A factory for a BuilderShard only knows about the builders in
+        # that shard.
+        builder_names = set(
+            self.factory.makeBuilder().name for _ in range(10))
+        transaction.commit()
+        all_names = set(
+            vitals.name for vitals in BuilderFactory().iterVitals())
+        shard_names = []
+        for index in range(3):
+            shard = BuilderShard(index=index, count=3)
+            pbf = PrefetchedBuilderFactory(shard=shard)
+            pbf.update()
+            names = set(vitals.name for vitals in pbf.iterVitals())
+            self.assertEqual(
+                names,
+                set(vitals.name for vitals in BuilderFactory(
+                    shard=shard).iterVitals()))
+            shard_names.append(names)
+        self.assertTrue(builder_names.issubset(all_names))
+        self.assertEqual(all_names, set.union(*shard_names))
+        self.assertEqual(
+            len(all_names), sum(len(names) for names in shard_names))
+
+
+class TestBuilderShard(TestCase):
+
+    def makeVitals(self, name, processor_names):
+        return BuilderVitals(
+            name, None, processor_names, False, None, None, True, False,
+            None, None, None, True, 0)
+
+    def test_single_shard(self):
+        # With a single shard, every builder is in it.
+        shard = BuilderShard()
+        self.assertIn(self.makeVitals("builder", ["386"]), shard)
+
+    def test_by_name(self):
+        # Sharding by name puts each builder in exactly one shard.
+        shards = [BuilderShard(index=index, count=4) for index in range(4)]
+        for i in range(20):
+            vitals = self.makeVitals("builder-%d" % i, ["386"])
+            self.assertEqual(
+                1, len([shard for shard in shards if vitals in shard]))
+
+    def test_by_processor(self):
+        # Sharding by processor puts builders with the same processors in
+        # the same shard.
+        shards = [
+            BuilderShard(index=index, count=4, key="processor")
+            for index in range(4)]
+        for processor_names in (["386"], ["amd64", "386"], ["arm64"]):
+            shards_for_processors = set()
+            for i in range(5):
+                vitals = self.makeVitals("builder-%d" % i, processor_names)
+                [shard] = [shard for shard in shards if vitals in shard]
+                shards_for_processors.add(shard)
+            self.assertEqual(1, len(shards_for_processors))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, BuilderShard, index=2, count=2)
+        self.assertRaises(ValueError, BuilderShard, key="colour")
+
+    def test_fromConfig(self):
+        self.pushConfig(
+            "builddmaster", shard_count=3, shard_index=1,
+            shard_by="processor")
+        shard = BuilderShard.fromConfig()
+        self.assertEqual(
+            (1, 3, "processor"), (shard.index, shard.count, shard.key))
+
 
 class FakeBuilddManager:
     """A minimal fake version of `BuilddManager`."""
 
     pending_logtails = {}
+    pending_builder_updates = {}
 
     def addLogTail(self, build_queue_id, logtail):
         self.pending_logtails[build_queue_id] = logtail
 
+    def addBuilderUpdate(self, vitals, **changes):
+        self.pending_builder_updates.setdefault(vitals.name, {}).update(
+            changes)
+
+    def applyPendingBuilderUpdates(self, vitals):
+        return vitals
+
+    def claimBuilderUpdates(self, builder):
+        pass
+
+    def flushBuilderUpdates(self, builder_names=None, if_changing=None):
+        pass
+
 
 class TestSlaveScannerWithoutDB(TestCase):
 
@@ -1254,6 +1469,198 @@ class TestBuilddManager(TestCase):
         clock.advance(advance)
         self.assertNotEqual(0, manager.flushLogTails.call_count)
 
+    def test_startService_adds_flushBuilderUpdates_loop(self):
+        # When startService is called, the manager will start up a
+        # flushBuilderUpdates loop.
+        self._stub_out_scheduleNextScanCycle()
+        clock = task.Clock()
+        manager = BuilddManager(clock=clock)
+
+        # Replace flushBuilderUpdates() with FakeMethod so we can see if it
+        # was called.
+        manager.flushBuilderUpdates = FakeMethod()
+
+        manager.startService()
+        advance = BuilddManager.FLUSH_BUILDER_UPDATES_INTERVAL + 1
+        clock.advance(advance)
+        self.assertNotEqual(0, manager.flushBuilderUpdates.call_count)
+
+
+class TestBuilderUpdates(TestCaseWithFactory):
+    """Test batching of builder state updates by `BuilddManager`."""
+
+    layer = ZopelessDatabaseLayer
+
+    def makeManager(self):
+        manager = BuilddManager(builder_factory=BuilderFactory())
+        manager.logger = BufferLogger()
+        return manager
+
+    def test_updates_are_deferred(self):
+        # addBuilderUpdate doesn't touch the database; flushBuilderUpdates
+        # writes the pending changes.
+        builder = self.factory.makeBuilder()
+        builder.version = "1"
+        transaction.commit()
+        manager = self.makeManager()
+        with StormStatementRecorder() as recorder:
+            manager.addBuilderUpdate(
+                extract_vitals_from_db(builder), version="2")
+        self.assertThat(recorder, HasQueryCount(Equals(0)))
+        self.assertEqual("1", builder.version)
+        manager.flushBuilderUpdates()
+        self.assertEqual("2", builder.version)
+        self.assertEqual({}, manager.pending_builder_updates)
+
+    def test_flush_query_count(self):
+        # Updates to any number of builders are flushed using one query
+        # for each distinct set of changed columns.
+        builders = [self.factory.makeBuilder() for _ in range(10)]
+        for builder in builders:
+            builder.failure_count = 2
+        transaction.commit()
+        manager = self.makeManager()
+        for i, builder in enumerate(builders):
+            vitals = extract_vitals_from_db(builder)
+            if i % 2:
+                manager.addBuilderUpdate(vitals, version="%d" % i)
+            else:
+                manager.addBuilderUpdate(vitals, failure_count=0)
+        with StormStatementRecorder() as recorder:
+            manager.flushBuilderUpdates()
+        self.assertThat(recorder, HasQueryCount(Equals(2)))
+        for i, builder in enumerate(builders):
+            if i % 2:
+                self.assertEqual("%d" % i, builder.version)
+                self.assertEqual(2, builder.failure_count)
+            else:
+                self.assertEqual(0, builder.failure_count)
+
+    def test_flush_selected_builders(self):
+        # flushBuilderUpdates can be restricted to particular builders.
+        builders = [self.factory.makeBuilder() for _ in range(2)]
+        transaction.commit()
+        manager = self.makeManager()
+        for builder in builders:
+            manager.addBuilderUpdate(
+                extract_vitals_from_db(builder), version="2")
+        manager.flushBuilderUpdates([builders[0].name])
+        self.assertEqual("2", builders[0].version)
+        self.assertIsNone(builders[1].version)
+        self.assertEqual(
+            [builders[1].name], list(manager.pending_builder_updates))
+
+    def test_clean_status(self):
+        # Changing the clean status also records when it changed.
+        builder = self.factory.makeBuilder()
+        builder.setCleanStatus(BuilderCleanStatus.DIRTY)
+        transaction.commit()
+        old_date = builder.date_clean_status_changed
+        manager = self.makeManager()
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builder),
+            clean_status=BuilderCleanStatus.CLEAN)
+        manager.flushBuilderUpdates()
+        self.assertEqual(BuilderCleanStatus.CLEAN, builder.clean_status)
+        self.assertNotEqual(old_date, builder.date_clean_status_changed)
+
+    def test_clean_status_changed_meanwhile(self):
+        # A queued clean status change is dropped if the builder's clean
+        # status has changed since the scanner looked at it.
+        builder = self.factory.makeBuilder()
+        builder.setCleanStatus(BuilderCleanStatus.CLEANING)
+        transaction.commit()
+        manager = self.makeManager()
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builder),
+            clean_status=BuilderCleanStatus.CLEAN)
+        builder.setCleanStatus(BuilderCleanStatus.DIRTY)
+        transaction.commit()
+        manager.flushBuilderUpdates()
+        self.assertEqual(BuilderCleanStatus.DIRTY, builder.clean_status)
+
+    def test_clean_status_changed_meanwhile_other_columns(self):
+        # If a queued clean status change is dropped, other changes
+        # queued for the same builder are still written.
+        builder = self.factory.makeBuilder()
+        builder.setCleanStatus(BuilderCleanStatus.CLEANING)
+        builder.failure_count = 2
+        transaction.commit()
+        manager = self.makeManager()
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builder),
+            clean_status=BuilderCleanStatus.CLEAN, failure_count=0,
+            version="2")
+        builder.setCleanStatus(BuilderCleanStatus.DIRTY)
+        transaction.commit()
+        manager.flushBuilderUpdates()
+        self.assertEqual(BuilderCleanStatus.DIRTY, builder.clean_status)
+        self.assertEqual(0, builder.failure_count)
+        self.assertEqual("2", builder.version)
+
+    def test_flush_if_changing(self):
+        # flushBuilderUpdates can be restricted to builders with pending
+        # changes to particular columns.
+        builders = [self.factory.makeBuilder() for _ in range(2)]
+        for builder in builders:
+            builder.setCleanStatus(BuilderCleanStatus.CLEANING)
+        transaction.commit()
+        manager = self.makeManager()
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builders[0]), version="2")
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builders[1]),
+            clean_status=BuilderCleanStatus.CLEAN)
+        manager.flushBuilderUpdates(if_changing=["clean_status"])
+        self.assertIsNone(builders[0].version)
+        self.assertEqual(BuilderCleanStatus.CLEAN, builders[1].clean_status)
+        self.assertEqual(
+            [builders[0].name], list(manager.pending_builder_updates))
+
+    def test_applyPendingBuilderUpdates(self):
+        # Scanners can see their queued changes without flushing them.
+        builder = self.factory.makeBuilder()
+        builder.failure_count = 2
+        transaction.commit()
+        manager = self.makeManager()
+        vitals = extract_vitals_from_db(builder)
+        self.assertIs(vitals, manager.applyPendingBuilderUpdates(vitals))
+        manager.addBuilderUpdate(vitals, version="2", failure_count=0)
+        with StormStatementRecorder() as recorder:
+            updated_vitals = manager.applyPendingBuilderUpdates(vitals)
+        self.assertThat(recorder, HasQueryCount(Equals(0)))
+        self.assertEqual(
+            ("2", 0), (updated_vitals.version, updated_vitals.failure_count))
+        self.assertEqual(2, builder.failure_count)
+
+    def test_claimBuilderUpdates(self):
+        # claimBuilderUpdates moves a builder's queued changes into the
+        # current transaction, still respecting a conditional clean status
+        # change.
+        builder = self.factory.makeBuilder()
+        builder.failure_count = 2
+        builder.setCleanStatus(BuilderCleanStatus.CLEANING)
+        transaction.commit()
+        manager = self.makeManager()
+        manager.addBuilderUpdate(
+            extract_vitals_from_db(builder), failure_count=0,
+            clean_status=BuilderCleanStatus.CLEAN)
+        builder.setCleanStatus(BuilderCleanStatus.DIRTY)
+        transaction.commit()
+        manager.claimBuilderUpdates(builder)
+        self.assertEqual({}, manager.pending_builder_updates)
+        transaction.commit()
+        self.assertEqual(0, builder.failure_count)
+        self.assertEqual(BuilderCleanStatus.DIRTY, builder.clean_status)
+
+    def test_unknown_column(self):
+        # Only some columns may be updated lazily.
+        builder = self.factory.makeBuilder()
+        manager = self.makeManager()
+        self.assertRaises(
+            AssertionError, manager.addBuilderUpdate,
+            extract_vitals_from_db(builder), builderok=False)
+
 
 class TestFailureAssessments(TestCaseWithFactory):
 
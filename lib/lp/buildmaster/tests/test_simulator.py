@@ -0,0 +1,101 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Run buildd-manager against a simulated build farm."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+
+from testtools.content import text_content
+from testtools.twistedsupport import AsynchronousDeferredRunTest
+import transaction
+from twisted.internet import defer
+from zope.component import getUtility
+
+from lp.buildmaster.enums import BuildStatus
+from lp.buildmaster.interactor import (
+    BuilderSlave,
+    shut_down_default_process_pool,
+    )
+from lp.buildmaster.interfaces.builder import IBuilderSet
+from lp.buildmaster.tests.simulator import (
+    BuilddManagerBenchmark,
+    make_build_queue,
+    SimulatedBuildFarm,
+    skip_uploads,
+    )
+from lp.services.config import config
+from lp.services.log.logger import BufferLogger
+from lp.testing import TestCaseWithFactory
+from lp.testing.layers import LaunchpadZopelessLayer
+
+
+class TestSimulatedBuilder(TestCaseWithFactory):
+
+    layer = LaunchpadZopelessLayer
+    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=30)
+
+    def setUp(self):
+        super(TestSimulatedBuilder, self).setUp()
+        self.addCleanup(shut_down_default_process_pool)
+
+    @defer.inlineCallbacks
+    def test_build_cycle(self):
+        # A simulated builder goes through the same states as a real one.
+        farm = self.useFixture(SimulatedBuildFarm(1, durations=(0, 0)))
+        simulated = farm.builders[0]
+        slave = BuilderSlave.makeBuilderSlave(
+            simulated.url, None, config.builddmaster.socket_timeout)
+        status = yield slave.status()
+        self.assertEqual('BuilderStatus.IDLE', status['builder_status'])
+        yield slave.build('1-1', 'binarypackage', 'chroot', {}, {})
+        status = yield slave.status()
+        self.assertEqual('BuilderStatus.WAITING', status['builder_status'])
+        self.assertEqual('BuildStatus.OK', status['build_status'])
+        self.assertEqual('1-1', status['build_id'])
+        yield slave.clean()
+        status = yield slave.status()
+        self.assertEqual('BuilderStatus.IDLE', status['builder_status'])
+        [build] = farm.builds
+        self.assertIsNotNone(build.detection_latency)
+        self.assertIsNotNone(build.date_cleaned)
+
+
+class TestBuilddManagerBenchmark(TestCaseWithFactory):
+
+    layer = LaunchpadZopelessLayer
+    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=60)
+
+    def setUp(self):
+        super(TestBuilddManagerBenchmark, self).setUp()
+        self.addCleanup(shut_down_default_process_pool)
+        # Keep the sampledata builders out of the way.
+        for builder in getUtility(IBuilderSet):
+            builder.builderok = False
+        self.useFixture(skip_uploads())
+
+    @defer.inlineCallbacks
+    def test_benchmark(self):
+        # BuilddManagerBenchmark dispatches and collects all the queued
+        # builds, and reports on how well the manager did.  Use
+        # utilities/buildd-manager-benchmark.py for real benchmarks.
+        farm = self.useFixture(SimulatedBuildFarm(
+            3, durations=(0.5, 1.5), failure_rate=0.3, seed=1))
+        builds = make_build_queue(self.factory, farm, 6)
+        benchmark = BuilddManagerBenchmark(
+            farm, scan_interval=0.2, logger=BufferLogger())
+        report = yield benchmark.run(len(builds), timeout=50)
+        self.addDetail('benchmark', text_content(report.format()))
+        self.assertFalse(report.timed_out)
+        self.assertEqual(6, len(report.builds))
+        self.assertEqual(6, len(report.dispatch_latencies))
+        self.assertEqual(6, len(report.detection_latencies))
+        self.assertNotEqual([], report.reactor_lags)
+        self.assertGreater(report.scan_count, 0)
+        self.assertGreater(report.queries_per_scan, 0)
+        transaction.abort()
+        for build in builds:
+            self.assertIn(
+                build.status,
+                (BuildStatus.UPLOADING, BuildStatus.FAILEDTOBUILD))
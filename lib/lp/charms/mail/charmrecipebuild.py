@@ -8,7 +8,6 @@ __all__ = [
     "CharmRecipeBuildMailer",
     ]
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.services.config import config
 from lp.services.mail.basemailer import (
     BaseMailer,
@@ -69,6 +68,7 @@ class CharmRecipeBuildMailer(BaseMailer):
             "upload_log_url": "",
             })
         if build.duration is not None:
+            from lp.app.browser.tales import DurationFormatterAPI
             duration_formatter = DurationFormatterAPI(build.duration)
             params["build_duration"] = duration_formatter.approximateduration()
         if build.log is not None:
@@ -419,7 +419,8 @@ class BranchListingBatchNavigator(TableBatchNavigator,
         TableBatchNavigator.__init__(
             self, view.getVisibleBranchesForUser(), view.request,
             columns_to_show=view.extra_columns,
-            size=config.launchpad.branchlisting_batch_size)
+            size=config.launchpad.branchlisting_batch_size,
+            approximate_counts=True)
         BranchListingItemsMixin.__init__(self, view.user)
         self.view = view
         self.column_count = 4 + len(view.extra_columns)
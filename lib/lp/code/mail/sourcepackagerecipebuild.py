@@ -8,7 +8,6 @@ __all__ = [
     ]
 
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.services.config import config
 from lp.services.mail.basemailer import (
     BaseMailer,
@@ -74,6 +73,7 @@ class SourcePackageRecipeBuildMailer(BaseMailer):
         if self.build.builder is not None:
             params['builder_url'] = canonical_url(self.build.builder)
         if self.build.duration is not None:
+            from lp.app.browser.tales import DurationFormatterAPI
             duration_formatter = DurationFormatterAPI(self.build.duration)
             params['duration'] = duration_formatter.approximateduration()
         if self.build.log is not None:
@@ -262,7 +262,10 @@ from lp.services.webapp.authorization import (
     check_permission,
     precache_permission_for_objects,
     )
-from lp.services.webapp.batching import BatchNavigator
+from lp.services.webapp.batching import (
+    BatchNavigator,
+    StormRangeFactory,
+    )
 from lp.services.webapp.breadcrumb import DisplaynameBreadcrumb
 from lp.services.webapp.interfaces import (
     ILaunchBag,
@@ -3514,7 +3517,11 @@ class PersonRelatedSoftwareView(LaunchpadView):
         This method creates the BatchNavigator and converts its
         results batch into a list of decorated sourcepackagereleases.
         """
-        self.batchnav = BatchNavigator(packages, self.request)
+        self.batchnav = BatchNavigator(
+            packages, self.request,
+            range_factory=StormRangeFactory(
+                packages, approximate_counts=True),
+            approximate_counts=True)
         packages_batch = list(self.batchnav.currentBatch())
         self.batch = self._addStatsToPackages(packages_batch)
 
@@ -3558,7 +3565,11 @@ class PersonPPAPackagesView(PersonRelatedSoftwareView):
         # to filter like this, but as the comment in filterPPAPackage() says,
         # it's very hard to write the SQL for the original query.
         packages = self.context.getLatestUploadedPPAPackages()
-        self.batchnav = BatchNavigator(packages, self.request)
+        self.batchnav = BatchNavigator(
+            packages, self.request,
+            range_factory=StormRangeFactory(
+                packages, approximate_counts=True),
+            approximate_counts=True)
         packages_batch = list(self.batchnav.currentBatch())
         packages_batch = self.filterPPAPackageList(packages_batch)
         self.batch = self._addStatsToPackages(packages_batch)
@@ -3583,7 +3594,11 @@ class PersonSynchronisedPackagesView(PersonRelatedSoftwareView):
         This method creates the BatchNavigator and converts its
         results batch into a list of decorated sourcepackagepublishinghistory.
         """
-        self.batchnav = BatchNavigator(publishings, self.request)
+        self.batchnav = BatchNavigator(
+            publishings, self.request,
+            range_factory=StormRangeFactory(
+                publishings, approximate_counts=True),
+            approximate_counts=True)
         publishings_batch = list(self.batchnav.currentBatch())
         self.batch = self._addStatsToPublishings(publishings_batch)
 
@@ -6,12 +6,14 @@ from __future__ import unicode_literals
 
 __metaclass__ = type
 
+from datetime import datetime
 import doctest
 from operator import attrgetter
 import re
 from textwrap import dedent
 
 from fixtures import FakeLogger
+import pytz
 import six
 from six.moves.urllib.parse import urljoin
 import soupmatchers
@@ -68,10 +70,12 @@ from lp.registry.interfaces.teammembership import (
     )
 from lp.registry.model.karma import KarmaCategory
 from lp.registry.model.milestone import milestone_sort_key
+from lp.registry.model.person import Person
 from lp.scripts.garbo import PopulateLatestPersonSourcePackageReleaseCache
 from lp.services.compat import message_from_bytes
 from lp.services.config import config
 from lp.services.database.interfaces import IStore
+from lp.services.database.sqlbase import convert_storm_clause_to_string
 from lp.services.features.testing import FeatureFixture
 from lp.services.identity.interfaces.account import AccountStatus
 from lp.services.identity.interfaces.emailaddress import IEmailAddressSet
@@ -83,6 +87,7 @@ from lp.services.verification.interfaces.authtoken import LoginTokenType
 from lp.services.verification.interfaces.logintoken import ILoginTokenSet
 from lp.services.verification.tests.logintoken import get_token_url_from_email
 from lp.services.webapp import canonical_url
+from lp.services.webapp.batching import StormRangeFactory
 from lp.services.webapp.escaping import html_escape
 from lp.services.webapp.interfaces import ILaunchBag
 from lp.services.webapp.publisher import RedirectionView
@@ -94,6 +99,7 @@ from lp.soyuz.enums import (
     PackagePublishingStatus,
     )
 from lp.soyuz.interfaces.livefs import LIVEFS_FEATURE_FLAG
+from lp.soyuz.model.reporting import LatestPersonSourcePackageReleaseCache
 from lp.soyuz.tests.test_publishing import SoyuzTestPublisher
 from lp.testing import (
     ANONYMOUS,
@@ -1389,6 +1395,73 @@ class TestPersonPPAPackagesView(TestCaseWithFactory):
             self.view.max_results_to_display)
 
 
+class TestPersonRelatedPackagesBatching(TestCaseWithFactory):
+    """Test that the related packages listings are batched by memo."""
+
+    layer = LaunchpadFunctionalLayer
+
+    def setUp(self):
+        super(TestPersonRelatedPackagesBatching, self).setUp()
+        self.user = self.factory.makePerson()
+        distroseries = self.factory.makeDistroSeries()
+        for _ in range(5):
+            self.factory.makeSourcePackagePublishingHistory(
+                distroseries=distroseries,
+                archive=distroseries.main_archive,
+                spr_creator=self.user, maintainer=self.user)
+        # Update the releases cache table.
+        switch_dbuser('garbo_frequently')
+        job = PopulateLatestPersonSourcePackageReleaseCache(DevNullLogger())
+        while not job.isDone():
+            job(chunk_size=100)
+        switch_dbuser('launchpad')
+        login(ANONYMOUS)
+
+    def getBatch(self, view):
+        return [package.context for package in view.batch]
+
+    def test_later_batches_use_memo(self):
+        # Following the "Next" link fetches the next batch by memo rather
+        # than by offset, and the batches don't overlap.
+        expected = list(self.user.getLatestMaintainedPackages())
+        view = create_initialized_view(
+            self.user, '+maintained-packages', query_string='batch=2')
+        self.assertEqual(expected[:2], self.getBatch(view))
+        next_url = view.batchnav.nextBatchURL()
+        self.assertIn('memo=', next_url)
+        with StormStatementRecorder() as recorder:
+            view = create_initialized_view(
+                self.user, '+maintained-packages',
+                query_string=next_url.split('?', 1)[1])
+            self.assertEqual(expected[2:4], self.getBatch(view))
+        for statement in recorder.statements:
+            self.assertNotIn('OFFSET', statement)
+
+    def test_later_batches_use_index_scan(self):
+        # Later batches of the most common listings are fetched by index
+        # scans that start at the memo, so they cost the same as the first.
+        store = IStore(Person)
+        store.execute('SET LOCAL enable_seqscan = off')
+        listings = [
+            ('latestpersonsprc__maintainer__date__id__non_ppa__idx',
+             self.user.getLatestMaintainedPackages()),
+            ('latestpersonsprc__creator__purpose__date__id__idx',
+             self.user.getLatestUploadedPPAPackages()),
+            ]
+        for index, packages in listings:
+            range_factory = StormRangeFactory(packages)
+            memo = [datetime.now(pytz.UTC), 1000000]
+            result = removeSecurityProxy(
+                range_factory.getSliceFromMemo(2, memo))
+            select = result.get_plain_result_set().get_select_expr(
+                LatestPersonSourcePackageReleaseCache.cache_id)
+            plan = '\n'.join(
+                row[0] for row in store.execute(
+                    'EXPLAIN ' + convert_storm_clause_to_string(select)))
+            self.assertIn(index, plan)
+            self.assertNotIn('Sort', plan)
+
+
 class PersonOwnedTeamsViewTestCase(TestCaseWithFactory):
     """Test +owned-teams view."""
 
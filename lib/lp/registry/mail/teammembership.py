@@ -12,7 +12,6 @@ from datetime import datetime
 import pytz
 from zope.component import getUtility
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.registry.enums import (
     TeamMembershipPolicy,
     TeamMembershipRenewalPolicy,
@@ -327,6 +326,7 @@ class TeamMembershipMailer(BaseMailer):
             recipients[recipient] = TeamMembershipRecipientReason.forMember(
                 member, team, recipient)
 
+        from lp.app.browser.tales import DurationFormatterAPI
         formatter = DurationFormatterAPI(dateexpires - datetime.now(pytz.UTC))
         extra_params = {
             "how_to_renew": how_to_renew,
@@ -261,6 +261,7 @@ from lp.services.database.decoratedresultset import DecoratedResultSet
 from lp.services.database.enumcol import EnumCol
 from lp.services.database.interfaces import IStore
 from lp.services.database.policy import MasterDatabasePolicy
+from lp.services.database.referencecache import ReferenceCache
 from lp.services.database.sqlbase import (
     convert_storm_clause_to_string,
     cursor,
@@ -2873,7 +2874,8 @@ class Person(
         clauses = self._releasesQueryFilter(uploader_only, ppa_only)
         rs = Store.of(self).find(
             LatestPersonSourcePackageReleaseCache, *clauses).order_by(
-            Desc(LatestPersonSourcePackageReleaseCache.dateuploaded))
+            Desc(LatestPersonSourcePackageReleaseCache.dateuploaded),
+            Desc(LatestPersonSourcePackageReleaseCache.cache_id))
 
         def load_related_objects(rows):
             if rows and rows[0].maintainer_id:
@@ -3244,6 +3246,9 @@ class Person(
 class PersonSet:
     """The set of persons."""
 
+    _name_cache = ReferenceCache(
+        Person, 'name', check=lambda person: person.mergedID is None)
+
     def __init__(self):
         self.title = 'People registered with Launchpad'
 
@@ -3631,10 +3636,9 @@ class PersonSet:
 
     def getByName(self, name, ignore_merged=True):
         """See `IPersonSet`."""
-        query = (Person.name == name)
         if ignore_merged:
-            query = And(query, Person.mergedID == None)
-        return Person.selectOne(query)
+            return self._name_cache.get(name)
+        return Person.selectOne(Person.name == name)
 
     def getByAccount(self, account):
         """See `IPersonSet`."""
@@ -26,6 +26,7 @@ from lp.registry.interfaces.sourcepackagename import (
     ISourcePackageName,
     ISourcePackageNameSet,
     )
+from lp.services.database.referencecache import ReferenceCache
 from lp.services.database.sqlbase import (
     cursor,
     SQLBase,
@@ -63,13 +64,15 @@ class SourcePackageName(SQLBase):
 @implementer(ISourcePackageNameSet)
 class SourcePackageNameSet:
 
+    _cache = ReferenceCache(SourcePackageName, 'name')
+
     def __getitem__(self, name):
         """See `ISourcePackageNameSet`."""
         name = six.ensure_text(name, 'ASCII')
-        try:
-            return SourcePackageName.byName(name)
-        except SQLObjectNotFound:
+        sourcepackagename = self._cache.get(name)
+        if sourcepackagename is None:
             raise NoSuchSourcePackageName(name)
+        return sourcepackagename
 
     def get(self, sourcepackagenameid):
         """See `ISourcePackageNameSet`."""
@@ -84,7 +87,7 @@ class SourcePackageNameSet:
 
     def queryByName(self, name):
         """See `ISourcePackageNameSet`."""
-        return SourcePackageName.selectOneBy(name=name)
+        return self._cache.get(name)
 
     def new(self, name):
         if not valid_name(name):
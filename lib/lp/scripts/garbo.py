@@ -1948,6 +1948,11 @@ class FrequentDatabaseGarbageCollector(BaseDatabaseGarbageCollector):
     Jobs with low overhead can go here to distribute work more evenly.
     """
     script_name = 'garbo-frequently'
+    # None of these loops render pages or compute URLs, so skip the
+    # browser registrations.  Loops that need them (such as
+    # ArchiveAuthTokenDeactivator, which calls canonical_url) must not be
+    # added here without switching back to the full script.zcml.
+    zcml_profile = 'db'
     tunable_loops = [
         AntiqueSessionPruner,
         ArchiveSubscriptionExpirer,
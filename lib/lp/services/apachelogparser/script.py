@@ -28,7 +28,7 @@ class ParseApacheLogs(LaunchpadCronScript):
     into a structure mapping files to days to countries to download counts.
 
     Subclasses should override root, getDownloadKey, getDownloadCountUpdater,
-    and optionally setUpUtilities.
+    and optionally setUpUtilities and updateDownloadCounts.
     """
 
     # Glob to restrict filenames that are parsed.
@@ -66,6 +66,40 @@ class ParseApacheLogs(LaunchpadCronScript):
         """
         raise NotImplementedError
 
+    def updateDownloadCounts(self, downloads):
+        """Record the download counts parsed from a log file.
+
+        By default this updates each object's counts in turn using
+        getDownloadCountUpdater.  Subclasses may override it to do so more
+        efficiently.
+
+        :param downloads: A dictionary mapping download keys to days to
+            country codes to counts, as returned by `parse_file`.  It is
+            emptied as it is processed, to free memory.
+        """
+        country_set = getUtility(ICountrySet)
+        # Use a while loop here because we want to pop items from the dict
+        # in order to free some memory as we go along. This is a good
+        # thing here because the downloads dict may get really huge.
+        while downloads:
+            file_id, daily_downloads = downloads.popitem()
+            update_download_count = self.getDownloadCountUpdater(file_id)
+
+            # The object couldn't be retrieved (maybe it was deleted).
+            # Don't bother counting downloads for it.
+            if update_download_count is None:
+                continue
+
+            for day, country_downloads in daily_downloads.items():
+                for country_code, count in country_downloads.items():
+                    try:
+                        country = country_set[country_code]
+                    except NotFoundError:
+                        # We don't know the country for the IP address
+                        # where this request originated.
+                        country = None
+                    update_download_count(day, country, count)
+
     def main(self):
         self.setUpUtilities()
 
@@ -79,7 +113,6 @@ class ParseApacheLogs(LaunchpadCronScript):
         files_to_parse = list(get_files_to_parse(
             glob.glob(os.path.join(self.root, self.log_file_glob))))
 
-        country_set = getUtility(ICountrySet)
         parsed_lines = 0
         max_parsed_lines = getattr(
             config.launchpad, 'logparser_max_parsed_lines', None)
@@ -90,27 +123,7 @@ class ParseApacheLogs(LaunchpadCronScript):
                 break
             downloads, parsed_bytes, parsed_lines = parse_file(
                 fd, position, self.logger, self.getDownloadKey)
-            # Use a while loop here because we want to pop items from the dict
-            # in order to free some memory as we go along. This is a good
-            # thing here because the downloads dict may get really huge.
-            while downloads:
-                file_id, daily_downloads = downloads.popitem()
-                update_download_count = self.getDownloadCountUpdater(file_id)
-
-                # The object couldn't be retrieved (maybe it was deleted).
-                # Don't bother counting downloads for it.
-                if update_download_count is None:
-                    continue
-
-                for day, country_downloads in daily_downloads.items():
-                    for country_code, count in country_downloads.items():
-                        try:
-                            country = country_set[country_code]
-                        except NotFoundError:
-                            # We don't know the country for the IP address
-                            # where this request originated.
-                            country = None
-                        update_download_count(day, country, count)
+            self.updateDownloadCounts(downloads)
             fd.seek(0)
             first_line = fd.readline()
             fd.close()
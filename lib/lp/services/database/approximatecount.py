@@ -0,0 +1,100 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Cheap estimates of the sizes of large result sets."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'approximate_count',
+    'approximately_counted',
+    'estimate_count',
+    ]
+
+import re
+
+from storm.store import EmptyResultSet
+from zope.component import getUtility
+from zope.interface import alsoProvides
+from zope.security.proxy import removeSecurityProxy
+
+from lp.services.config import config
+from lp.services.database.decoratedresultset import DecoratedResultSet
+from lp.services.database.interfaces import (
+    IApproximatelyCountedResultSet,
+    IStoreSelector,
+    MAIN_STORE,
+    SLAVE_FLAVOR,
+    )
+from lp.services.database.sqlbase import convert_storm_clause_to_string
+
+
+_rows_re = re.compile(r"rows=(\d+)\swidth=")
+
+
+def estimate_count(resultset, columns=None):
+    """Return the query planner's estimate of the size of a result set.
+
+    This runs EXPLAIN on a slave store, so it is cheap however large the
+    result set is, but the estimate may be some way off; it is most
+    accurate for simple queries on recently-analyzed tables.
+
+    :param resultset: A Storm result set or a `DecoratedResultSet`.
+    :param columns: If not None, estimate the size of a query for these
+        columns rather than for the result set's own columns.  For SELECT
+        DISTINCT queries with an ORDER BY clause, these must include the
+        sort columns.
+    """
+    resultset = removeSecurityProxy(resultset)
+    if isinstance(resultset, DecoratedResultSet):
+        resultset = removeSecurityProxy(resultset.get_plain_result_set())
+    if isinstance(resultset, EmptyResultSet):
+        return 0
+    if columns is None:
+        select = resultset._get_select()
+    else:
+        select = resultset.get_select_expr(*columns)
+    explain = 'EXPLAIN ' + convert_storm_clause_to_string(select)
+    store = getUtility(IStoreSelector).get(MAIN_STORE, SLAVE_FLAVOR)
+    first_line = store.execute(explain).get_one()[0]
+    match = _rows_re.search(first_line)
+    if match is None:
+        raise RuntimeError("Unexpected EXPLAIN output %s" % repr(first_line))
+    return int(match.group(1))
+
+
+def approximate_count(resultset, columns=None):
+    """Return the size of a result set, estimating it if it is large.
+
+    Result sets that the query planner expects to have fewer than
+    `config.launchpad.approximate_count_threshold` rows are counted
+    exactly, since that is cheap and the planner's estimates are least
+    reliable for small results.
+
+    :param columns: See `estimate_count`.
+    """
+    estimate = estimate_count(resultset, columns=columns)
+    if estimate < config.launchpad.approximate_count_threshold:
+        return resultset.count()
+    return estimate
+
+
+def approximately_counted(resultset):
+    """Allow listings of a result set to show an estimate of its size.
+
+    Webservice collections and batch navigators then use
+    `approximate_count` rather than counting every row, although clients
+    can still ask for the exact size of a webservice collection using
+    "ws.show=total_size".  Calling `count()` on the result set is
+    unaffected.
+
+    Result sets derived from this one, for instance by `order_by()` or
+    `find()`, are not marked, so this should be the last thing done to a
+    result set before returning it.
+
+    :return: `resultset`.
+    """
+    alsoProvides(
+        removeSecurityProxy(resultset), IApproximatelyCountedResultSet)
+    return resultset
@@ -5,6 +5,7 @@ __metaclass__ = type
 __all__ = [
     'DEFAULT_FLAVOR',
     'DisallowedStore',
+    'IApproximatelyCountedResultSet',
     'IDatabasePolicy',
     'IDBObject',
     'IMasterObject',
@@ -20,6 +21,7 @@ __all__ = [
     ]
 
 
+from storm.zope.interfaces import IResultSet
 from zope.interface import Interface
 from zope.interface.common.interfaces import IRuntimeError
 from zope.schema import Int
@@ -164,3 +166,10 @@ class IDBObject(Interface):
 
 class IMasterObject(IDBObject):
     """A Storm database object associated with its master Store."""
+
+
+class IApproximatelyCountedResultSet(IResultSet):
+    """A result set whose size may be estimated when listing it.
+
+    See `lp.services.database.approximatecount.approximately_counted`.
+    """
@@ -0,0 +1,142 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A cache for looking up rows of small reference tables by name."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'ReferenceCache',
+    'invalidate_reference_caches',
+    ]
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+import weakref
+
+import six
+from zope.component import getUtility
+
+from lp.services.config import config
+from lp.services.database.interfaces import IStore
+from lp.services.memcache.interfaces import IMemcacheClient
+
+
+# Every `ReferenceCache` in this process, so that tests can reset them.
+_reference_caches = weakref.WeakSet()
+
+
+def invalidate_reference_caches():
+    """Forget all local entries in every `ReferenceCache`."""
+    for cache in list(_reference_caches):
+        cache.invalidate()
+
+
+class ReferenceCache:
+    """A bounded cache of database IDs for rows looked up by a unique key.
+
+    Only the mapping from key to ID is cached, in a per-process
+    least-recently-used cache that entries also expire from after
+    `config.database.reference_cache_ttl` seconds, optionally backed by
+    memcached.  Objects are always fetched from the store that
+    `IStoreSelector` currently chooses for the class, and checked against
+    the key before being returned, so a row that has been renamed or
+    deleted (even earlier in the current transaction) is never returned:
+    the stale entry is dropped and the lookup falls back to a query.
+    Fetching by ID means that repeated lookups within a transaction are
+    normally answered from Storm's own cache without a query.
+
+    Missing rows are not cached, since they may be created at any time.
+    """
+
+    def __init__(self, cls, attribute, check=None):
+        """Create a cache.
+
+        :param cls: The Storm class to look up.
+        :param attribute: The name of the unique attribute to look up by.
+        :param check: If not None, a callable that takes an object and
+            returns False if it should not be found by this lookup.
+        """
+        self.cls = cls
+        self.attribute = attribute
+        self.check = check
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        _reference_caches.add(self)
+
+    @property
+    def hit_rate(self):
+        """The proportion of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def _memcacheKey(self, key):
+        return 'referencecache:%s:%s:%s' % (
+            self.cls.__storm_table__, self.attribute,
+            hashlib.sha1(six.ensure_binary(key)).hexdigest())
+
+    def _lookupID(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > now:
+                # Mark this entry as the most recently used.
+                self._entries[key] = entry
+                return entry[0]
+        if config.database.reference_cache_memcache:
+            return getUtility(IMemcacheClient).get(self._memcacheKey(key))
+        return None
+
+    def _remember(self, key, object_id, shared=True):
+        ttl = config.database.reference_cache_ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (object_id, time.time() + ttl)
+            while len(self._entries) > config.database.reference_cache_size:
+                self._entries.popitem(last=False)
+        if shared and config.database.reference_cache_memcache:
+            getUtility(IMemcacheClient).set(
+                self._memcacheKey(key), object_id, time=ttl)
+
+    def invalidate(self, key=None):
+        """Forget the entry for `key`, or all local entries if it is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if key is not None and config.database.reference_cache_memcache:
+            getUtility(IMemcacheClient).delete(self._memcacheKey(key))
+
+    def _valid(self, obj, key):
+        return (
+            obj is not None and getattr(obj, self.attribute) == key and
+            (self.check is None or self.check(obj)))
+
+    def get(self, key):
+        """Return the object with this key, or None if there is none."""
+        store = IStore(self.cls)
+        object_id = self._lookupID(key)
+        if object_id is not None:
+            obj = store.get(self.cls, object_id)
+            if self._valid(obj, key):
+                self.hits += 1
+                # Refresh the local entry if it came from memcached.
+                with self._lock:
+                    local = key in self._entries
+                if not local:
+                    self._remember(key, object_id, shared=False)
+                return obj
+            self.invalidate(key)
+        self.misses += 1
+        obj = store.find(
+            self.cls, getattr(self.cls, self.attribute) == key).one()
+        if self._valid(obj, key):
+            self._remember(key, obj.id)
+            return obj
+        return None
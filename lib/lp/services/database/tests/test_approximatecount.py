@@ -0,0 +1,95 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for approximate counts of result sets."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+
+from storm.store import EmptyResultSet
+from testtools.matchers import (
+    GreaterThan,
+    HasLength,
+    )
+from zope.interface.common.sequence import IFiniteSequence
+from zope.security.proxy import ProxyFactory
+
+from lp.registry.model.person import Person
+from lp.services.database.approximatecount import (
+    approximate_count,
+    approximately_counted,
+    estimate_count,
+    )
+from lp.services.database.decoratedresultset import DecoratedResultSet
+from lp.services.database.interfaces import (
+    IApproximatelyCountedResultSet,
+    IStore,
+    )
+from lp.services.webapp.servers import LaunchpadTestRequest
+from lp.testing import (
+    ANONYMOUS,
+    login,
+    StormStatementRecorder,
+    TestCaseWithFactory,
+    )
+from lp.testing.layers import DatabaseFunctionalLayer
+
+
+class TestApproximateCount(TestCaseWithFactory):
+
+    layer = DatabaseFunctionalLayer
+
+    def makeResultSet(self):
+        for _ in range(3):
+            self.factory.makePerson()
+        return IStore(Person).find(Person).order_by(Person.id)
+
+    def test_estimate_count(self):
+        # estimate_count asks the query planner rather than counting.
+        resultset = self.makeResultSet()
+        with StormStatementRecorder() as recorder:
+            estimate = estimate_count(resultset)
+        self.assertThat(estimate, GreaterThan(0))
+        self.assertThat(recorder, HasLength(1))
+        self.assertTrue(recorder.statements[0].startswith('EXPLAIN'))
+
+    def test_estimate_count_decorated(self):
+        # estimate_count handles security-proxied DecoratedResultSets.
+        resultset = self.makeResultSet()
+        decorated = ProxyFactory(DecoratedResultSet(resultset))
+        self.assertEqual(estimate_count(resultset), estimate_count(decorated))
+
+    def test_estimate_count_empty(self):
+        self.assertEqual(0, estimate_count(EmptyResultSet()))
+
+    def test_approximate_count_small(self):
+        # Result sets with small estimates are counted exactly.
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=10 ** 9)
+        self.assertEqual(resultset.count(), approximate_count(resultset))
+
+    def test_approximate_count_large(self):
+        # Result sets with large estimates are not counted.
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=0)
+        self.assertEqual(
+            estimate_count(resultset), approximate_count(resultset))
+
+    def test_approximately_counted(self):
+        # Marked result sets are estimated when adapted to IFiniteSequence,
+        # as lazr.restful does for webservice collections.
+        resultset = self.makeResultSet()
+        self.assertIs(resultset, approximately_counted(resultset))
+        self.assertTrue(IApproximatelyCountedResultSet.providedBy(resultset))
+        self.pushConfig('launchpad', approximate_count_threshold=0)
+        self.assertEqual(
+            estimate_count(resultset), len(IFiniteSequence(resultset)))
+
+    def test_approximately_counted_exact_on_request(self):
+        # Webservice clients can still ask for an exact total size.
+        resultset = approximately_counted(self.makeResultSet())
+        self.pushConfig('launchpad', approximate_count_threshold=0)
+        login(
+            ANONYMOUS, LaunchpadTestRequest(form={'ws.show': 'total_size'}))
+        self.assertEqual(resultset.count(), len(IFiniteSequence(resultset)))
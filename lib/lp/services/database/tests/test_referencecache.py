@@ -0,0 +1,120 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the reference table lookup cache."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+
+from testtools.matchers import HasLength
+from zope.security.proxy import removeSecurityProxy
+
+from lp.buildmaster.model.processor import Processor
+from lp.services.database.interfaces import IStore
+from lp.services.database.referencecache import (
+    invalidate_reference_caches,
+    ReferenceCache,
+    )
+from lp.services.memcache.testing import MemcacheFixture
+from lp.testing import (
+    StormStatementRecorder,
+    TestCaseWithFactory,
+    )
+from lp.testing.layers import DatabaseFunctionalLayer
+
+
+class TestReferenceCache(TestCaseWithFactory):
+
+    layer = DatabaseFunctionalLayer
+
+    def makeProcessor(self, name):
+        return removeSecurityProxy(self.factory.makeProcessor(name=name))
+
+    def test_hit(self):
+        # A repeated lookup in the same transaction doesn't need a query.
+        processor = self.makeProcessor('refcache')
+        cache = ReferenceCache(Processor, 'name')
+        self.assertEqual(processor, cache.get('refcache'))
+        with StormStatementRecorder() as recorder:
+            self.assertEqual(processor, cache.get('refcache'))
+        self.assertThat(recorder, HasLength(0))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(0.5, cache.hit_rate)
+
+    def test_missing(self):
+        # Missing rows are not cached.
+        cache = ReferenceCache(Processor, 'name')
+        self.assertIsNone(cache.get('refcache'))
+        processor = self.makeProcessor('refcache')
+        self.assertEqual(processor, cache.get('refcache'))
+
+    def test_renamed(self):
+        # Renaming a row, even without flushing, invalidates its entry.
+        processor = self.makeProcessor('refcache')
+        other = self.makeProcessor('refcache-other')
+        cache = ReferenceCache(Processor, 'name')
+        cache.get('refcache')
+        processor.name = 'refcache-renamed'
+        self.assertIsNone(cache.get('refcache'))
+        other.name = 'refcache'
+        self.assertEqual(other, cache.get('refcache'))
+
+    def test_deleted(self):
+        processor = self.makeProcessor('refcache')
+        cache = ReferenceCache(Processor, 'name')
+        cache.get('refcache')
+        IStore(Processor).remove(processor)
+        self.assertIsNone(cache.get('refcache'))
+
+    def test_check(self):
+        # Objects rejected by the check are not found.
+        processor = self.makeProcessor('refcache')
+        cache = ReferenceCache(
+            Processor, 'name', check=lambda processor: processor.restricted)
+        self.assertIsNone(cache.get('refcache'))
+        processor.restricted = True
+        self.assertEqual(processor, cache.get('refcache'))
+
+    def test_ttl(self):
+        self.pushConfig('database', reference_cache_ttl=0)
+        self.makeProcessor('refcache')
+        cache = ReferenceCache(Processor, 'name')
+        cache.get('refcache')
+        cache.get('refcache')
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+    def test_bounded(self):
+        # The least recently used entries are evicted.
+        self.pushConfig('database', reference_cache_size=2)
+        for name in ('refcache-1', 'refcache-2', 'refcache-3'):
+            self.makeProcessor(name)
+        cache = ReferenceCache(Processor, 'name')
+        for name in ('refcache-1', 'refcache-2', 'refcache-1', 'refcache-3'):
+            cache.get(name)
+        self.assertContentEqual(
+            ['refcache-1', 'refcache-3'], list(cache._entries))
+
+    def test_memcache(self):
+        # With memcached enabled, entries are shared between caches.
+        self.pushConfig('database', reference_cache_memcache=True)
+        self.useFixture(MemcacheFixture())
+        processor = self.makeProcessor('refcache')
+        ReferenceCache(Processor, 'name').get('refcache')
+        cache = ReferenceCache(Processor, 'name')
+        self.assertEqual(processor, cache.get('refcache'))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+        processor.name = 'refcache-renamed'
+        self.assertIsNone(cache.get('refcache'))
+        self.assertIsNone(
+            ReferenceCache(Processor, 'name')._lookupID('refcache'))
+
+    def test_invalidate_reference_caches(self):
+        # invalidate_reference_caches forgets the entries in every cache.
+        self.makeProcessor('refcache')
+        caches = [ReferenceCache(Processor, 'name') for _ in range(2)]
+        for cache in caches:
+            cache.get('refcache')
+        invalidate_reference_caches()
+        for cache in caches:
+            self.assertEqual({}, dict(cache._entries))
@@ -209,6 +209,13 @@ flag_info = sorted([
      'disabled',
      '',
      ''),
+    ('librarian.deduplicate_uploads.enabled',
+     'boolean',
+     ('If true, uploads to the librarian share existing content with the '
+      'same SHA-256 hash and size rather than storing another copy.'),
+     'disabled',
+     '',
+     ''),
     ('soyuz.ppa.separate_long_descriptions',
      'boolean',
      'If true, PPAs will create an i18n/Translations-en file',
@@ -290,10 +297,11 @@ class FeatureController():
     be one per web app request.
 
     Intended performance: when this object is first asked about a flag, it
-    will read the whole feature flag table from the database.  It is expected
-    to be reasonably small.  The scopes may be expensive to compute (eg
-    checking team membership) so they are checked at most once when
-    they are first needed.
+    will get the whole set of rules, compiled by `compile_rules`, from its
+    rule source.  The table is expected to be reasonably small, and some
+    rule sources share the compiled rules between controllers.  The scopes
+    may be expensive to compute (eg checking team membership) so they are
+    checked at most once when they are first needed.
 
     The controller is then supposed to be held in a thread-local and reused
     for the duration of the request.
@@ -337,21 +345,25 @@ class FeatureController():
 
     def _currentValueAndScope(self, flag):
         self._needRules()
-        if flag in self._rules:
-            for scope, priority, value in self._rules[flag]:
-                if self._known_scopes.lookup(scope):
+        flag_rules = self._rules.get(flag)
+        if flag_rules is not None:
+            lookup_scope = self._known_scopes.lookup
+            for scope, priority, value in flag_rules:
+                if lookup_scope(scope):
                     self._debugMessage(
-                        'feature match flag=%r value=%r scope=%r' %
-                        (flag, value, scope))
+                        'feature match flag=%r value=%r scope=%r',
+                        flag, value, scope)
                     return (value, scope)
             else:
-                self._debugMessage('no rules matched for %r' % flag)
+                self._debugMessage('no rules matched for %r', flag)
         else:
-            self._debugMessage('no rules relevant to %r' % flag)
+            self._debugMessage('no rules relevant to %r', flag)
         return (None, None)
 
-    def _debugMessage(self, message):
-        logger.debug(message)
+    def _debugMessage(self, message, *args):
+        # Only format the message if it will be logged: this is called for
+        # every flag lookup.
+        logger.debug(message, *args)
         # The OOPS machinery can also grab it out of the request if needed.
 
     def currentScope(self, flag):
@@ -393,7 +405,7 @@ class FeatureController():
 
     def _needRules(self):
         if self._rules is None:
-            self._rules = self.rule_source.getAllRulesAsDict()
+            self._rules = self.rule_source.getCompiledRules()
 
     def usedFlags(self):
         """Return dict of flags used in this controller so far."""
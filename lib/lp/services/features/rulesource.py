@@ -4,11 +4,13 @@
 """Returns rules defining which features are active"""
 
 __all__ = [
+    'CachingStormFeatureRuleSource',
     'DuplicatePriorityError',
     'FeatureRuleSource',
     'MemoryFeatureRuleSource',
     'NullFeatureRuleSource',
     'StormFeatureRuleSource',
+    'compile_rules',
     ]
 
 __metaclass__ = type
@@ -20,7 +22,11 @@ from collections import (
 import re
 
 import six
-from storm.locals import Desc
+from storm.locals import (
+    Count,
+    Desc,
+    Max,
+    )
 
 from lp.services.features.model import (
     FeatureFlag,
@@ -43,6 +49,29 @@ class DuplicatePriorityError(Exception):
             self.flag, self.priority)
 
 
+def compile_rules(rules):
+    """Compile rules into the form used by `FeatureController`.
+
+    :param rules: A dict as returned by
+        `FeatureRuleSource.getAllRulesAsDict`.
+    :returns: dict from flag name to a tuple of (scope, priority, value)
+        in descending order by priority.  Rules after a rule in the default
+        scope can never be chosen, so they are left out.  Equal scope names
+        share a single string, so comparing them is cheap.
+    """
+    scopes = {}
+    compiled = {}
+    for flag, flag_rules in rules.items():
+        compiled_rules = []
+        for scope, priority, value in flag_rules:
+            scope = scopes.setdefault(scope, scope)
+            compiled_rules.append((scope, priority, value))
+            if scope == 'default':
+                break
+        compiled[flag] = tuple(compiled_rules)
+    return compiled
+
+
 class FeatureRuleSource(object):
     """Access feature rule sources from the database or elsewhere."""
 
@@ -62,6 +91,13 @@ class FeatureRuleSource(object):
         """Generate list of (flag, scope, priority, value)"""
         raise NotImplementedError()
 
+    def getCompiledRules(self):
+        """Return all rule definitions in the form used for evaluation.
+
+        :returns: See `compile_rules`.
+        """
+        return compile_rules(self.getAllRulesAsDict())
+
     def getAllRulesAsText(self):
         """Return a text for of the rules.
 
@@ -152,6 +188,61 @@ class StormFeatureRuleSource(FeatureRuleSource):
                 value=value,
                 priority=priority))
         store.flush()
+        CachingStormFeatureRuleSource.invalidate()
+
+
+class CachingStormFeatureRuleSource(StormFeatureRuleSource):
+    """Share one snapshot of the database's feature rules between threads.
+
+    Reading the rules is cheap compared with the rest of a request, but
+    they change only a few times a week and every request reads them.
+    Instead, each call to `getAllRulesAsDict` checks a generation marker
+    (the number of rules and the time they were last modified), and only
+    reads the whole table again if it has changed since the snapshot was
+    taken.  Scope evaluation is still done by each `FeatureController`.
+
+    The marker relies on rules being replaced with `setAllRules`, as the
+    feature flag editor does: updating a rule in place without touching
+    `date_modified` is not noticed until some other change is made.
+    """
+
+    # (generation, rules, compiled rules) as of the last read, shared by
+    # all instances.  The rules must be treated as read-only.
+    _snapshot = None
+
+    @classmethod
+    def invalidate(cls):
+        """Forget the current snapshot."""
+        cls._snapshot = None
+
+    def getGeneration(self):
+        """Return a marker that changes whenever the rules change."""
+        store = getFeatureStore()
+        return tuple(store.find(
+            (Count(), Max(FeatureFlag.date_modified))).one())
+
+    def _getSnapshot(self):
+        try:
+            # See StormFeatureRuleSource.getAllRulesAsTuples.
+            adapter.get_request_remaining_seconds()
+        except adapter.RequestExpired:
+            return None, {}, {}
+        generation = self.getGeneration()
+        snapshot = CachingStormFeatureRuleSource._snapshot
+        if snapshot is None or snapshot[0] != generation:
+            rules = super(
+                CachingStormFeatureRuleSource, self).getAllRulesAsDict()
+            snapshot = (generation, rules, compile_rules(rules))
+            # Replacing the snapshot is atomic, so threads racing to
+            # refresh it at worst do some redundant work.
+            CachingStormFeatureRuleSource._snapshot = snapshot
+        return snapshot
+
+    def getAllRulesAsDict(self):
+        return self._getSnapshot()[1]
+
+    def getCompiledRules(self):
+        return self._getSnapshot()[2]
 
 
 class MemoryFeatureRuleSource(FeatureRuleSource):
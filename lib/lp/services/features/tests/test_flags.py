@@ -8,17 +8,23 @@ __metaclass__ = type
 
 import os
 
+from testtools.matchers import HasLength
+
 from lp.services.features import (
     getFeatureFlag,
     install_feature_controller,
     )
 from lp.services.features.flags import FeatureController
+from lp.services.features.model import getFeatureStore
 from lp.services.features.rulesource import (
+    CachingStormFeatureRuleSource,
+    compile_rules,
     MemoryFeatureRuleSource,
     StormFeatureRuleSource,
     )
 from lp.testing import (
     layers,
+    StormStatementRecorder,
     TestCase,
     )
 
@@ -261,6 +267,79 @@ class TestStormFeatureRuleSource(FeatureRuleSourceTestsMixin, TestCase):
         return StormFeatureRuleSource()
 
 
+class TestCompileRules(TestCase):
+
+    layer = layers.BaseLayer
+
+    def test_compile_rules(self):
+        # Rules after one in the default scope are dropped, and equal scope
+        # names are shared.
+        compiled = compile_rules({
+            'flag1': [
+                ('beta_user', 300, u'4.0'),
+                ('default', 100, u'3.0'),
+                ('alpha_user', 50, u'2.0'),
+                ],
+            'flag2': [('b' + 'eta_user', 100, u'on')],
+            })
+        self.assertEqual({
+            'flag1': (('beta_user', 300, u'4.0'), ('default', 100, u'3.0')),
+            'flag2': (('beta_user', 100, u'on'),),
+            }, compiled)
+        self.assertIs(compiled['flag1'][0][0], compiled['flag2'][0][0])
+
+
+class TestCachingStormFeatureRuleSource(
+        FeatureRuleSourceTestsMixin, TestCase):
+
+    layer = layers.DatabaseFunctionalLayer
+
+    def setUp(self):
+        super(TestCachingStormFeatureRuleSource, self).setUp()
+        CachingStormFeatureRuleSource.invalidate()
+        self.addCleanup(CachingStormFeatureRuleSource.invalidate)
+
+    def makeSource(self):
+        return CachingStormFeatureRuleSource()
+
+    def test_snapshot_shared(self):
+        # Once the rules have been read, other instances only check that
+        # they haven't changed.
+        self.makeSource().setAllRules(test_rules_list)
+        rules = self.makeSource().getAllRulesAsDict()
+        with StormStatementRecorder() as recorder:
+            self.assertEqual(rules, self.makeSource().getAllRulesAsDict())
+        self.assertThat(recorder, HasLength(1))
+
+    def test_setAllRules_invalidates(self):
+        source = self.makeSource()
+        source.setAllRules(test_rules_list)
+        source.getAllRulesAsDict()
+        source.setAllRules([('ui.icing', 'default', 100, u'1.0')])
+        self.assertEqual(
+            {'ui.icing': [('default', 100, '1.0')]},
+            self.makeSource().getAllRulesAsDict())
+
+    def test_getCompiledRules_shared(self):
+        self.makeSource().setAllRules(test_rules_list)
+        self.assertIs(
+            self.makeSource().getCompiledRules(),
+            self.makeSource().getCompiledRules())
+
+    def test_external_change_noticed(self):
+        # Changes made elsewhere, such as by another process, are picked
+        # up by the generation check.
+        source = self.makeSource()
+        source.setAllRules(test_rules_list)
+        source.getAllRulesAsDict()
+        getFeatureStore().execute(
+            "INSERT INTO FeatureFlag (scope, priority, flag, value) "
+            "VALUES ('default', 0, 'new.flag', 'on')")
+        self.assertEqual(
+            [('default', 0, 'on')],
+            source.getAllRulesAsDict()['new.flag'])
+
+
 class TestMemoryFeatureRuleSource(FeatureRuleSourceTestsMixin, TestCase):
 
     layer = layers.FunctionalLayer
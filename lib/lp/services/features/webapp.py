@@ -9,7 +9,7 @@ __metaclass__ = type
 
 from lp.services.features import install_feature_controller
 from lp.services.features.flags import FeatureController
-from lp.services.features.rulesource import StormFeatureRuleSource
+from lp.services.features.rulesource import CachingStormFeatureRuleSource
 from lp.services.features.scopes import ScopesFromRequest
 
 
@@ -17,7 +17,7 @@ def start_request(event):
     """Register FeatureController."""
     event.request.features = FeatureController(
         ScopesFromRequest(event.request).lookup,
-        StormFeatureRuleSource())
+        CachingStormFeatureRuleSource())
     install_feature_controller(event.request.features)
 
 
@@ -0,0 +1,114 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Measure how long it takes to import modules.
+
+This works on both Python 2 and 3, unlike ``python -X importtime``.  It
+deliberately only depends on the standard library and six, so that it can
+be installed before most of Launchpad is imported.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'ImportProfiler',
+    ]
+
+import sys
+import threading
+from timeit import default_timer
+
+from six.moves import builtins
+
+
+class ImportProfiler:
+    """Record the time spent importing each module.
+
+    While the profiler is installed, each import statement that loads new
+    modules is timed and charged to the module it names.  Cumulative time
+    includes the modules that it imports in turn; self time excludes them.
+    Modules pulled in by ``from package import submodule`` are charged to
+    the package.
+    """
+
+    def __init__(self):
+        self.cumulative = {}
+        self.self_time = {}
+        self.total = 0.0
+        self._original_import = None
+        self._local = threading.local()
+
+    def install(self):
+        """Start timing imports."""
+        assert self._original_import is None, "Already installed."
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        """Stop timing imports."""
+        builtins.__import__ = self._original_import
+        self._original_import = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.uninstall()
+
+    def _import(self, name, globals=None, locals=None, fromlist=(),
+                level=0):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # Time spent in nested imports is accumulated in the top entry.
+        stack.append(0.0)
+        module_count = len(sys.modules)
+        start = default_timer()
+        try:
+            return self._original_import(
+                name, globals, locals, fromlist, level)
+        finally:
+            elapsed = default_timer() - start
+            nested = stack.pop()
+            if len(sys.modules) != module_count:
+                if stack:
+                    stack[-1] += elapsed
+                else:
+                    self.total += elapsed
+                if level:
+                    name = self._resolve(name, globals, level)
+                self.cumulative[name] = (
+                    self.cumulative.get(name, 0.0) + elapsed)
+                self.self_time[name] = (
+                    self.self_time.get(name, 0.0) + elapsed - nested)
+
+    @staticmethod
+    def _resolve(name, globals, level):
+        """Turn a relative import into an absolute module name."""
+        package = (globals or {}).get('__package__')
+        if not package:
+            return '.' * level + name
+        base = package.rsplit('.', level - 1)[0]
+        return '%s.%s' % (base, name) if name else base
+
+    def format(self, limit=None, sort_key='cumulative'):
+        """Format a report of the most expensive imports.
+
+        :param limit: The maximum number of modules to list, or None to
+            list them all.
+        :param sort_key: 'cumulative' or 'self'.
+        """
+        times = self.cumulative if sort_key == 'cumulative' else self.self_time
+        names = sorted(times, key=lambda name: times[name], reverse=True)
+        if limit is not None:
+            names = names[:limit]
+        lines = ['%10s %10s  %s' % ('cumul. ms', 'self ms', 'module')]
+        for name in names:
+            lines.append('%10.1f %10.1f  %s' % (
+                self.cumulative[name] * 1000, self.self_time[name] * 1000,
+                name))
+        lines.append('Total: %.3fs importing %d modules' % (
+            self.total, len(self.cumulative)))
+        return '\n'.join(lines)
@@ -13,6 +13,7 @@ __all__ = [
     ]
 
 
+from concurrent import futures
 import hashlib
 import select
 import socket
@@ -20,10 +21,13 @@ from socket import (
     SOCK_STREAM,
     AF_INET,
     )
+import tempfile
 import threading
 import time
 
 from lazr.restful.utils import get_current_browser_request
+import requests
+from requests.adapters import HTTPAdapter
 import six
 from six.moves import http_client
 from six.moves.urllib.error import (
@@ -44,8 +48,10 @@ from lp.services.config import (
     config,
     dbconfig,
     )
+from lp.services.database.bulk import create
 from lp.services.database.interfaces import IMasterStore
 from lp.services.database.postgresql import ConnectionString
+from lp.services.features import getFeatureFlag
 from lp.services.librarian.interfaces.client import (
     DownloadFailed,
     ILibrarianClient,
@@ -170,6 +176,13 @@ class FileUploadClient:
 
         name = six.ensure_binary(name)
 
+        if (size > 0 and
+                getFeatureFlag('librarian.deduplicate_uploads.enabled')):
+            aliasID = self._addExistingFile(
+                name, size, file, contentType, expires=expires)
+            if aliasID is not None:
+                return aliasID
+
         # Import in this method to avoid a circular import
         from lp.services.librarian.model import LibraryFileContent
         from lp.services.librarian.model import LibraryFileAlias
@@ -189,56 +202,18 @@ class FileUploadClient:
             aliasID = store.execute(
                 "SELECT nextval('libraryfilealias_id_seq')").get_one()[0]
 
-            # Send command
-            self._sendLine(b'STORE %d %s' % (size, name))
-
-            # Send headers
-            self._sendHeader('Database-Name', databaseName)
-            self._sendHeader('File-Content-ID', contentID)
-            self._sendHeader('File-Alias-ID', aliasID)
-
-            if debugID is not None:
-                self._sendHeader('Debug-ID', debugID)
-
-            # Send blank line. Do not check for a response from the
-            # server when no data will be sent. Otherwise
-            # _checkError() might consume the "200" response which
-            # is supposed to be read below in this method.
-            self._sendLine(b'', check_for_error_responses=(size > 0))
-
-            # Prepare to the upload the file
-            md5_digester = hashlib.md5()
-            sha1_digester = hashlib.sha1()
-            sha256_digester = hashlib.sha256()
-            bytesWritten = 0
-
-            # Read in and upload the file 64kb at a time, by using the two-arg
-            # form of iter (see
-            # /usr/share/doc/python/html/library/functions.html#iter).
-            for chunk in iter(lambda: file.read(1024 * 64), b''):
-                self.state.f.write(chunk)
-                bytesWritten += len(chunk)
-                md5_digester.update(chunk)
-                sha1_digester.update(chunk)
-                sha256_digester.update(chunk)
-
-            assert bytesWritten == size, (
-                'size is %d, but %d were read from the file'
-                % (size, bytesWritten))
+            md5, sha1, sha256 = self._sendFile(
+                name, size, file, databaseName, contentID, aliasID,
+                debugID=debugID)
             self.state.f.flush()
 
             # Read response
-            response = six.ensure_str(
-                self.state.f.readline().strip(), errors='replace')
-            if response != '200':
-                raise UploadFailed('Server said: ' + response)
+            self._readResponse()
 
             # Add rows to DB
             content = LibraryFileContent(
-                id=contentID, filesize=size,
-                sha256=sha256_digester.hexdigest(),
-                sha1=sha1_digester.hexdigest(),
-                md5=md5_digester.hexdigest())
+                id=contentID, filesize=size, sha256=sha256, sha1=sha1,
+                md5=md5)
             LibraryFileAlias(
                 id=aliasID, content=content, filename=name.decode('UTF-8'),
                 mimetype=contentType, expires=expires,
@@ -252,6 +227,195 @@ class FileUploadClient:
         finally:
             self._close()
 
+    def _sendFile(self, name, size, file, databaseName, contentID, aliasID,
+                  debugID=None):
+        """Send a STORE request for a file with reserved IDs.
+
+        :return: A tuple of the file's hex MD5, SHA-1, and SHA-256 digests.
+        """
+        # Send command
+        self._sendLine(b'STORE %d %s' % (size, name))
+
+        # Send headers
+        self._sendHeader('Database-Name', databaseName)
+        self._sendHeader('File-Content-ID', contentID)
+        self._sendHeader('File-Alias-ID', aliasID)
+
+        if debugID is not None:
+            self._sendHeader('Debug-ID', debugID)
+
+        # Send blank line. Do not check for a response from the
+        # server when no data will be sent. Otherwise
+        # _checkError() might consume the "200" response which
+        # is supposed to be read later.
+        self._sendLine(b'', check_for_error_responses=(size > 0))
+
+        # Prepare to the upload the file
+        md5_digester = hashlib.md5()
+        sha1_digester = hashlib.sha1()
+        sha256_digester = hashlib.sha256()
+        bytesWritten = 0
+
+        # Read in and upload the file 64kb at a time, by using the two-arg
+        # form of iter (see
+        # /usr/share/doc/python/html/library/functions.html#iter).
+        for chunk in iter(lambda: file.read(1024 * 64), b''):
+            self.state.f.write(chunk)
+            bytesWritten += len(chunk)
+            md5_digester.update(chunk)
+            sha1_digester.update(chunk)
+            sha256_digester.update(chunk)
+
+        assert bytesWritten == size, (
+            'size is %d, but %d were read from the file'
+            % (size, bytesWritten))
+        return (
+            md5_digester.hexdigest(), sha1_digester.hexdigest(),
+            sha256_digester.hexdigest())
+
+    def _addExistingFile(self, name, size, file, contentType, expires=None):
+        """Add an alias for existing content matching a file, if possible.
+
+        The file is hashed before anything is sent to the librarian, and if
+        the librarian already has content with the same SHA-256 hash and
+        size then we only need to add a new alias for it.  This means
+        reading the file twice when it isn't a duplicate, and files that
+        can't be rewound are never checked.
+
+        :return: The new aliasID, or None if the file must be uploaded.
+        """
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import (
+            find_reusable_content,
+            LibraryFileAlias,
+            )
+
+        try:
+            start = file.tell()
+        except (AttributeError, IOError, OSError):
+            return None
+        sha256_digester = hashlib.sha256()
+        bytesRead = 0
+        for chunk in iter(lambda: file.read(1024 * 64), b''):
+            sha256_digester.update(chunk)
+            bytesRead += len(chunk)
+        file.seek(start)
+        if bytesRead != size:
+            # Let the upload fail in the usual way.
+            return None
+
+        store = IMasterStore(LibraryFileAlias)
+        contentID = find_reusable_content(
+            store, sha256_digester.hexdigest(), size)
+        if contentID is None:
+            return None
+        alias = LibraryFileAlias(
+            contentID=contentID, filename=six.ensure_text(name),
+            mimetype=contentType, expires=expires,
+            restricted=self.restricted)
+        store.flush()
+        return alias.id
+
+    def _readResponse(self):
+        response = six.ensure_str(
+            self.state.f.readline().strip(), errors='replace')
+        if response != '200':
+            raise UploadFailed('Server said: ' + response)
+
+    def addFiles(self, files, debugID=None):
+        """Add several files to the librarian at once.
+
+        The files are sent over a single connection without waiting for
+        responses in between, and the librarian stores them in a single
+        transaction.
+
+        :param files: A sequence of dictionaries of keyword arguments as
+            for `addFile`: name, size, file, contentType, and optionally
+            expires.
+        :param debugID: As for `addFile`.
+        :returns: A list of aliasIDs as integers, in the same order as
+            `files`.
+        :raises UploadFailed: If the server rejects the upload for some
+            reason.
+        """
+        files = list(files)
+        for spec in files:
+            if spec['file'] is None:
+                raise TypeError('Bad File Descriptor: %s' % repr(spec['file']))
+            if spec['size'] <= 0:
+                raise UploadFailed('Invalid length: %d' % spec['size'])
+            if spec['contentType'] is None:
+                raise TypeError('No content type for %s' % spec['name'])
+
+        existing = {}
+        if getFeatureFlag('librarian.deduplicate_uploads.enabled'):
+            for i, spec in enumerate(files):
+                aliasID = self._addExistingFile(
+                    six.ensure_binary(spec['name']), spec['size'],
+                    spec['file'], spec['contentType'],
+                    expires=spec.get('expires'))
+                if aliasID is not None:
+                    existing[i] = aliasID
+        uploaded = iter(self._uploadFiles(
+            [spec for i, spec in enumerate(files) if i not in existing],
+            debugID=debugID))
+        return [
+            existing[i] if i in existing else next(uploaded)
+            for i in range(len(files))]
+
+    def _uploadFiles(self, files, debugID=None):
+        """Upload a batch of files, returning their new aliasIDs."""
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import LibraryFileAlias
+        from lp.services.librarian.model import LibraryFileContent
+
+        if not files:
+            return []
+
+        # Reserve all the IDs we need at once.
+        store = IMasterStore(LibraryFileAlias)
+        databaseName = self._getDatabaseName(store)
+        ids = store.execute("""
+            SELECT
+                nextval('libraryfilecontent_id_seq'),
+                nextval('libraryfilealias_id_seq')
+            FROM generate_series(1, ?)
+            """, (len(files),)).get_all()
+
+        self._connect()
+        try:
+            self._sendLine(b'BATCH %d' % len(files))
+            digests = []
+            for spec, (contentID, aliasID) in zip(files, ids):
+                digests.append(self._sendFile(
+                    six.ensure_binary(spec['name']), spec['size'],
+                    spec['file'], databaseName, contentID, aliasID,
+                    debugID=debugID))
+            self.state.f.flush()
+            for _ in files:
+                self._readResponse()
+        finally:
+            self._close()
+
+        # Add rows to DB
+        create(
+            (LibraryFileContent.id, LibraryFileContent.filesize,
+             LibraryFileContent.sha256, LibraryFileContent.sha1,
+             LibraryFileContent.md5),
+            [(contentID, spec['size'], six.ensure_text(sha256),
+              six.ensure_text(sha1), six.ensure_text(md5))
+             for spec, (contentID, _), (md5, sha1, sha256)
+             in zip(files, ids, digests)])
+        create(
+            (LibraryFileAlias.id, LibraryFileAlias.contentID,
+             LibraryFileAlias.filename, LibraryFileAlias.mimetype,
+             LibraryFileAlias.expires, LibraryFileAlias.restricted),
+            [(aliasID, contentID, six.ensure_text(spec['name']),
+              six.ensure_text(spec['contentType']), spec.get('expires'),
+              self.restricted)
+             for spec, (contentID, aliasID) in zip(files, ids)])
+        return [aliasID for _, aliasID in ids]
+
     def _getDatabaseName(self, store):
         return store.execute("SELECT current_database();").get_one()[0]
 
@@ -352,9 +516,33 @@ class _File:
         return self.file.close()
 
 
+class _PooledResponse:
+    """Make a streamed `requests` response look like one from `urlopen`."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def info(self):
+        return self.response.headers
+
+    def read(self, size=None):
+        # Once the whole body has been read, urllib3 returns the connection
+        # to the pool.
+        return self.response.raw.read(size)
+
+    def close(self):
+        self.response.close()
+
+
 class FileDownloadClient:
     """A simple client to download files from the librarian"""
 
+    # Prefetched files larger than this are spooled to disk.
+    prefetch_spool_size = 1024 * 1024
+
+    _download_session = None
+    _download_session_lock = threading.Lock()
+
     # If anything is using this, it should be exposed as a public method
     # in the interface. Note that there is no need to contact the Librarian
     # to do this if you have a database connection available.
@@ -514,6 +702,55 @@ class FileDownloadClient:
         if url is None:
             # File has been deleted
             return None
+        return self._getFileByURL(url, aliasID, timeout)
+
+    def getFilesByAlias(
+        self, aliasIDs, timeout=LIBRARIAN_SERVER_DEFAULT_TIMEOUT,
+        max_workers=4):
+        """See `IFileDownloadClient`."""
+        # Look up the URLs here, since the database can only be used from
+        # this thread.
+        urls = [
+            (aliasID, self._getURLForDownload(aliasID))
+            for aliasID in aliasIDs]
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            prefetches = [
+                executor.submit(self._prefetch, url, aliasID, timeout)
+                for aliasID, url in urls]
+        files = []
+        error = None
+        for prefetch in prefetches:
+            if prefetch.exception() is None:
+                files.append(prefetch.result())
+            elif error is None:
+                error = prefetch.exception()
+        if error is not None:
+            for prefetched in files:
+                if prefetched is not None:
+                    prefetched.close()
+            raise error
+        return files
+
+    def _prefetch(self, url, aliasID, timeout):
+        """Download a file into a temporary file, for getFilesByAlias."""
+        if url is None:
+            # File has been deleted
+            return None
+        source = self._getFileByURL(url, aliasID, timeout)
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=self.prefetch_spool_size)
+        try:
+            for chunk in iter(lambda: source.read(1024 * 64), b''):
+                spool.write(chunk)
+            spool.seek(0)
+        except Exception:
+            spool.close()
+            raise
+        finally:
+            source.close()
+        return spool
+
+    def _getFileByURL(self, url, aliasID, timeout):
         try_until = time.time() + timeout
         request = get_current_browser_request()
         timeline = get_request_timeline(request)
@@ -523,11 +760,45 @@ class FileDownloadClient:
         finally:
             action.finish()
 
+    def _getDownloadSession(self):
+        """Return a `requests.Session` that keeps connections alive."""
+        with self._download_session_lock:
+            if self._download_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_maxsize=(
+                        config.librarian.download_connection_pool_size))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._download_session = session
+            return self._download_session
+
+    def _open(self, url):
+        """Open `url` for reading.
+
+        If `librarian.download_connection_pool_size` is set, connections
+        to the librarian are kept open and reused; otherwise each file is
+        fetched over a new connection.  Either way, failures are reported
+        as from `urlopen`.
+        """
+        if not config.librarian.download_connection_pool_size:
+            return urlopen(url)
+        try:
+            response = self._getDownloadSession().get(url, stream=True)
+        except requests.RequestException as e:
+            raise URLError(e)
+        if response.status_code >= 400:
+            response.close()
+            raise HTTPError(
+                url, response.status_code, response.reason,
+                response.headers, None)
+        return _PooledResponse(response)
+
     def _connect_read(self, url, try_until, aliasID):
         """Helper for getFileByAlias."""
         while 1:
             try:
-                return _File(urlopen(url), url)
+                return _File(self._open(url), url)
             except URLError as error:
                 # 404 errors indicate a data inconsistency: more than one
                 # attempt to open the file is pointless.
@@ -176,6 +176,17 @@ class ILibraryFileAliasSet(Interface):
         given sha256.
         """
 
+    def updateDownloadCounts(counts):
+        """Add to the download counts of many files at once.
+
+        This is equivalent to calling `ILibraryFileAlias.updateDownloadCount`
+        for each count, but only needs a single database query.
+
+        :param counts: A dictionary mapping (alias ID, day, country ID)
+            tuples to numbers of downloads.  The country ID may be None.
+            Counts for aliases that no longer exist are ignored.
+        """
+
 
 class ILibraryFileDownloadCount(Interface):
     """Download count of a given file in a given day."""
@@ -69,6 +69,22 @@ class IFileUploadClient(Interface):
         Returns the id of the newly added LibraryFileAlias
         """
 
+    def addFiles(files, debugID=None):
+        """Add several files to the librarian at once.
+
+        This behaves like calling `addFile` for each file, but uses a
+        single connection and a single librarian transaction.
+
+        :param files: A sequence of dictionaries of keyword arguments as
+            for `addFile`: name, size, file, contentType, and optionally
+            expires.
+
+        :raises UploadFailed: If the server rejects the upload for some reason
+
+        Returns a list of the ids of the newly added LibraryFileAliases, in
+        the same order as `files`.
+        """
+
     def remoteAddFile(name, size, file, contentType, expires=None):
         """Add a file to the librarian using the remote protocol.
 
@@ -128,6 +144,24 @@ class IFileDownloadClient(Interface):
             unreachable or returns an 5xx HTTPError.
         """
 
+    def getFilesByAlias(aliasIDs, timeout=LIBRARIAN_SERVER_DEFAULT_TIMEOUT,
+                        max_workers=4):
+        """Download several files at once.
+
+        The files are downloaded in parallel into temporary files, which
+        are returned once all the downloads have finished.
+
+        :param aliasIDs: A sequence of alias IDs identifying the files.
+        :param timeout: As for `getFileByAlias`, but applying to each file.
+        :param max_workers: The maximum number of files to download at
+            once.
+        :return: A list of file-like objects, in the same order as
+            `aliasIDs`, or None in place of any files that have been
+            deleted.
+        :raises: As for `getFileByAlias`, if any of the files can't be
+            downloaded.
+        """
+
 
 class ILibrarianClient(IFileUploadClient, IFileDownloadClient):
     """Interface for the librarian client."""
@@ -3,6 +3,7 @@
 
 __metaclass__ = type
 __all__ = [
+    'find_reusable_content',
     'LibraryFileAlias',
     'LibraryFileAliasWithParent',
     'LibraryFileAliasSet',
@@ -83,6 +84,36 @@ class LibraryFileContent(SQLBase):
     md5 = StringCol(notNull=True)
 
 
+def find_reusable_content(store, sha256, size):
+    """Find existing content that a new upload could share.
+
+    Content only qualifies if it has an alias that the garbage collector
+    won't expire for a while yet, so that it can't be deleted between
+    being found here and being given a new alias.
+
+    :return: A `LibraryFileContent` ID, or None.
+    """
+    row = store.execute("""
+        SELECT LibraryFileContent.id
+        FROM LibraryFileContent
+        WHERE
+            LibraryFileContent.sha256 = ?
+            AND LibraryFileContent.filesize = ?
+            AND EXISTS (
+                SELECT 1 FROM LibraryFileAlias
+                WHERE
+                    LibraryFileAlias.content = LibraryFileContent.id
+                    AND (
+                        LibraryFileAlias.expires IS NULL
+                        OR LibraryFileAlias.expires >
+                            CURRENT_TIMESTAMP AT TIME ZONE 'UTC'
+                            + interval '1 day'))
+        ORDER BY LibraryFileContent.id DESC
+        LIMIT 1
+        """, (six.ensure_text(sha256), size)).get_one()
+    return None if row is None else row[0]
+
+
 @implementer(ILibraryFileAlias)
 class LibraryFileAlias(SQLBase):
     """A filename and mimetype that we can serve some given content with."""
@@ -272,6 +303,67 @@ class LibraryFileAliasSet(object):
             AND LibraryFileContent.sha256 = '%s'
             """ % sha256, clauseTables=['LibraryFileContent'])
 
+    def updateDownloadCounts(self, counts):
+        """See `ILibraryFileAliasSet`."""
+        if not counts:
+            return
+        rows = [
+            (int(alias_id), day, country_id, count)
+            for (alias_id, day, country_id), count in counts.items()]
+        store = IMasterStore(LibraryFileAlias)
+        store.flush()
+        # Update existing counts, add any new ones, and keep
+        # LibraryFileAlias.hits in step, all in one statement.  Counts for
+        # aliases that no longer exist are dropped.
+        store.execute("""
+            WITH new_counts (libraryfilealias, day, country, count) AS (
+                VALUES %s
+            ),
+            updated AS (
+                UPDATE LibraryFileDownloadCount
+                SET count = LibraryFileDownloadCount.count + new_counts.count
+                FROM new_counts
+                WHERE
+                    LibraryFileDownloadCount.libraryfilealias =
+                        new_counts.libraryfilealias
+                    AND LibraryFileDownloadCount.day = new_counts.day
+                    AND LibraryFileDownloadCount.country
+                        IS NOT DISTINCT FROM new_counts.country
+                RETURNING
+                    LibraryFileDownloadCount.libraryfilealias,
+                    LibraryFileDownloadCount.day,
+                    LibraryFileDownloadCount.country
+            ),
+            hits AS (
+                UPDATE LibraryFileAlias
+                SET hits = LibraryFileAlias.hits + alias_counts.count
+                FROM (
+                    SELECT libraryfilealias, sum(count) AS count
+                    FROM new_counts
+                    GROUP BY libraryfilealias
+                ) AS alias_counts
+                WHERE LibraryFileAlias.id = alias_counts.libraryfilealias
+                RETURNING LibraryFileAlias.id
+            )
+            INSERT INTO LibraryFileDownloadCount
+                (libraryfilealias, day, country, count)
+            SELECT
+                new_counts.libraryfilealias, new_counts.day,
+                new_counts.country, new_counts.count
+            FROM new_counts JOIN hits ON hits.id = new_counts.libraryfilealias
+            WHERE NOT EXISTS (
+                SELECT 1 FROM updated
+                WHERE
+                    updated.libraryfilealias = new_counts.libraryfilealias
+                    AND updated.day = new_counts.day
+                    AND updated.country
+                        IS NOT DISTINCT FROM new_counts.country)
+            """ % ", ".join(
+                ["(?::integer, ?::date, ?::integer, ?::integer)"] * len(rows)),
+            [value for row in rows for value in row])
+        # The aliases' hits have changed behind Storm's back.
+        store.invalidate()
+
 
 @implementer(ILibraryFileDownloadCount)
 class LibraryFileDownloadCount(SQLBase):
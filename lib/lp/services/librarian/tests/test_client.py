@@ -1,6 +1,10 @@
 # Copyright 2009-2020 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
+from datetime import (
+    datetime,
+    timedelta,
+    )
 import hashlib
 import io
 import os
@@ -14,6 +18,7 @@ from fixtures import (
     EnvironmentVariable,
     TempDir,
     )
+import pytz
 from six.moves import http_client
 from six.moves.urllib.error import (
     HTTPError,
@@ -28,6 +33,7 @@ from lp.services.daemons.tachandler import TacTestSetup
 from lp.services.database.interfaces import ISlaveStore
 from lp.services.database.policy import SlaveDatabasePolicy
 from lp.services.database.sqlbase import block_implicit_flushes
+from lp.services.features.testing import FeatureFixture
 from lp.services.librarian import client as client_module
 from lp.services.librarian.client import (
     _File,
@@ -348,6 +354,148 @@ class LibrarianClientTestCase(TestCase):
         self.assertEqual(sha1, lfa.content.sha1)
         self.assertEqual(sha256, lfa.content.sha256)
 
+    def test_addFiles(self):
+        # addFiles() uploads several files in one batch.
+        contents = [b'file %d' % i for i in range(5)]
+        client = LibrarianClient()
+        alias_ids = client.addFiles([
+            {'name': 'file%d.txt' % i, 'size': len(data),
+             'file': io.BytesIO(data), 'contentType': 'text/plain'}
+            for i, data in enumerate(contents)])
+        transaction.commit()
+        self.assertEqual(len(contents), len(alias_ids))
+        for i, (alias_id, data) in enumerate(zip(alias_ids, contents)):
+            lfa = LibraryFileAlias.get(alias_id)
+            self.assertEqual('file%d.txt' % i, lfa.filename)
+            self.assertEqual('text/plain', lfa.mimetype)
+            self.assertEqual(hashlib.sha256(data).hexdigest(),
+                             lfa.content.sha256)
+            self.assertEqual(data, client.getFileByAlias(alias_id).read())
+
+    def test_addFiles_wrong_database(self):
+        # If the server rejects a batch, none of the files are added.
+        client = LibrarianClient()
+        client._getDatabaseName = lambda cur: 'wrong_database'
+        self.assertRaisesRegex(
+            UploadFailed, 'Server said: 400 Wrong database',
+            client.addFiles, [
+                {'name': 'sample%d.txt' % i, 'size': 6,
+                 'file': io.BytesIO(b'sample'), 'contentType': 'text/plain'}
+                for i in range(3)])
+
+    def test_addFiles_requires_content_type(self):
+        # A missing content type is rejected before anything is uploaded.
+        client = InstrumentedLibrarianClient()
+        self.assertRaisesRegex(
+            TypeError, 'No content type for sample.txt',
+            client.addFiles, [
+                {'name': 'sample.txt', 'size': 6,
+                 'file': io.BytesIO(b'sample'), 'contentType': None}])
+        self.assertFalse(client.sentDatabaseName)
+        self.assertEqual(0, client.check_error_calls)
+
+    def test_addFile_deduplicates(self):
+        # If deduplication is enabled and the librarian already has the
+        # file's content, addFile() only creates a new alias for it.
+        self.useFixture(FeatureFixture(
+            {'librarian.deduplicate_uploads.enabled': 'on'}))
+        client = InstrumentedLibrarianClient()
+        first = LibraryFileAlias.get(client.addFile(
+            'first.txt', 6, io.BytesIO(b'sample'), 'text/plain'))
+        self.assertEqual(5, client.check_error_calls)
+        second = LibraryFileAlias.get(client.addFile(
+            'second.txt', 6, io.BytesIO(b'sample'), 'text/x-diff'))
+        # Nothing more was sent to the librarian.
+        self.assertEqual(5, client.check_error_calls)
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual('second.txt', second.filename)
+        self.assertEqual('text/x-diff', second.mimetype)
+        transaction.commit()
+        self.assertEqual(b'sample', client.getFileByAlias(second.id).read())
+
+    def test_addFile_deduplicate_disabled(self):
+        # Without the feature flag, every upload gets new content.
+        client = LibrarianClient()
+        first = LibraryFileAlias.get(client.addFile(
+            'first.txt', 6, io.BytesIO(b'sample'), 'text/plain'))
+        second = LibraryFileAlias.get(client.addFile(
+            'second.txt', 6, io.BytesIO(b'sample'), 'text/plain'))
+        self.assertNotEqual(first.content, second.content)
+
+    def test_addFile_does_not_reuse_expiring_content(self):
+        # Content whose aliases are about to expire may be deleted by the
+        # garbage collector at any moment, so it is never shared.
+        self.useFixture(FeatureFixture(
+            {'librarian.deduplicate_uploads.enabled': 'on'}))
+        client = LibrarianClient()
+        first = LibraryFileAlias.get(client.addFile(
+            'first.txt', 6, io.BytesIO(b'sample'), 'text/plain',
+            expires=datetime.now(pytz.UTC) - timedelta(days=1)))
+        second = LibraryFileAlias.get(client.addFile(
+            'second.txt', 6, io.BytesIO(b'sample'), 'text/plain'))
+        self.assertNotEqual(first.content, second.content)
+
+    def test_addFiles_deduplicates(self):
+        # addFiles() only uploads files whose content the librarian
+        # doesn't already have, but returns aliases for all of them.
+        self.useFixture(FeatureFixture(
+            {'librarian.deduplicate_uploads.enabled': 'on'}))
+        client = LibrarianClient()
+        existing = LibraryFileAlias.get(client.addFile(
+            'existing.txt', 6, io.BytesIO(b'sample'), 'text/plain'))
+        alias_ids = client.addFiles([
+            {'name': 'new.txt', 'size': 3, 'file': io.BytesIO(b'new'),
+             'contentType': 'text/plain'},
+            {'name': 'old.txt', 'size': 6, 'file': io.BytesIO(b'sample'),
+             'contentType': 'text/plain'},
+            ])
+        transaction.commit()
+        new, old = [LibraryFileAlias.get(alias_id) for alias_id in alias_ids]
+        self.assertEqual('new.txt', new.filename)
+        self.assertEqual(b'new', client.getFileByAlias(new.id).read())
+        self.assertEqual('old.txt', old.filename)
+        self.assertEqual(existing.content, old.content)
+
+    def test_getFileByAlias_pooled(self):
+        # If download_connection_pool_size is set, getFileByAlias reuses
+        # connections to the librarian.
+        self.pushConfig('librarian', download_connection_pool_size=2)
+        client = LibrarianClient()
+        alias_id = client.addFile(
+            'sample.txt', 6, io.BytesIO(b'sample'), 'text/plain')
+        transaction.commit()
+        for _ in range(3):
+            f = client.getFileByAlias(alias_id)
+            self.assertEqual(b'sample', f.read())
+            f.close()
+        url = client._getURLForDownload(alias_id)
+        pool = client._download_session.get_adapter(
+            url).poolmanager.connection_from_url(url)
+        self.assertEqual(1, pool.num_connections)
+
+    def test_getFileByAlias_pooled_missing(self):
+        # Pooled downloads report missing files in the same way as others.
+        self.pushConfig('librarian', download_connection_pool_size=2)
+        client = LibrarianClient()
+        alias_id = client.addFile(
+            'sample.txt', 6, io.BytesIO(b'sample'), 'text/plain')
+        # The file isn't visible to the librarian until we commit.
+        self.assertRaises(LookupError, client.getFileByAlias, alias_id)
+
+    def test_getFilesByAlias(self):
+        # getFilesByAlias downloads several files in parallel, returning
+        # them in the order they were asked for.
+        client = LibrarianClient()
+        contents = [b'file %d' % i * (i + 1) for i in range(5)]
+        alias_ids = [
+            client.addFile(
+                'file%d.txt' % i, len(data), io.BytesIO(data), 'text/plain')
+            for i, data in enumerate(contents)]
+        transaction.commit()
+        files = client.getFilesByAlias(alias_ids, max_workers=2)
+        self.assertEqual(contents, [f.read() for f in files])
+
     def test__getURLForDownload(self):
         # This protected method is used by getFileByAlias. It is supposed to
         # use the internal host and port rather than the external, proxied
@@ -5,19 +5,31 @@
 
 __metaclass__ = type
 
+from datetime import (
+    date,
+    timedelta,
+    )
 import io
 import unittest
 
 import transaction
 from zope.component import getUtility
+from zope.security.proxy import removeSecurityProxy
 
+from lp.services.database.interfaces import IStore
 from lp.services.librarian.interfaces import ILibraryFileAliasSet
+from lp.services.librarian.model import LibraryFileDownloadCount
+from lp.services.worlddata.interfaces.country import ICountrySet
 from lp.testing import (
     ANONYMOUS,
     login,
     logout,
+    TestCaseWithFactory,
+    )
+from lp.testing.layers import (
+    DatabaseFunctionalLayer,
+    LaunchpadFunctionalLayer,
     )
-from lp.testing.layers import LaunchpadFunctionalLayer
 
 
 class TestLibraryFileAlias(unittest.TestCase):
@@ -45,3 +57,37 @@ class TestLibraryFileAlias(unittest.TestCase):
         # the remaining content. If it's reset, the file will be auto-opened
         # and its whole content will be returned.
         self.assertEqual(self.text_content, self.file_alias.read())
+
+
+class TestUpdateDownloadCounts(TestCaseWithFactory):
+
+    layer = DatabaseFunctionalLayer
+
+    def test_updateDownloadCounts(self):
+        # updateDownloadCounts adds to existing counts, creates new ones,
+        # and keeps each alias's hits up to date.
+        lfa1 = self.factory.makeLibraryFileAlias(db_only=True)
+        lfa2 = self.factory.makeLibraryFileAlias(db_only=True)
+        brazil = getUtility(ICountrySet)['BR']
+        day = date(2006, 11, 1)
+        next_day = day + timedelta(days=1)
+        removeSecurityProxy(lfa1).updateDownloadCount(day, brazil, 1)
+        getUtility(ILibraryFileAliasSet).updateDownloadCounts({
+            (lfa1.id, day, brazil.id): 2,
+            (lfa1.id, day, None): 3,
+            (lfa2.id, next_day, brazil.id): 4,
+            # Counts for aliases that don't exist are ignored.
+            (lfa2.id + 1000, day, None): 5,
+            })
+        self.assertEqual(6, lfa1.hits)
+        self.assertEqual(4, lfa2.hits)
+        counts = IStore(LibraryFileDownloadCount).find(
+            LibraryFileDownloadCount,
+            LibraryFileDownloadCount.libraryfilealias_id.is_in(
+                (lfa1.id, lfa2.id, lfa2.id + 1000)))
+        self.assertContentEqual(
+            [(lfa1.id, day, brazil.id, 3),
+             (lfa1.id, day, None, 3),
+             (lfa2.id, next_day, brazil.id, 4)],
+            [(count.libraryfilealias_id, count.day, count.country_id,
+              count.count) for count in counts])
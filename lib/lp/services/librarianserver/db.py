@@ -33,6 +33,7 @@ from lp.services.config import config
 from lp.services.database.interfaces import IStore
 from lp.services.database.sqlbase import session_store
 from lp.services.librarian.model import (
+    find_reusable_content,
     LibraryFileAlias,
     LibraryFileContent,
     TimeLimitedToken,
@@ -61,6 +62,14 @@ class Library:
     def lookupBySHA1(self, digest):
         return [fc.id for fc in LibraryFileContent.selectBy(sha1=digest)]
 
+    def lookupReusableContent(self, sha256_digest, size):
+        """Return the ID of content that a new upload could share, or None.
+
+        See `find_reusable_content`.
+        """
+        return find_reusable_content(
+            IStore(LibraryFileContent), sha256_digest, size)
+
     @defer.inlineCallbacks
     def _verifyMacaroon(self, macaroon, aliasid):
         """Verify an LFA-authorising macaroon with the authserver.
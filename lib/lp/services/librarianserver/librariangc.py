@@ -53,6 +53,7 @@ debug = False
 
 
 STREAM_CHUNK_SIZE = 64 * 1024
+ONE_DAY = 24 * 60 * 60
 
 
 def file_exists(content_id):
@@ -614,146 +615,307 @@ def delete_unreferenced_content(con):
     loop_tuner.run()
 
 
-def delete_unwanted_files(con):
-    delete_unwanted_disk_files(con)
+def delete_unwanted_files(con, dry_run=False, checkpoint_dir=None):
+    """Delete files from disk and Swift that have no database records.
+
+    The disk and Swift sweeps run concurrently.
+
+    :param dry_run: If True, only report what would be deleted.
+    :param checkpoint_dir: If not None, a directory in which each sweep
+        records its progress, so that an interrupted run can be resumed.
+    """
     swift_enabled = getFeatureFlag('librarian.swift.enabled') or False
+    sweeps = [
+        UnwantedDiskFiles(
+            con, swift_enabled, dry_run=dry_run,
+            checkpoint_path=_checkpoint_path(checkpoint_dir, 'disk'))]
     if swift_enabled:
-        delete_unwanted_swift_files(con)
+        sweeps.append(UnwantedSwiftFiles(
+            con, dry_run=dry_run,
+            checkpoint_path=_checkpoint_path(checkpoint_dir, 'swift')))
+    pool = multiprocessing.pool.ThreadPool(len(sweeps))
+    try:
+        pool.map(lambda sweep: sweep.run(), sweeps)
+    finally:
+        pool.close()
+        pool.join()
 
 
-def delete_unwanted_disk_files(con):
-    """Delete files found on disk that have no corresponding record in the
-    database.
+def _checkpoint_path(checkpoint_dir, name):
+    if checkpoint_dir is None:
+        return None
+    return os.path.join(checkpoint_dir, name)
 
-    Files will only be deleted if they were created more than one day ago
-    to avoid deleting files that have just been uploaded but have yet to have
-    the database records committed.
-    """
 
-    log.info("Deleting unwanted files from disk.")
+def wanted_content_ids(con, start=None, batch_size=10000):
+    """Generate the IDs of all LibraryFileContent rows, in order.
 
-    swift_enabled = getFeatureFlag('librarian.swift.enabled') or False
+    Rows are fetched in batches by ID, so memory use is bounded however
+    large the table is.
 
+    :param start: If not None, only generate IDs greater than this.
+    """
     cur = con.cursor()
+    last_id = -1 if start is None else start
+    while True:
+        cur.execute("""
+            SELECT id FROM LibraryFileContent
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+            """, (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row[0]
+        last_id = rows[-1][0]
+
+
+def merge_wanted(wanted_ids, found):
+    """Merge-join stored files with the content IDs that we want to keep.
+
+    :param wanted_ids: An iterator over wanted content IDs, in order.
+    :param found: An iterable of (content_id, item) pairs describing the
+        files in some storage, in content ID order.  There may be several
+        items for the same content ID.
+    :return: A generator of (content_id, item, wanted) tuples, in content
+        ID order.  Wanted content IDs without any stored files are
+        included with an item of None.
+    """
+    next_wanted_id = next(wanted_ids, None)
+    matched = False
+    for content_id, item in found:
+        while next_wanted_id is not None and next_wanted_id < content_id:
+            if not matched:
+                yield next_wanted_id, None, True
+            next_wanted_id = next(wanted_ids, None)
+            matched = False
+        wanted = next_wanted_id == content_id
+        matched = matched or wanted
+        yield content_id, item, wanted
+    while next_wanted_id is not None:
+        if not matched:
+            yield next_wanted_id, None, True
+        next_wanted_id = next(wanted_ids, None)
+        matched = False
+
+
+class UnwantedFiles:
+    """Delete files from some storage that have no database records.
+
+    Files are only deleted if they were created more than one day ago, to
+    avoid deleting files that have just been uploaded but whose database
+    records have yet to be committed.
+
+    Subclasses list the storage in content ID order, which lets us
+    merge-join it with the LibraryFileContent IDs in the database rather
+    than holding either in memory.
+    """
 
-    # Calculate all stored LibraryFileContent ids that we want to keep.
-    # Results are ordered so we don't have to suck them all in at once.
-    cur.execute("""
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """)
+    # A name for the storage, for logging.
+    storage_name = None
 
-    def get_next_wanted_content_id():
-        result = cur.fetchone()
-        if result is None:
-            return None
-        else:
-            return result[0]
+    # Save the checkpoint at most this often, in seconds.
+    checkpoint_interval = 10
 
-    removed_count = 0
-    content_id = next_wanted_content_id = -1
+    def __init__(self, con, dry_run=False, checkpoint_path=None):
+        self.con = con
+        self.dry_run = dry_run
+        self.checkpoint_path = checkpoint_path
+
+    def found_files(self, start):
+        """Generate (content_id, item) pairs for the files in storage.
+
+        :param start: If not None, only files for content IDs greater than
+            this need be generated.
+        """
+        raise NotImplementedError
+
+    def is_recent(self, item):
+        """Was this file created too recently to be deleted?"""
+        raise NotImplementedError
+
+    def file_size(self, item):
+        raise NotImplementedError
+
+    def delete(self, item):
+        raise NotImplementedError
+
+    def report_missing(self, content_id):
+        """Report a wanted file that is missing from this storage."""
+        raise NotImplementedError
+
+    def _saveCheckpoint(self, content_id):
+        if self.checkpoint_path is not None:
+            swift.write_checkpoint(self.checkpoint_path, content_id)
+
+    def run(self):
+        log.info("Deleting unwanted files from %s.", self.storage_name)
+        start = None
+        if self.checkpoint_path is not None:
+            start = swift.read_checkpoint(self.checkpoint_path)
+            if start is not None:
+                log.info(
+                    "Resuming %s sweep after LibraryFileContent %d.",
+                    self.storage_name, start)
+
+        removed_count = 0
+        removed_size = 0
+        last_id = None
+        saved_at = time()
+        for content_id, item, wanted in merge_wanted(
+                wanted_content_ids(self.con, start=start),
+                self.found_files(start)):
+            if content_id != last_id:
+                # We have finished with everything up to last_id.
+                if (last_id is not None and
+                        time() - saved_at >= self.checkpoint_interval):
+                    self._saveCheckpoint(last_id)
+                    saved_at = time()
+                last_id = content_id
+            if item is None:
+                self.report_missing(content_id)
+            elif not wanted:
+                if self.is_recent(item):
+                    log.debug3(
+                        "File %d not removed - created too recently",
+                        content_id)
+                    continue
+                removed_size += self.file_size(item)
+                removed_count += 1
+                if not self.dry_run:
+                    self.delete(item)
 
-    hex_content_id_re = re.compile(r'^([0-9a-f]{8})(\.migrated)?$')
-    ONE_DAY = 24 * 60 * 60
-
-    for dirpath, dirnames, filenames in scandir.walk(
-        get_storage_root(), followlinks=True):
-
-        # Ignore known and harmless noise in the Librarian storage area.
-        if 'incoming' in dirnames:
-            dirnames.remove('incoming')
-        if 'lost+found' in dirnames:
-            dirnames.remove('lost+found')
-        filenames = set(filenames)
-        filenames.discard('librarian.pid')
-        filenames.discard('librarian.log')
-
-        for dirname in dirnames[:]:
-            if len(dirname) != 2:
-                dirnames.remove(dirname)
-                log.warning(
-                    "Ignoring directory %s that shouldn't be here" % dirname)
-                continue
+        # The sweep is complete, so the next one should start afresh.
+        if self.checkpoint_path is not None:
             try:
-                int(dirname, 16)
-            except ValueError:
-                dirnames.remove(dirname)
-                log.warning("Ignoring invalid directory %s" % dirname)
-
-        # We need everything in order to ensure we visit files in the
-        # same order we retrieve wanted files from the database.
-        dirnames.sort()
-        filenames = sorted(filenames)
-
-        # Noise in the storage area, or maybe we are looking at the wrong
-        # path?
-        if dirnames and filenames:
-            log.warning(
-                "%s contains both files %r and subdirectories %r. Skipping."
-                % (dirpath, filenames, dirnames))
-            continue
+                os.unlink(self.checkpoint_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
 
-        for filename in filenames:
-            path = os.path.join(dirpath, filename)
-            hex_content_id = ''.join(path.split(os.sep)[-4:])
-            match = hex_content_id_re.search(hex_content_id)
-            if match is None:
-                log.warning(
-                    "Ignoring invalid path %s" % path)
-                continue
+        log.info(
+            "%s %d files (%d bytes) from %s that were no longer referenced "
+            "in the db.", "Would delete" if self.dry_run else "Deleted",
+            removed_count, removed_size, self.storage_name)
 
-            content_id = int(match.groups()[0], 16)
 
-            while (next_wanted_content_id is not None
-                    and content_id > next_wanted_content_id):
+class UnwantedDiskFiles(UnwantedFiles):
+    """Delete files found on disk that have no database records."""
 
-                next_wanted_content_id = get_next_wanted_content_id()
+    storage_name = 'disk'
 
-                if (config.librarian_server.upstream_host is None
-                        and not swift_enabled  # Maybe the file is in Swift.
-                        and next_wanted_content_id is not None
-                        and next_wanted_content_id < content_id):
-                    log.error(
-                        "LibraryFileContent %d exists in the database but "
-                        "was not found on disk." % next_wanted_content_id)
+    hex_content_id_re = re.compile(r'^([0-9a-f]{8})(\.migrated)?$')
 
-            file_wanted = (
-                    next_wanted_content_id is not None
-                    and next_wanted_content_id == content_id)
+    def __init__(self, con, swift_enabled, **kwargs):
+        super(UnwantedDiskFiles, self).__init__(con, **kwargs)
+        self.swift_enabled = swift_enabled
+
+    def found_files(self, start):
+        storage_root = get_storage_root()
+        for dirpath, dirnames, filenames in scandir.walk(
+                storage_root, followlinks=True):
+
+            # Ignore known and harmless noise in the Librarian storage area.
+            if 'incoming' in dirnames:
+                dirnames.remove('incoming')
+            if 'lost+found' in dirnames:
+                dirnames.remove('lost+found')
+            filenames = set(filenames)
+            filenames.discard('librarian.pid')
+            filenames.discard('librarian.log')
+
+            for dirname in dirnames[:]:
+                if len(dirname) != 2:
+                    dirnames.remove(dirname)
+                    log.warning(
+                        "Ignoring directory %s that shouldn't be here"
+                        % dirname)
+                    continue
+                try:
+                    int(dirname, 16)
+                except ValueError:
+                    dirnames.remove(dirname)
+                    log.warning("Ignoring invalid directory %s" % dirname)
+
+            # We need everything in order to ensure we visit files in the
+            # same order we retrieve wanted files from the database.
+            dirnames.sort()
+            filenames = sorted(filenames)
+
+            if start is not None and dirnames:
+                # Skip directories that only hold files we have already
+                # dealt with.
+                prefix = os.path.relpath(dirpath, storage_root)
+                prefix = '' if prefix == '.' else prefix.replace(os.sep, '')
+                padding = 'f' * (8 - len(prefix) - 2)
+                dirnames[:] = [
+                    dirname for dirname in dirnames
+                    if int(prefix + dirname + padding, 16) > start]
+
+            # Noise in the storage area, or maybe we are looking at the
+            # wrong path?
+            if dirnames and filenames:
+                log.warning(
+                    "%s contains both files %r and subdirectories %r. "
+                    "Skipping." % (dirpath, filenames, dirnames))
+                continue
 
-            if not file_wanted:
-                if time() - os.path.getctime(path) < ONE_DAY:
-                    log.debug3(
-                        "File %d not removed - created too recently"
-                        % content_id)
-                else:
-                    # File uploaded a while ago but no longer wanted.
-                    os.unlink(path)
-                    log.debug3("Deleted %s" % path)
-                    removed_count += 1
-
-    # Report any remaining LibraryFileContent that the database says
-    # should exist but we didn't find on disk.
-    if next_wanted_content_id == content_id:
-        next_wanted_content_id = get_next_wanted_content_id()
-    if not swift_enabled:
-        while next_wanted_content_id is not None:
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                hex_content_id = ''.join(path.split(os.sep)[-4:])
+                match = self.hex_content_id_re.search(hex_content_id)
+                if match is None:
+                    log.warning("Ignoring invalid path %s" % path)
+                    continue
+                content_id = int(match.group(1), 16)
+                if start is None or content_id > start:
+                    yield content_id, path
+
+    def is_recent(self, path):
+        return time() - os.path.getctime(path) < ONE_DAY
+
+    def file_size(self, path):
+        return os.path.getsize(path)
+
+    def delete(self, path):
+        os.unlink(path)
+        log.debug3("Deleted %s" % path)
+
+    def report_missing(self, content_id):
+        # If Swift is enabled, the file is probably there instead.
+        if (config.librarian_server.upstream_host is None
+                and not self.swift_enabled):
             log.error(
                 "LibraryFileContent %d exists in the database but "
-                "was not found on disk." % next_wanted_content_id)
-            next_wanted_content_id = get_next_wanted_content_id()
+                "was not found on disk." % content_id)
 
-    log.info(
-        "Deleted %d files from disk that were no longer referenced "
-        "in the db." % removed_count)
+
+def delete_unwanted_disk_files(con, dry_run=False, checkpoint_path=None):
+    """Delete files found on disk that have no corresponding record in the
+    database.
+
+    Files will only be deleted if they were created more than one day ago
+    to avoid deleting files that have just been uploaded but have yet to have
+    the database records committed.
+    """
+    swift_enabled = getFeatureFlag('librarian.swift.enabled') or False
+    UnwantedDiskFiles(
+        con, swift_enabled, dry_run=dry_run,
+        checkpoint_path=checkpoint_path).run()
 
 
-def swift_files(max_lfc_id):
+def swift_files(max_lfc_id, start=None):
     """Generate all files stored in all configured Swift instances.
 
     For each file, yield (connection_pool, container, name).  Results are
     yielded in numerical order; if the same file is present in multiple
     Swift instances, all copies of it are yielded before moving on to the
-    next file.
+    next file.  Only one container's listing is held in memory at a time.
+
+    :param start: If not None, skip files for content IDs up to and
+        including this one.
     """
     final_container = swift.swift_location(max_lfc_id)[0]
 
@@ -764,7 +926,12 @@ def swift_files(max_lfc_id):
         # We generate the container names, rather than query the
         # server, because the mock Swift implementation doesn't
         # support that operation.
-        container_num = -1
+        if start is None:
+            container_num = -1
+        else:
+            first_container = swift.swift_location(start)[0]
+            container_num = int(
+                first_container[len(swift.SWIFT_CONTAINER_PREFIX):]) - 1
         container = None
         while container != final_container:
             container_num += 1
@@ -785,106 +952,76 @@ def swift_files(max_lfc_id):
             objs.sort(key=lambda x: (
                 [int(segment) for segment in x[0]['name'].split('/')], x[1]))
             for obj, pool_index in objs:
+                if (start is not None and
+                        int(obj['name'].split('/', 1)[0]) <= start):
+                    continue
                 if (obj['name'], pool_index) not in seen_names:
                     yield (swift.connection_pools[pool_index], container, obj)
                 seen_names.add((obj['name'], pool_index))
 
 
-def delete_unwanted_swift_files(con):
-    """Delete files found in Swift that have no corresponding db record."""
-    assert getFeatureFlag('librarian.swift.enabled')
-
-    log.info("Deleting unwanted files from Swift.")
-
-    cur = con.cursor()
-
-    # Get the largest LibraryFileContent id in the database. This lets
-    # us know when to stop looking in Swift for more files.
-    cur.execute("SELECT max(id) FROM LibraryFileContent")
-    max_lfc_id = cur.fetchone()[0]
-
-    # Calculate all stored LibraryFileContent ids that we want to keep.
-    # Results are ordered so we don't have to suck them all in at once.
-    cur.execute("""
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """)
-
-    def get_next_wanted_content_id():
-        result = cur.fetchone()
-        if result is None:
-            return None
-        else:
-            return result[0]
-
-    removed_count = 0
-    content_id = next_wanted_content_id = -1
-
-    for connection_pool, container, obj in swift_files(max_lfc_id):
-        name = obj['name']
-
-        # We may have a segment of a large file.
-        if '/' in name:
-            content_id = int(name.split('/', 1)[0])
-        else:
-            content_id = int(name)
+class UnwantedSwiftFiles(UnwantedFiles):
+    """Delete files found in Swift that have no database records."""
 
-        while (next_wanted_content_id is not None
-            and content_id > next_wanted_content_id):
+    storage_name = 'Swift'
 
-            next_wanted_content_id = get_next_wanted_content_id()
+    def found_files(self, start):
+        # Get the largest LibraryFileContent id in the database. This lets
+        # us know when to stop looking in Swift for more files.
+        cur = self.con.cursor()
+        cur.execute("SELECT max(id) FROM LibraryFileContent")
+        max_lfc_id = cur.fetchone()[0]
+        if max_lfc_id is None:
+            return
+        for connection_pool, container, obj in swift_files(
+                max_lfc_id, start=start):
+            # We may have a segment of a large file.
+            content_id = int(obj['name'].split('/', 1)[0])
+            yield content_id, (connection_pool, container, obj)
+
+    def is_recent(self, item):
+        _, _, obj = item
+        mod_time = iso8601.parse_date(obj['last_modified'])
+        return mod_time > _utcnow() - timedelta(days=1)
+
+    def file_size(self, item):
+        _, _, obj = item
+        return obj['bytes']
+
+    def delete(self, item):
+        connection_pool, container, obj = item
+        with swift.connection(connection_pool) as swift_connection:
+            try:
+                swift_connection.delete_object(container, obj['name'])
+            except swiftclient.ClientException as e:
+                if e.http_status != 404:
+                    raise
+        log.debug3(
+            'Deleted (%s, %s) from Swift (%s)',
+            container, obj['name'], connection_pool.os_auth_url)
 
-            if (config.librarian_server.upstream_host is None
-                    and next_wanted_content_id is not None
-                    and next_wanted_content_id < content_id
-                    and not os.path.exists(
-                        get_file_path(next_wanted_content_id))):
+    def report_missing(self, content_id):
+        path = get_file_path(content_id)
+        if not os.path.exists(path):
+            if config.librarian_server.upstream_host is None:
                 log.error(
                     "LibraryFileContent %d exists in the database but "
-                    "was not found on disk nor in Swift."
-                    % next_wanted_content_id)
-
-        file_wanted = (
-            next_wanted_content_id is not None
-            and next_wanted_content_id == content_id)
-
-        if not file_wanted:
-            mod_time = iso8601.parse_date(obj['last_modified'])
-            if mod_time > _utcnow() - timedelta(days=1):
-                log.debug3(
-                    "File %d not removed - created too recently", content_id)
-            else:
-                with swift.connection(connection_pool) as swift_connection:
-                    try:
-                        swift_connection.delete_object(container, name)
-                    except swiftclient.ClientException as e:
-                        if e.http_status != 404:
-                            raise
-                log.debug3(
-                    'Deleted (%s, %s) from Swift (%s)',
-                    container, name, connection_pool.os_auth_url)
-                removed_count += 1
-
-    if next_wanted_content_id == content_id:
-        next_wanted_content_id = get_next_wanted_content_id()
-    while next_wanted_content_id is not None:
-        # The entry exists in the database but not in Swift. This is
-        # normal, as there is lag between uploading files to disk and
-        # migrating them into Swift. The important case, where files
-        # are missing and exist neither on disk nor in Swift, is reported
-        # earlier. Still, we should catch if the librarian-feed-swift
-        # has not run recently. Report an error if the file is older
-        # than one week and doesn't exist in Swift.
-        path = get_file_path(next_wanted_content_id)
-        if os.path.exists(path) and (os.stat(path).st_ctime
-                                     < time() - (7 * 24 * 60 * 60)):
+                    "was not found on disk nor in Swift." % content_id)
+        elif os.stat(path).st_ctime < time() - (7 * ONE_DAY):
+            # The entry exists in the database but not in Swift. This is
+            # normal, as there is lag between uploading files to disk and
+            # migrating them into Swift.  Still, we should catch if the
+            # librarian-feed-swift has not run recently.
             log.error(
                 "LibraryFileContent {0} exists in the database and disk "
-                "but was not found in Swift.".format(next_wanted_content_id))
-        next_wanted_content_id = get_next_wanted_content_id()
+                "but was not found in Swift.".format(content_id))
 
-    log.info(
-        "Deleted {0} files from Swift that were no longer referenced "
-        "in the db.".format(removed_count))
+
+def delete_unwanted_swift_files(con, dry_run=False, checkpoint_path=None):
+    """Delete files found in Swift that have no corresponding db record."""
+    assert getFeatureFlag('librarian.swift.enabled')
+    UnwantedSwiftFiles(
+        con, dry_run=dry_run, checkpoint_path=checkpoint_path).run()
 
 
 def get_file_path(content_id):
@@ -13,7 +13,10 @@ from twisted.internet.threads import deferToThread
 from twisted.protocols import basic
 from twisted.python import log
 
-from lp.services.librarianserver.storage import WrongDatabaseError
+from lp.services.librarianserver.storage import (
+    store_uploads,
+    WrongDatabaseError,
+    )
 
 
 class ProtocolViolation(Exception):
@@ -62,11 +65,29 @@ class FileUploadProtocol(basic.LineReceiver):
 
     Once the server has replied, the client may re-use the connection as if it
     were just established to start a new upload.
+
+    To upload several files at once, a client may send::
+
+        BATCH 3
+
+    followed immediately by three STORE requests as above, without waiting
+    for responses.  Once it has received all the files, the server stores
+    them in a single database transaction and sends one response line per
+    file, in order.  If anything goes wrong, the server sends a single
+    error response instead, and none of the files are stored.
     """
 
     delimiter = b'\r\n'  # same as HTTP
     state = 'command'
 
+    # The most files that may be sent in one batch.
+    max_batch_size = 10000
+
+    # If not None, the number of files in the current batch, and the
+    # uploads received so far.
+    batchSize = None
+    batch = None
+
     def lineReceived(self, line):
         try:
             try:
@@ -158,6 +179,19 @@ class FileUploadProtocol(basic.LineReceiver):
     def badCommand(self, line):
         raise ProtocolViolation('Unknown command: ' + line)
 
+    def command_BATCH(self, args):
+        if self.batchSize is not None:
+            raise ProtocolViolation("BATCH commands may not be nested")
+        try:
+            size = int(args)
+        except ValueError:
+            raise ProtocolViolation("BATCH command expects a number of files")
+        if not 0 < size <= self.max_batch_size:
+            raise ProtocolViolation(
+                "BATCH size must be between 1 and %d" % self.max_batch_size)
+        self.batchSize = size
+        self.batch = []
+
     def command_STORE(self, args):
         try:
             size, name = args.split(None, 1)
@@ -207,8 +241,17 @@ class FileUploadProtocol(basic.LineReceiver):
         realdata, rest = data[:self.bytesLeft], data[self.bytesLeft:]
         self.bytesLeft -= len(realdata)
         self.newFile.append(realdata)
-
         if self.bytesLeft == 0:
+            self.newFile.finishReceiving()
+
+        if self.bytesLeft == 0 and self.batchSize is not None:
+            self.batch.append(self.newFile)
+            if len(self.batch) == self.batchSize:
+                self._storeBatch()
+            # Treat remaining bytes (if any) as a new command.
+            self.state = 'command'
+            self.setLineMode(rest)
+        elif self.bytesLeft == 0:
             # Store file.
             deferred = self._storeFile()
 
@@ -231,15 +274,45 @@ class FileUploadProtocol(basic.LineReceiver):
             self.state = 'command'
             self.setLineMode(rest)
 
+    def _storeBatch(self):
+        uploads = self.batch
+        self.batchSize = self.batch = None
+        deferred = self._storeUploads(uploads)
+
+        def _logDebugging(result_or_failure):
+            for upload in uploads:
+                self._logUploadDebugging(upload)
+            return result_or_failure
+
+        def _sendIDs(all_ids):
+            for upload, (fileID, aliasID) in zip(uploads, all_ids):
+                if upload.contentID is None:
+                    self.sendLine(
+                        ('200 %s/%s' % (fileID, aliasID)).encode('UTF-8'))
+                else:
+                    self.sendLine(b'200')
+
+        deferred.addBoth(_logDebugging)
+        deferred.addCallback(_sendIDs)
+        deferred.addErrback(self.translateErrors)
+        deferred.addErrback(self.protocolErrors)
+        deferred.addErrback(self.unknownError)
+
+    def _logUploadDebugging(self, upload):
+        if upload.debugID is not None:
+            for msg in upload.debugLog:
+                log.msg('Debug %s: %s' % (upload.debugID, msg))
+
     def logDebugging(self, result_or_failure):
-        if self.newFile.debugID is not None:
-            for msg in self.newFile.debugLog:
-                log.msg('Debug %s: %s' % (self.newFile.debugID, msg))
+        self._logUploadDebugging(self.newFile)
         return result_or_failure
 
     def _storeFile(self):
         return deferToThread(self.newFile.store)
 
+    def _storeUploads(self, uploads):
+        return deferToThread(store_uploads, uploads)
+
 
 class FileUploadFactory(protocol.Factory):
     protocol = FileUploadProtocol
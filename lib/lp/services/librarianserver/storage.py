@@ -6,6 +6,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 
 import errno
+import functools
 import hashlib
 import os
 import shutil
@@ -31,6 +32,7 @@ __all__ = [
     'LibrarianStorage',
     'LibraryFileUpload',
     'DuplicateFileIDError',
+    'store_uploads',
     'WrongDatabaseError',
     # _relFileLocation needed by other modules in this package.
     # Listed here to keep the import pedant happy
@@ -95,9 +97,10 @@ class LibrarianStorage:
     swift_download_attempts = 0
     swift_download_fails = 0
 
-    def __init__(self, directory, library):
+    def __init__(self, directory, library, swift_cache=None):
         self.directory = directory
         self.library = library
+        self.swift_cache = swift_cache
         self.incoming = os.path.join(self.directory, 'incoming')
         try:
             os.mkdir(self.incoming)
@@ -108,10 +111,22 @@ class LibrarianStorage:
     def hasFile(self, fileid):
         return os.access(self._fileLocation(fileid), os.F_OK)
 
+    # web.FileProducer reads in pieces of the same size.
     CHUNK_SIZE = StaticProducer.bufferSize
 
     @defer.inlineCallbacks
-    def open(self, fileid):
+    def open(self, fileid, byte_range=None, size=None):
+        """Open a file for reading.
+
+        :param fileid: The `LibraryFileContent` ID of the file.
+        :param byte_range: If not None, a (first, last) tuple of inclusive
+            byte offsets.  The returned stream starts at the first of these;
+            callers must not read past the last.
+        :param size: The size of the file, if known.  Files that are too
+            large to fill the Swift cache quickly are streamed from Swift.
+        :return: A Deferred that fires with a stream, or with None if the
+            file is missing.
+        """
         if getFeatureFlag('librarian.swift.enabled'):
             # Log our attempt.
             self.swift_download_attempts += 1
@@ -120,16 +135,41 @@ class LibrarianStorage:
                 log.msg('{} Swift download attempts, {} failures'.format(
                     self.swift_download_attempts, self.swift_download_fails))
 
+            # There's no point caching files that are still on local disk.
+            if self.swift_cache is not None and not self.hasFile(fileid):
+                # Partial fetches are usually resumed downloads of large
+                # files, so only whole fetches fill the cache.
+                stream = None
+                try:
+                    if byte_range is None and (
+                            size is None or self.swift_cache.fills(size)):
+                        stream = yield self.swift_cache.get(
+                            fileid,
+                            functools.partial(self._fillSwiftCache, fileid))
+                    else:
+                        stream = self.swift_cache.open(fileid)
+                        if stream is not None:
+                            stream.seek(byte_range[0])
+                except Exception as x:
+                    log.err(x)
+                if stream is not None:
+                    defer.returnValue(stream)
+
             # First, try and stream the file from Swift.  Try the newest
             # configured instance first.
             swift_download_fail = False
             container, name = swift.swift_location(fileid)
+            request_headers = {}
+            if byte_range is not None:
+                # Only fetch the bytes we need.
+                request_headers['Range'] = 'bytes=%d-%d' % byte_range
             for connection_pool in reversed(swift.connection_pools):
                 swift_connection = connection_pool.get()
                 try:
                     headers, chunks = yield deferToThread(
                         swift.quiet_swiftclient, swift_connection.get_object,
-                        container, name, resp_chunk_size=self.CHUNK_SIZE)
+                        container, name, resp_chunk_size=self.CHUNK_SIZE,
+                        headers=request_headers)
                     swift_stream = TxSwiftStream(
                         connection_pool, swift_connection, chunks)
                     defer.returnValue(swift_stream)
@@ -151,46 +191,119 @@ class LibrarianStorage:
 
         path = self._fileLocation(fileid)
         if os.path.exists(path):
-            defer.returnValue(open(path, 'rb'))
+            stream = open(path, 'rb')
+            if byte_range is not None:
+                stream.seek(byte_range[0])
+            defer.returnValue(stream)
+
+    def _fillSwiftCache(self, fileid, path):
+        return deferToThread(self._fetchFromSwift, fileid, path)
+
+    def _fetchFromSwift(self, fileid, path):
+        """Copy a file from Swift to `path`.
+
+        This blocks, so must be run in a thread.
+
+        :return: The size of the file, or None if it was not found in Swift
+            or is too large to cache.
+        """
+        container, name = swift.swift_location(fileid)
+        for connection_pool in reversed(swift.connection_pools):
+            swift_connection = connection_pool.get()
+            # Only connections with no response left unread can be reused.
+            reusable = False
+            try:
+                try:
+                    headers, chunks = swift.quiet_swiftclient(
+                        swift_connection.get_object, container, name,
+                        resp_chunk_size=self.CHUNK_SIZE)
+                except swiftclient.ClientException as x:
+                    if x.http_status == 404:
+                        reusable = True
+                        continue
+                    raise
+                size = int(headers['content-length'])
+                if not self.swift_cache.fills(size):
+                    # Abandon the response rather than reading it all.
+                    return None
+                with open(path, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                reusable = True
+                return size
+            finally:
+                if reusable:
+                    connection_pool.put(swift_connection)
+                else:
+                    swift_connection.close()
+        return None
 
     def _fileLocation(self, fileid):
         return os.path.join(self.directory, _relFileLocation(str(fileid)))
 
     def startAddFile(self, filename, size):
-        return LibraryFileUpload(self, filename, size)
+        upload = LibraryFileUpload(self, filename, size)
+        # Feature flags are only available in the reactor thread, so this
+        # can't wait until the upload is stored.
+        upload.deduplicate = bool(
+            getFeatureFlag('librarian.deduplicate_uploads.enabled'))
+        return upload
 
     def getFileAlias(self, aliasid, token, path):
         return self.library.getAlias(aliasid, token, path)
 
 
 class TxSwiftStream(swift.SwiftStream):
+    """A `SwiftStream` that fetches chunks in a thread.
+
+    Reads return Deferreds, and may be short: they return data from at
+    most one chunk.
+    """
+
+    @defer.inlineCallbacks
+    def _fetchAsync(self):
+        """Make sure the current chunk has unread data.
+
+        :return: A Deferred that fires with False if we have reached the
+            end of the object.
+        """
+        while not self._available():
+            if self._swift_connection is None:
+                defer.returnValue(False)
+            chunk = yield deferToThread(self._next_chunk)
+            if self.closed:
+                defer.returnValue(False)
+            self._setChunk(chunk)
+        defer.returnValue(True)
+
     @defer.inlineCallbacks
     def read(self, size):
         if self.closed:
             raise ValueError('I/O operation on closed file')
 
-        if self._swift_connection is None:
+        if self._swift_connection is None and not self._available():
             defer.returnValue(b'')  # EOF already reached, connection returned.
 
         if size == 0:
             defer.returnValue(b'')
 
-        if not self._chunk:
-            self._chunk = yield deferToThread(self._next_chunk)
-            if not self._chunk:
-                # If we have drained the data successfully,
-                # the connection can be reused saving on auth
-                # handshakes.
-                if self._swift_connection is not None:
-                    self._connection_pool.put(self._swift_connection)
-                    self._swift_connection = None
-                self._chunks = None
-                defer.returnValue(b'')
-        return_chunk = self._chunk[:size]
-        self._chunk = self._chunk[size:]
+        more = yield self._fetchAsync()
+        if not more:
+            defer.returnValue(b'')
+        defer.returnValue(self._take(size))
+
+    @defer.inlineCallbacks
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
 
-        self._offset += len(return_chunk)
-        defer.returnValue(return_chunk)
+        view = memoryview(b)
+        if len(view) == 0:
+            defer.returnValue(0)
+        more = yield self._fetchAsync()
+        if not more:
+            defer.returnValue(0)
+        defer.returnValue(self._takeInto(view))
 
 
 class LibraryFileUpload(object):
@@ -202,6 +315,9 @@ class LibraryFileUpload(object):
     expires = None
     databaseName = None
     debugID = None
+    # If True, share existing content with the same SHA-256 and size
+    # rather than storing a new copy.
+    deduplicate = False
 
     def __init__(self, storage, filename, size):
         self.storage = storage
@@ -223,8 +339,20 @@ class LibraryFileUpload(object):
         self.sha1_digester.update(data)
         self.sha256_digester.update(data)
 
+    def finishReceiving(self):
+        """Close the temporary file once all of the data has arrived.
+
+        Uploads in a batch wait for the rest of the batch before being
+        stored, and shouldn't hold a file descriptor open meanwhile.
+        """
+        self.tmpfile.close()
+
     @write_transaction
     def store(self):
+        return self._store()
+
+    def _store(self):
+        """Store the file, without committing the transaction."""
         self.debugLog.append('storing %r, size %r'
                              % (self.filename, self.size))
         self.tmpfile.close()
@@ -260,14 +388,22 @@ class LibraryFileUpload(object):
                 'database name %r ok' % (self.databaseName, ))
             # If we haven't got a contentID, we need to create one and return
             # it to the client.
+            existing = False
             if self.contentID is None:
-                contentID = self.storage.library.add(
+                contentID = None
+                if self.deduplicate:
+                    contentID = self.storage.library.lookupReusableContent(
+                        self.sha256_digester.hexdigest(), self.size)
+                    existing = contentID is not None
+                if contentID is None:
+                    contentID = self.storage.library.add(
                         dstDigest, self.size, self.md5_digester.hexdigest(),
                         self.sha256_digester.hexdigest())
                 aliasID = self.storage.library.addAlias(
                         contentID, self.filename, self.mimetype, self.expires)
-                self.debugLog.append('created contentID: %r, aliasID: %r.'
-                                     % (contentID, aliasID))
+                self.debugLog.append('%s contentID: %r, aliasID: %r.'
+                                     % ('reused' if existing else 'created',
+                                        contentID, aliasID))
             else:
                 contentID = self.contentID
                 aliasID = None
@@ -278,18 +414,22 @@ class LibraryFileUpload(object):
             self.debugLog.append('failed to get contentID/aliasID, aborting')
             raise
 
-        # Move file to final location
-        try:
-            self._move(contentID)
-        except:
-            # Abort DB transaction
-            self.debugLog.append('failed to move file, aborting')
-
-            # Remove file
+        if existing:
+            # We already have this content, so throw the new copy away.
             os.remove(self.tmpfilepath)
-
-            # Re-raise
-            raise
+        else:
+            # Move file to final location
+            try:
+                self._move(contentID)
+            except:
+                # Abort DB transaction
+                self.debugLog.append('failed to move file, aborting')
+
+                # Remove file
+                os.remove(self.tmpfilepath)
+
+                # Re-raise
+                raise
 
         # Commit any DB changes
         self.debugLog.append('committed')
@@ -312,6 +452,16 @@ class LibraryFileUpload(object):
         fsync_path(os.path.dirname(location), dir=True)
 
 
+@write_transaction
+def store_uploads(uploads):
+    """Store several `LibraryFileUpload`s in a single transaction.
+
+    :return: A list of (contentID, aliasID) tuples, as for
+        `LibraryFileUpload.store`.
+    """
+    return [upload._store() for upload in uploads]
+
+
 def _relFileLocation(file_id):
     """Return the relative location for the given file_id.
 
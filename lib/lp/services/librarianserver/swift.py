@@ -12,20 +12,25 @@ __all__ = [
     'connection_pools',
     'filesystem_path',
     'quiet_swiftclient',
+    'read_checkpoint',
     'reconfigure_connection_pools',
     'swift_location',
     'to_swift',
+    'write_checkpoint',
     ]
 
+from collections import deque
+from concurrent import futures
 from contextlib import contextmanager
+import errno
 import hashlib
+import json
 import os.path
 import re
 import time
 
 import scandir
 import six
-from six.moves.urllib.parse import quote
 from swiftclient import client as swiftclient
 
 from lp.services.config import config
@@ -57,37 +62,14 @@ def quiet_swiftclient(func, *args, **kwargs):
         swiftclient.logger.disabled = old_disabled
 
 
-def to_swift(log, start_lfc_id=None, end_lfc_id=None,
-             instance_id=None, num_instances=None, remove_func=False):
-    '''Copy a range of Librarian files from disk into Swift.
-
-    start and end identify the range of LibraryFileContent.id to
-    migrate (inclusive).
-
-    If instance_id and num_instances are set, only process files whose ID
-    have remainder instance_id when divided by num_instances.  This allows
-    running multiple feeders in parallel.
-
-    If remove_func is set, it is called for every file after being copied into
-    Swift.
-    '''
-    swift_connection = connection_pools[-1].get()
-    fs_root = os.path.abspath(config.librarian_server.root)
-
-    if start_lfc_id is None:
-        start_lfc_id = 1
-    if end_lfc_id is None:
-        # Maximum id capable of being stored on the filesystem - ffffffff
-        end_lfc_id = 0xffffffff
-
-    log.info("Walking disk store {0} from {1} to {2}, inclusive".format(
-        fs_root, start_lfc_id, end_lfc_id))
-    if instance_id is not None and num_instances is not None:
-        log.info("Parallel mode: instance ID {0} of {1}".format(
-            instance_id, num_instances))
+def _disk_files(log, fs_root, start_lfc_id, end_lfc_id):
+    """Generate (lfc_id, fs_path) for files in the disk store, in ID order.
 
+    Only directories that may contain files in the given range are walked.
+    """
     start_fs_path = filesystem_path(start_lfc_id)
     end_fs_path = filesystem_path(end_lfc_id)
+    _filename_re = re.compile('^[0-9a-f]{2}$')
 
     # Walk the Librarian on disk file store, searching for matching
     # files that may need to be copied into Swift. We need to follow
@@ -108,8 +90,6 @@ def to_swift(log, start_lfc_id=None, end_lfc_id=None,
 
         log.debug('Scanning {0} for matching files'.format(dirpath))
 
-        _filename_re = re.compile('^[0-9a-f]{2}$')
-
         for filename in sorted(filenames):
             fs_path = os.path.join(dirpath, filename)
 
@@ -124,12 +104,6 @@ def to_swift(log, start_lfc_id=None, end_lfc_id=None,
             if fs_path > end_fs_path:
                 break
 
-            # Skip files which have been modified recently, as they
-            # may be uploads still in progress.
-            if os.path.getmtime(fs_path) > time.time() - ONE_DAY:
-                log.debug('Skipping recent upload %s' % fs_path)
-                continue
-
             # Reverse engineer the LibraryFileContent.id from the
             # file's path. Warn about and skip bad filenames.
             rel_fs_path = fs_path[len(fs_root) + 1:]
@@ -143,32 +117,208 @@ def to_swift(log, start_lfc_id=None, end_lfc_id=None,
             except ValueError:
                 log.warning('Invalid hex fail, skipping {0}'.format(fs_path))
                 continue
+            yield lfc, fs_path
+
+
+def read_checkpoint(path):
+    """Return the `LibraryFileContent.id` recorded in a checkpoint file.
+
+    Returns None if there is no checkpoint.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            return int(checkpoint_file.read().strip())
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def write_checkpoint(path, lfc_id):
+    """Atomically record a `LibraryFileContent.id` in a checkpoint file."""
+    temp_path = path + '.new'
+    with open(temp_path, 'w') as checkpoint_file:
+        checkpoint_file.write('%d\n' % lfc_id)
+    os.rename(temp_path, path)
+
+
+class _FeedProgress:
+    """Track which files `to_swift` has finished with, in ID order.
+
+    Uploads complete out of order, so the checkpoint is the highest ID
+    such that it and all earlier IDs in the walk have been dealt with.
+    """
+
+    # A file that we skipped, but that a later run should try again.
+    _RETRY = object()
+
+    # Save the checkpoint at most this often, in seconds.
+    save_interval = 10
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = None
+        self._saved = None
+        self._saved_at = time.time()
+        # (lfc_id, future) in walk order; future is None if there is
+        # nothing to wait for.
+        self._queue = deque()
+
+    def add(self, lfc_id, future=None):
+        self._queue.append((lfc_id, future))
+
+    def retry(self, lfc_id):
+        self._queue.append((lfc_id, self._RETRY))
+
+    def advance(self):
+        while self._queue:
+            lfc_id, future = self._queue[0]
+            if future is self._RETRY:
+                break
+            if future is not None and (
+                    not future.done() or future.cancelled() or
+                    future.exception() is not None):
+                break
+            self._queue.popleft()
+            self.checkpoint = lfc_id
+        if time.time() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if (self.checkpoint_path is not None and
+                self.checkpoint is not None and
+                self.checkpoint != self._saved):
+            write_checkpoint(self.checkpoint_path, self.checkpoint)
+            self._saved = self.checkpoint
+        self._saved_at = time.time()
+
+
+def _upload_file(log, lfc_id, fs_path, db_md5_hash, remove_func=None):
+    """Copy a file into Swift using a connection from the newest pool.
+
+    This is run in `to_swift`'s worker threads, so must not touch the
+    database.
+    """
+    connection_pool = connection_pools[-1]
+    swift_connection = connection_pool.get()
+    try:
+        _to_swift_file(
+            log, swift_connection, lfc_id, fs_path, db_md5_hash=db_md5_hash)
+    except Exception:
+        swift_connection.close()
+        raise
+    connection_pool.put(swift_connection)
+    if remove_func:
+        remove_func(fs_path)
+
+
+def to_swift(log, start_lfc_id=None, end_lfc_id=None,
+             instance_id=None, num_instances=None, remove_func=False,
+             workers=1, checkpoint_path=None):
+    '''Copy a range of Librarian files from disk into Swift.
+
+    start and end identify the range of LibraryFileContent.id to
+    migrate (inclusive).
+
+    If instance_id and num_instances are set, only process files whose ID
+    have remainder instance_id when divided by num_instances.  This allows
+    running multiple feeders in parallel.
+
+    If remove_func is set, it is called for every file after being copied into
+    Swift.
+
+    Files are uploaded by a pool of `workers` threads, each using its own
+    connection from the shared connection pool, while this thread walks
+    the disk store and checks the database.
+
+    If checkpoint_path is set, the highest ID such that it and all
+    earlier files in the range have been dealt with is recorded in that
+    file, and later runs resume from there rather than walking the whole
+    range again.  Recent uploads that are skipped hold the checkpoint
+    back, so that a later run will pick them up.
+    '''
+    fs_root = os.path.abspath(config.librarian_server.root)
+
+    if start_lfc_id is None:
+        start_lfc_id = 1
+    if end_lfc_id is None:
+        # Maximum id capable of being stored on the filesystem - ffffffff
+        end_lfc_id = 0xffffffff
+
+    if checkpoint_path is not None:
+        checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint is not None and checkpoint >= start_lfc_id:
+            log.info("Resuming after {0} from checkpoint {1}".format(
+                checkpoint, checkpoint_path))
+            start_lfc_id = checkpoint + 1
+
+    log.info("Walking disk store {0} from {1} to {2}, inclusive".format(
+        fs_root, start_lfc_id, end_lfc_id))
+    if instance_id is not None and num_instances is not None:
+        log.info("Parallel mode: instance ID {0} of {1}".format(
+            instance_id, num_instances))
+
+    progress = _FeedProgress(checkpoint_path)
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    in_flight = set()
+
+    def collect(return_when):
+        done, not_done = futures.wait(in_flight, return_when=return_when)
+        in_flight.difference_update(done)
+        # Raise any exception from the workers.
+        for future in done:
+            future.result()
+        progress.advance()
+
+    try:
+        for lfc, fs_path in _disk_files(
+                log, fs_root, start_lfc_id, end_lfc_id):
             if instance_id is not None and num_instances is not None:
                 if (lfc % num_instances) != instance_id:
+                    progress.add(lfc)
                     continue
 
-            log.debug('Found {0} ({1})'.format(lfc, filename))
+            # Skip files which have been modified recently, as they
+            # may be uploads still in progress.
+            if os.path.getmtime(fs_path) > time.time() - ONE_DAY:
+                log.debug('Skipping recent upload %s' % fs_path)
+                progress.retry(lfc)
+                continue
+
+            log.debug('Found {0} ({1})'.format(lfc, fs_path))
 
-            if ISlaveStore(LibraryFileContent).get(
-                    LibraryFileContent, lfc) is None:
+            lfc_row = ISlaveStore(LibraryFileContent).get(
+                LibraryFileContent, lfc)
+            if lfc_row is None:
                 log.info("{0} exists on disk but not in the db".format(
                     lfc))
+                progress.add(lfc)
                 continue
 
-            _to_swift_file(log, swift_connection, lfc, fs_path)
-
-            if remove_func:
-                remove_func(fs_path)
-
-    connection_pools[-1].put(swift_connection)
+            # Don't let the walk get too far ahead of the uploads.
+            while len(in_flight) >= workers * 2:
+                collect(futures.FIRST_COMPLETED)
+            future = executor.submit(
+                _upload_file, log, lfc, fs_path, lfc_row.md5,
+                remove_func=remove_func)
+            in_flight.add(future)
+            progress.add(lfc, future)
+        collect(futures.ALL_COMPLETED)
+    finally:
+        executor.shutdown(wait=True)
+        progress.advance()
+        progress.save()
 
 
-def _to_swift_file(log, swift_connection, lfc_id, fs_path):
+def _to_swift_file(log, swift_connection, lfc_id, fs_path,
+                   db_md5_hash=None):
     '''Copy a single file into Swift.
 
     This is separate for the benefit of tests; production code should use
     `to_swift` rather than calling this function directly, since this omits
     a number of checks.
+
+    If db_md5_hash is None, it is looked up in the database.
     '''
     container, obj_name = swift_location(lfc_id)
 
@@ -188,6 +338,7 @@ def _to_swift_file(log, swift_connection, lfc_id, fs_path):
             "{0} already exists in Swift({1}, {2})".format(
                 lfc_id, container, obj_name))
         if ('X-Object-Manifest' not in headers and
+                'x-static-large-object' not in headers and
                 int(headers['content-length'])
                 != os.path.getsize(fs_path)):
             raise AssertionError(
@@ -197,7 +348,9 @@ def _to_swift_file(log, swift_connection, lfc_id, fs_path):
             raise
         log.info('Putting {0} into Swift ({1}, {2})'.format(
             lfc_id, container, obj_name))
-        _put(log, swift_connection, lfc_id, container, obj_name, fs_path)
+        _put(
+            log, swift_connection, lfc_id, container, obj_name, fs_path,
+            db_md5_hash=db_md5_hash)
 
 
 def rename(path):
@@ -207,12 +360,14 @@ def rename(path):
     os.rename(path, path + '.migrated')
 
 
-def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
+def _put(log, swift_connection, lfc_id, container, obj_name, fs_path,
+         db_md5_hash=None):
     fs_size = os.path.getsize(fs_path)
     fs_file = HashStream(open(fs_path, 'rb'))
 
-    db_md5_hash = ISlaveStore(LibraryFileContent).get(
-        LibraryFileContent, lfc_id).md5
+    if db_md5_hash is None:
+        db_md5_hash = ISlaveStore(LibraryFileContent).get(
+            LibraryFileContent, lfc_id).md5
 
     assert hasattr(fs_file, 'tell') and hasattr(fs_file, 'seek'), '''
         File not rewindable
@@ -233,13 +388,13 @@ def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
                 log.exception('Failed to delete corrupt file from Swift')
             raise AssertionError('md5 mismatch')
     else:
-        # Large file upload. Create the segments first, then the
-        # manifest. This order prevents partial downloads, and lets us
-        # detect interrupted uploads and clean up.
-        segment = 0
+        # Large file upload, as a static large object.  Create the
+        # segments first, then the manifest.  This order prevents partial
+        # downloads, and lets us detect interrupted uploads and clean up.
+        segments = []
         while fs_file.tell() < fs_size:
-            assert segment <= 9999, 'Insane number of segments'
-            seg_name = '%s/%04d' % (obj_name, segment)
+            assert len(segments) <= 999, 'Insane number of segments'
+            seg_name = '%s/%04d' % (obj_name, len(segments))
             seg_size = min(fs_size - fs_file.tell(), MAX_SWIFT_OBJECT_SIZE)
             md5_stream = HashStream(fs_file, length=seg_size)
             swift_md5_hash = swift_connection.put_object(
@@ -247,8 +402,12 @@ def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
             segment_md5_hash = md5_stream.hash.hexdigest()
             assert swift_md5_hash == segment_md5_hash, (
                 "LibraryFileContent({0}) segment {1} upload corrupted".format(
-                    lfc_id, segment))
-            segment = segment + 1
+                    lfc_id, len(segments)))
+            segments.append({
+                'path': '/{0}/{1}'.format(container, seg_name),
+                'etag': segment_md5_hash,
+                'size_bytes': seg_size,
+                })
 
         disk_md5_hash = fs_file.hash.hexdigest()
         if disk_md5_hash != db_md5_hash:
@@ -260,10 +419,10 @@ def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
                     lfc_id, disk_md5_hash, db_md5_hash))
             raise AssertionError('md5 mismatch')
 
-        manifest = '{0}/{1}/'.format(quote(container), quote(obj_name))
-        manifest_headers = {'X-Object-Manifest': manifest}
+        manifest = json.dumps(segments).encode('UTF-8')
         swift_connection.put_object(
-            container, obj_name, b'', 0, headers=manifest_headers)
+            container, obj_name, manifest, len(manifest),
+            query_string='multipart-manifest=put')
 
 
 def swift_location(lfc_id):
@@ -294,6 +453,14 @@ def filesystem_path(lfc_id):
 
 
 class SwiftStream:
+    """A file-like object reading an object from Swift.
+
+    Chunks are kept as swiftclient returns them, and we track our position
+    within the current chunk rather than slicing off what has been read.
+    Reads that line up with chunk boundaries hand chunks over without
+    copying them, and nothing is ever copied more than once.
+    """
+
     def __init__(self, connection_pool, swift_connection, chunks):
         self._connection_pool = connection_pool
         self._swift_connection = swift_connection
@@ -302,39 +469,105 @@ class SwiftStream:
         self.closed = False
         self._offset = 0
         self._chunk = None
+        self._chunk_view = None
+        self._chunk_offset = 0
+
+    def _available(self):
+        """Return the number of unread bytes in the current chunk."""
+        if self._chunk is None:
+            return 0
+        return len(self._chunk) - self._chunk_offset
+
+    def _setChunk(self, chunk):
+        """Start reading a new chunk, or finish if there are no more."""
+        if chunk:
+            self._chunk = chunk
+            self._chunk_view = None
+            self._chunk_offset = 0
+        else:
+            self._chunk = self._chunk_view = None
+            # If we have drained the data successfully, the connection
+            # can be reused saving on auth handshakes.
+            if self._swift_connection is not None:
+                self._connection_pool.put(self._swift_connection)
+                self._swift_connection = None
+            self._chunks = None
+
+    def _fetch(self):
+        """Make sure the current chunk has unread data.
+
+        :return: False if we have reached the end of the object.
+        """
+        while not self._available():
+            if self._swift_connection is None:
+                return False
+            self._setChunk(self._next_chunk())
+        return True
+
+    def _take(self, size):
+        """Return up to `size` bytes from the current chunk."""
+        start = self._chunk_offset
+        if start == 0 and size >= len(self._chunk):
+            data = self._chunk
+        else:
+            data = self._chunk[start:start + size]
+        self._chunk_offset += len(data)
+        self._offset += len(data)
+        return data
+
+    def _takeInto(self, view, offset=0):
+        """Copy bytes from the current chunk into `view[offset:]`.
+
+        :return: The number of bytes copied.
+        """
+        if self._chunk_view is None:
+            self._chunk_view = memoryview(self._chunk)
+        start = self._chunk_offset
+        size = min(len(view) - offset, self._available())
+        view[offset:offset + size] = self._chunk_view[start:start + size]
+        self._chunk_offset += size
+        self._offset += size
+        return size
 
     def read(self, size):
         if self.closed:
             raise ValueError('I/O operation on closed file')
 
-        if self._swift_connection is None:
+        if self._swift_connection is None and not self._available():
             return b''
 
         if size == 0:
             return b''
 
+        if not self._fetch():
+            return b''
+        if self._available() >= size:
+            return self._take(size)
+
+        # The read spans chunks.  Joining the pieces copies each byte
+        # once; whole chunks in the middle are not sliced.
         return_chunks = []
         return_size = 0
-
-        while return_size < size:
-            if not self._chunk:
-                self._chunk = self._next_chunk()
-                if not self._chunk:
-                    # If we have drained the data successfully,
-                    # the connection can be reused saving on auth
-                    # handshakes.
-                    self._connection_pool.put(self._swift_connection)
-                    self._swift_connection = None
-                    self._chunks = None
-                    break
-            split = size - return_size
-            return_chunks.append(self._chunk[:split])
-            self._chunk = self._chunk[split:]
+        while return_size < size and self._fetch():
+            return_chunks.append(self._take(size - return_size))
             return_size += len(return_chunks[-1])
-
-        self._offset += return_size
         return b''.join(return_chunks)
 
+    def readinto(self, b):
+        """Read bytes into a pre-allocated writable buffer.
+
+        :return: The number of bytes read, which is only less than
+            `len(b)` at the end of the object.
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        view = memoryview(b)
+        filled = 0
+        while filled < len(view) and self._fetch():
+            filled += self._takeInto(view, filled)
+        return filled
+
     def _next_chunk(self):
         try:
             return next(self._chunks)
@@ -343,6 +576,7 @@ class SwiftStream:
 
     def close(self):
         self.closed = True
+        self._chunk = self._chunk_view = None
         if self._swift_connection is not None:
             self._swift_connection.close()
             self._swift_connection = None
@@ -350,8 +584,13 @@ class SwiftStream:
     def seek(self, offset):
         if offset < self._offset:
             raise NotImplementedError('rewind')  # Rewind not supported
-        else:
-            self.read(offset - self._offset)
+        # Skip forward without copying anything.
+        remaining = offset - self._offset
+        while remaining and self._fetch():
+            skip = min(remaining, self._available())
+            self._chunk_offset += skip
+            self._offset += skip
+            remaining -= skip
 
     def tell(self):
         return self._offset
@@ -0,0 +1,225 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A local on-disk cache of librarian files stored in Swift."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'SwiftCache',
+    ]
+
+from collections import OrderedDict
+import errno
+import os
+import tempfile
+
+from twisted.internet import defer
+from twisted.python import log
+from zope.component import getUtility
+
+from lp.services.config import config
+from lp.services.librarianserver.storage import _relFileLocation
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
+
+
+class SwiftCache:
+    """A bounded least-recently-used cache of Swift objects on local disk.
+
+    Entries are keyed by `LibraryFileContent` ID, and laid out in the same
+    way as the librarian's own disk store.  The cache is only ever used
+    from the reactor thread, so its bookkeeping needs no locking; the
+    `fill` callables passed to `get` are responsible for doing any
+    blocking work in threads.
+    """
+
+    # How often to log cache statistics, in lookups.
+    log_interval = 1000
+
+    def __init__(self, directory, max_size, fill_max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.fill_max_size = fill_max_size
+        self.incoming = os.path.join(self.directory, 'incoming')
+        # Maps content ID to file size, least recently used first.
+        self._entries = OrderedDict()
+        self._size = 0
+        # Maps content ID to a list of Deferreds waiting for that entry to
+        # be filled.
+        self._filling = {}
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self._load()
+
+    @classmethod
+    def fromConfig(cls):
+        """Make a cache as configured, or return None if it is disabled."""
+        if not config.librarian_server.swift_cache_size:
+            return None
+        return cls(
+            config.librarian_server.swift_cache_directory,
+            config.librarian_server.swift_cache_size,
+            config.librarian_server.swift_cache_fill_max_size)
+
+    @property
+    def size(self):
+        """The total size of the files in the cache."""
+        return self._size
+
+    def __contains__(self, fileid):
+        return int(fileid) in self._entries
+
+    def _path(self, fileid):
+        return os.path.join(self.directory, _relFileLocation(fileid))
+
+    def _load(self):
+        """Index any files left in the cache directory by a previous run."""
+        try:
+            os.makedirs(self.incoming)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            if dirpath == self.incoming:
+                # Partial fills can't be trusted.
+                for filename in filenames:
+                    os.unlink(os.path.join(dirpath, filename))
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, self.directory)
+                try:
+                    fileid = int(relpath.replace(os.sep, ''), 16)
+                except ValueError:
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_atime, fileid, stat.st_size))
+        for _, fileid, size in sorted(found):
+            self._entries[fileid] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            fileid, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                # Anyone still reading the file keeps their open handle.
+                os.unlink(self._path(fileid))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def accepts(self, size):
+        """Would a file of this size be worth caching?"""
+        # Don't let a single file flush more than half of the cache.
+        return size <= self.max_size // 2
+
+    def fills(self, size):
+        """Should a file of this size be fetched into the cache on a miss?
+
+        Callers of `get` wait for the whole file to be fetched, so large
+        files are better streamed to the client directly.
+        """
+        if self.fill_max_size is not None and size > self.fill_max_size:
+            return False
+        return self.accepts(size)
+
+    def _open(self, fileid):
+        size = self._entries.pop(fileid, None)
+        if size is None:
+            return None
+        try:
+            stream = open(self._path(fileid), 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # Somebody removed it behind our back.
+            self._size -= size
+            return None
+        # Mark this entry as the most recently used.
+        self._entries[fileid] = size
+        return stream
+
+    def _count(self, result):
+        if result == 'hit':
+            self.hits += 1
+        elif result == 'miss':
+            self.misses += 1
+        else:
+            self.waits += 1
+        getUtility(IStatsdClient).incr(
+            'librarian.swift_cache.lookup', labels={'result': result})
+        lookups = self.hits + self.misses + self.waits
+        if lookups % self.log_interval == 0:
+            log.msg(
+                'Swift cache: {} hits, {} misses, {} waits, {} evictions, '
+                '{} files, {} bytes'.format(
+                    self.hits, self.misses, self.waits, self.evictions,
+                    len(self._entries), self._size))
+            getUtility(IStatsdClient).gauge(
+                'librarian.swift_cache.size', self._size)
+
+    def open(self, fileid):
+        """Open a cached file for reading, without filling the cache.
+
+        :return: A file object, or None if the file is not cached.
+        """
+        stream = self._open(int(fileid))
+        self._count('miss' if stream is None else 'hit')
+        return stream
+
+    @defer.inlineCallbacks
+    def get(self, fileid, fill):
+        """Open a cached file for reading, filling the cache if needed.
+
+        Only one fill is ever in progress for any given file; other
+        callers asking for the same file wait for it to finish.
+
+        :param fileid: The `LibraryFileContent` ID of the file.
+        :param fill: A callable that takes the path of a temporary file,
+            writes the file's contents to it, and returns a Deferred that
+            fires with the file's size, or with None if the file cannot or
+            should not be cached.
+        :return: A Deferred that fires with a file object, or with None if
+            the file could not be cached.
+        """
+        fileid = int(fileid)
+        stream = self._open(fileid)
+        if stream is not None:
+            self._count('hit')
+            defer.returnValue(stream)
+        if fileid in self._filling:
+            self._count('wait')
+            waiter = defer.Deferred()
+            self._filling[fileid].append(waiter)
+            yield waiter
+            defer.returnValue(self._open(fileid))
+        self._count('miss')
+        self._filling[fileid] = []
+        fd, temp_path = tempfile.mkstemp(dir=self.incoming)
+        os.close(fd)
+        try:
+            size = yield fill(temp_path)
+            if size is not None and self.accepts(size):
+                path = self._path(fileid)
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.rename(temp_path, path)
+                self._entries[fileid] = size
+                self._size += size
+                self._evict()
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            for waiter in self._filling.pop(fileid):
+                waiter.callback(None)
+        defer.returnValue(self._open(fileid))
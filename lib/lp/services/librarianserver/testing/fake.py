@@ -95,6 +95,10 @@ class FakeLibrarian(Fixture):
         return self._storeFile(
             name, size, file, contentType, expires=expires).id
 
+    def addFiles(self, files, debugID=None):
+        """See `IFileUploadClient`."""
+        return [self.addFile(**spec) for spec in files]
+
     def _storeFile(self, name, size, file, contentType, expires=None):
         """Like `addFile`, but returns the `LibraryFileAlias`."""
         content = file.read()
@@ -131,6 +135,12 @@ class FakeLibrarian(Fixture):
         alias.checkCommitted()
         return io.BytesIO(alias.content_bytes)
 
+    def getFilesByAlias(self, aliasIDs,
+                        timeout=LIBRARIAN_SERVER_DEFAULT_TIMEOUT,
+                        max_workers=4):
+        """See `IFileDownloadClient`."""
+        return [self.getFileByAlias(aliasID) for aliasID in aliasIDs]
+
     def pretendCommit(self):
         """Pretend that there's been a commit.
 
@@ -5,8 +5,14 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 
+from datetime import (
+    datetime,
+    timedelta,
+    )
+
 from fixtures import MockPatchObject
 from pymacaroons import Macaroon
+import pytz
 from testtools.testcase import ExpectedException
 from testtools.twistedsupport import AsynchronousDeferredRunTest
 import transaction
@@ -62,6 +68,22 @@ class DBTestCase(TestCase):
         self.assertEqual('file1', alias.filename)
         self.assertEqual('text/unknown', alias.mimetype)
 
+    def test_lookupReusableContent(self):
+        # lookupReusableContent only finds content with a matching SHA-256
+        # and size that has an alias that won't expire soon.
+        library = db.Library()
+        fileID = library.add('deadbeef', 1234, 'abababab', 'babababa')
+        self.assertIsNone(library.lookupReusableContent('babababa', 1234))
+        library.addAlias(
+            fileID, 'file1', 'text/unknown',
+            expires=datetime.now(pytz.UTC) + timedelta(hours=1))
+        self.assertIsNone(library.lookupReusableContent('babababa', 1234))
+        library.addAlias(fileID, 'file2', 'text/unknown')
+        self.assertEqual(
+            fileID, library.lookupReusableContent('babababa', 1234))
+        self.assertIsNone(library.lookupReusableContent('babababa', 4321))
+        self.assertIsNone(library.lookupReusableContent('deadbeef', 1234))
+
 
 @implementer(IMacaroonIssuer)
 class DummyMacaroonIssuer(MacaroonIssuerBase):
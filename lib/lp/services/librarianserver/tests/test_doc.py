@@ -41,8 +41,12 @@ class MockTransport:
 class MockLibrary:
     file = None
 
+    def __init__(self):
+        self.files = []
+
     def startAddFile(self, name, size):
         self.file = MockFile(name)
+        self.files.append(self.file)
         return self.file
 
 
@@ -59,6 +63,9 @@ class MockFile:
     def append(self, bytes):
         self.bytes += bytes
 
+    def finishReceiving(self):
+        pass
+
     def store(self):
         databaseName = self.databaseName
         if databaseName is not None and databaseName != 'right_database':
@@ -107,6 +114,8 @@ def upload_request(request):
     #  * hook _storeFile to dispatch straight to newFile.store without
     #    spawning a thread.
     server._storeFile = lambda: defer.maybeDeferred(server.newFile.store)
+    server._storeUploads = lambda uploads: defer.maybeDeferred(
+        lambda: [upload.store() for upload in uploads])
 
     #  * give it a fake transport
     server.transport = MockTransport()
@@ -126,11 +135,11 @@ def upload_request(request):
     if server.transport.connectionLost:
         print('connection closed')
 
-    mockFile = server.fileLibrary.file
-    if mockFile is not None and mockFile.stored:
-        print("file '%s' stored as %s, contents: %r" % (
-                mockFile.name, mockFile.mimetype,
-                six.ensure_str(mockFile.bytes)))
+    for mockFile in server.fileLibrary.files:
+        if mockFile.stored:
+            print("file '%s' stored as %s, contents: %r" % (
+                    mockFile.name, mockFile.mimetype,
+                    six.ensure_str(mockFile.bytes)))
 
     # Cleanup: remove the observer.
     log.removeObserver(log_observer)
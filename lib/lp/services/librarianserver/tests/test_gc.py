@@ -25,7 +25,10 @@ from subprocess import (
 import sys
 import tempfile
 
-from fixtures import MockPatchObject
+from fixtures import (
+    MockPatchObject,
+    TempDir,
+    )
 import pytz
 import requests
 from six.moves.urllib.parse import urljoin
@@ -45,6 +48,7 @@ from lp.services.database.sqlbase import (
     cursor,
     ISOLATION_LEVEL_AUTOCOMMIT,
     )
+from lp.services.features import getFeatureFlag
 from lp.services.features.testing import FeatureFixture
 from lp.services.librarian.client import LibrarianClient
 from lp.services.librarian.model import (
@@ -523,6 +527,57 @@ class TestLibrarianGarbageCollectionBase:
         for content_id in (row[0] for row in cur.fetchall()):
             self.assertTrue(self.file_exists(content_id))
 
+    def _makeOrphan(self):
+        """Delete a LibraryFileContent row, leaving its file behind."""
+        self.ztm.begin()
+        cur = cursor()
+        cur.execute("""
+            SELECT LibraryFileContent.id
+            FROM LibraryFileContent
+            LEFT OUTER JOIN LibraryFileAlias
+                ON LibraryFileContent.id = content
+            WHERE LibraryFileAlias.id IS NULL
+            LIMIT 1
+            """)
+        content_id = cur.fetchone()[0]
+        cur.execute("""
+                DELETE FROM LibraryFileContent WHERE id=%s
+                """, (content_id,))
+        self.ztm.commit()
+        self.assertTrue(self.file_exists(content_id))
+        return content_id
+
+    def test_delete_unwanted_files_dry_run(self):
+        # In dry-run mode, delete_unwanted_files only reports what it
+        # would delete.
+        content_id = self._makeOrphan()
+        with self.librariangc_thinking_it_is_tomorrow():
+            librariangc.delete_unwanted_files(self.con, dry_run=True)
+        self.assertTrue(self.file_exists(content_id))
+        self.assertIn("Would delete 1 files", librariangc.log.getLogBuffer())
+
+    def test_delete_unwanted_files_checkpoint(self):
+        # If there is a checkpoint, delete_unwanted_files resumes after it,
+        # and removes it once the sweep is complete.
+        content_id = self._makeOrphan()
+        checkpoint_dir = self.useFixture(TempDir()).path
+        names = ['disk']
+        if getFeatureFlag('librarian.swift.enabled'):
+            names.append('swift')
+        for name in names:
+            swift.write_checkpoint(
+                os.path.join(checkpoint_dir, name), content_id)
+        with self.librariangc_thinking_it_is_tomorrow():
+            librariangc.delete_unwanted_files(
+                self.con, checkpoint_dir=checkpoint_dir)
+        self.assertTrue(self.file_exists(content_id))
+        self.assertEqual([], os.listdir(checkpoint_dir))
+
+        with self.librariangc_thinking_it_is_tomorrow():
+            librariangc.delete_unwanted_files(
+                self.con, checkpoint_dir=checkpoint_dir)
+        self.assertFalse(self.file_exists(content_id))
+
     def test_delete_unwanted_files_bug437084(self):
         # There was a bug where delete_unwanted_files() would die
         # if the last file found on disk was unwanted.
@@ -608,6 +663,27 @@ class TestLibrarianGarbageCollectionBase:
                 )
 
 
+class TestMergeWanted(TestCase):
+
+    def test_merge_wanted(self):
+        # merge_wanted marks each stored file as wanted or not, and
+        # reports wanted content IDs with no stored files.
+        found = [(1, 'a'), (1, 'b'), (2, 'c'), (5, 'd'), (6, 'e')]
+        self.assertEqual(
+            [(1, 'a', True), (1, 'b', True), (2, 'c', False),
+             (3, None, True), (5, 'd', True), (6, 'e', False),
+             (7, None, True)],
+            list(librariangc.merge_wanted(iter([1, 3, 5, 7]), found)))
+
+    def test_merge_wanted_empty(self):
+        self.assertEqual(
+            [(1, 'a', False)],
+            list(librariangc.merge_wanted(iter([]), [(1, 'a')])))
+        self.assertEqual(
+            [(1, None, True), (2, None, True)],
+            list(librariangc.merge_wanted(iter([1, 2]), [])))
+
+
 class TestDiskLibrarianGarbageCollection(
     TestLibrarianGarbageCollectionBase, TestCase):
 
@@ -4,6 +4,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import hashlib
+import os
 import shutil
 import tempfile
 import unittest
@@ -111,6 +112,47 @@ class LibrarianStorageTestCase(unittest.TestCase):
         self.assertEqual(sha1, lfc.sha1)
         self.assertEqual(sha256, lfc.sha256)
 
+    def test_finishReceiving(self):
+        # Finishing receiving an upload closes its temporary file, and it
+        # can still be stored afterwards.
+        data = b'i am some data'
+        newfile = self.storage.startAddFile('file', len(data))
+        newfile.append(data)
+        newfile.finishReceiving()
+        self.assertTrue(newfile.tmpfile.closed)
+        lfc_id, lfa_id = newfile.store()
+        self.assertTrue(self.storage.hasFile(lfc_id))
+
+    def test_deduplicate(self):
+        # If deduplication is enabled, an upload whose content we already
+        # have gets a new alias for the existing content, and the new copy
+        # is discarded.
+        data = b'i am some data'
+        newfile = self.storage.startAddFile('file1', len(data))
+        newfile.append(data)
+        lfc_id, lfa_id = newfile.store()
+
+        newfile = self.storage.startAddFile('file2', len(data))
+        newfile.deduplicate = True
+        newfile.append(data)
+        lfc_id2, lfa_id2 = newfile.store()
+        self.assertEqual(lfc_id, lfc_id2)
+        self.assertNotEqual(lfa_id, lfa_id2)
+        self.assertEqual(
+            ['file1', 'file2'],
+            [filename for _, filename, _ in sorted(
+                self.storage.library.getAliases(lfc_id))])
+        self.assertEqual([], os.listdir(self.storage.incoming))
+
+        # Different content is stored as usual.
+        data += b'more data'
+        newfile = self.storage.startAddFile('file3', len(data))
+        newfile.deduplicate = True
+        newfile.append(data)
+        lfc_id3, _ = newfile.store()
+        self.assertNotEqual(lfc_id, lfc_id3)
+        self.assertTrue(self.storage.hasFile(lfc_id3))
+
 
 class StubLibrary:
     # Used by test_multipleFilesInOnePrefixedDirectory
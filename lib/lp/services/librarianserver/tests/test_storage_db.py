@@ -7,7 +7,10 @@ import hashlib
 import os.path
 import time
 
-from fixtures import TempDir
+from fixtures import (
+    MockPatchObject,
+    TempDir,
+    )
 from swiftclient import client as swiftclient
 from testtools.testcase import ExpectedException
 from testtools.twistedsupport import AsynchronousDeferredRunTest
@@ -26,7 +29,9 @@ from lp.services.librarianserver.storage import (
     DuplicateFileIDError,
     LibrarianStorage,
     LibraryFileUpload,
+    TxSwiftStream,
     )
+from lp.services.librarianserver.swiftcache import SwiftCache
 from lp.services.log.logger import DevNullLogger
 from lp.testing import TestCase
 from lp.testing.dbuser import switch_dbuser
@@ -198,6 +203,104 @@ class LibrarianStorageSwiftTests(TestCase):
         self.assertEqual(b''.join(chunks), data)
         self.assertEqual(1, len(swift.connection_pools[-1]._pool))
 
+    @defer.inlineCallbacks
+    def test_range_fetch(self):
+        # A byte range can be fetched from Swift without fetching the
+        # rest of the file.
+        data = b''.join(b'%06d' % i for i in range(self.storage.CHUNK_SIZE))
+        newfile = self.storage.startAddFile('file', len(data))
+        newfile.mimetype = 'text/plain'
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        self.moveToSwift(lfc_id)
+        stream = yield self.storage.open(lfc_id, byte_range=(1000, 1999))
+        self.assertIsNotNone(stream)
+        chunks = []
+        while True:
+            chunk = yield stream.read(self.storage.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(data[1000:2000], b''.join(chunks))
+
+    @defer.inlineCallbacks
+    def test_swift_cache(self):
+        # If a Swift cache is configured, whole files are fetched into it
+        # once and then served from local disk.
+        self.storage.swift_cache = SwiftCache(
+            self.useFixture(TempDir()).path, 1024 * 1024)
+        data = b''.join(b'%06d' % i for i in range(10000))
+        newfile = self.storage.startAddFile('file', len(data))
+        newfile.mimetype = 'text/plain'
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        self.moveToSwift(lfc_id)
+        # A range request doesn't fill the cache.
+        stream = yield self.storage.open(lfc_id, byte_range=(6, 11))
+        chunk = yield stream.read(6)
+        self.assertEqual(b'000001', chunk)
+        stream.close()
+        self.assertNotIn(lfc_id, self.storage.swift_cache)
+        stream = yield self.storage.open(lfc_id)
+        self.assertEqual(data, stream.read())
+        stream.close()
+        self.assertIn(lfc_id, self.storage.swift_cache)
+        # The connection used to fill the cache was returned to the pool.
+        self.assertEqual(1, len(swift.connection_pools[-1]._pool))
+        # Later requests don't need Swift at all.
+        container, name = swift.swift_location(lfc_id)
+        with swift.connection() as swift_connection:
+            swift_connection.delete_object(container, name)
+        stream = yield self.storage.open(lfc_id)
+        self.assertEqual(data, stream.read())
+        stream.close()
+        stream = yield self.storage.open(lfc_id, byte_range=(6, 11))
+        self.assertEqual(b'000001', stream.read(6))
+        stream.close()
+        self.assertEqual(
+            (2, 2), (self.storage.swift_cache.hits,
+                     self.storage.swift_cache.misses))
+
+    @defer.inlineCallbacks
+    def test_swift_cache_large_file(self):
+        # Files larger than swift_cache_fill_max_size are streamed from
+        # Swift rather than fetched into the cache first.
+        self.storage.swift_cache = SwiftCache(
+            self.useFixture(TempDir()).path, 1024 * 1024, fill_max_size=100)
+        data = b'x' * 1000
+        newfile = self.storage.startAddFile('file', len(data))
+        newfile.mimetype = 'text/plain'
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        self.moveToSwift(lfc_id)
+        stream = yield self.storage.open(lfc_id, size=len(data))
+        self.assertIsInstance(stream, TxSwiftStream)
+        chunk = yield stream.read(len(data))
+        self.assertEqual(data, chunk)
+        stream.close()
+        self.assertNotIn(lfc_id, self.storage.swift_cache)
+
+    def test_fetchFromSwift_error_closes_connection(self):
+        # If fetching a file into the Swift cache fails, the connection is
+        # closed rather than returned to the pool with a response pending.
+        self.storage.swift_cache = SwiftCache(
+            self.useFixture(TempDir()).path, 1024 * 1024)
+        swift_connection = swift.connection_pools[-1].get()
+        self.useFixture(MockPatchObject(
+            swift.connection_pools[-1], 'get',
+            return_value=swift_connection))
+        close = self.useFixture(
+            MockPatchObject(swift_connection, 'close')).mock
+        self.useFixture(MockPatchObject(
+            swift, 'quiet_swiftclient',
+            side_effect=swiftclient.ClientException('boom', http_status=503)))
+        path = os.path.join(self.directory, 'fill')
+        self.assertRaises(
+            swiftclient.ClientException,
+            self.storage._fetchFromSwift, 1, path)
+        close.assert_called_once_with()
+        self.assertEqual(0, len(swift.connection_pools[-1]._pool))
+
     @defer.inlineCallbacks
     def test_partial_fetch_does_not_reuse_connection(self):
         # If only part of a file is fetched, the Swift connection is not
@@ -9,9 +9,11 @@ __metaclass__ = type
 
 import hashlib
 import io
+import json
 import os.path
 import time
 
+from fixtures import TempDir
 from mock import patch
 import six
 from swiftclient import client as swiftclient
@@ -309,11 +311,18 @@ class TestFeedSwift(TestCase):
         # instead we examine it directly in Swift as best we can.
         swift_client = self.swift_fixture.connect()
 
-        # The manifest exists. Unfortunately, we can't test that the
-        # magic manifest header is set correctly.
+        # The static large object manifest lists the segments.
+        # Unfortunately, we can't test that it was uploaded with the
+        # magic query string.
         container, name = swift.swift_location(lfc.id)
         headers, obj = swift_client.get_object(container, name)
-        self.assertEqual(obj, b'')
+        manifest = json.loads(obj.decode('UTF-8'))
+        self.assertEqual(
+            ['/{0}/{1}/{2:04d}'.format(container, name, i)
+             for i in range(3)],
+            [segment['path'] for segment in manifest])
+        self.assertEqual(size, sum(
+            segment['size_bytes'] for segment in manifest))
 
         # The segments we expect are all in their expected locations.
         _, obj1 = swift_client.get_object(container, '{0}/0000'.format(name))
@@ -326,6 +335,72 @@ class TestFeedSwift(TestCase):
         # Our object round tripped
         self.assertEqual(obj1 + obj2 + obj3, expected_content)
 
+    def test_move_to_swift_workers(self):
+        # Files may be uploaded by several worker threads at once.
+        log = BufferLogger()
+        swift.to_swift(log, remove_func=os.unlink, workers=3)
+
+        for lfc in self.lfcs:
+            self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+        swift_client = self.swift_fixture.connect()
+        try:
+            for lfc, contents in zip(self.lfcs, self.contents):
+                container, name = swift.swift_location(lfc.id)
+                headers, obj = swift_client.get_object(container, name)
+                self.assertEqual(contents, obj, 'Did not round trip')
+        finally:
+            swift_client.close()
+
+    def test_checkpoint(self):
+        # With a checkpoint, to_swift records how far it got and resumes
+        # from there.  A skipped recent upload holds the checkpoint back.
+        log = BufferLogger()
+        checkpoint_path = os.path.join(
+            self.useFixture(TempDir()).path, 'checkpoint')
+        recent_path = swift.filesystem_path(self.lfcs[1].id)
+        os.utime(recent_path, None)
+
+        swift.to_swift(
+            log, remove_func=os.unlink, workers=2,
+            checkpoint_path=checkpoint_path)
+        self.assertEqual(
+            self.lfcs[0].id, swift.read_checkpoint(checkpoint_path))
+        self.assertTrue(os.path.exists(recent_path))
+        for lfc in self.lfcs[2:]:
+            self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+
+        the_past = time.time() - 25 * 60 * 60
+        os.utime(recent_path, (the_past, the_past))
+        swift.to_swift(
+            log, remove_func=os.unlink, workers=2,
+            checkpoint_path=checkpoint_path)
+        self.assertIn(
+            'Resuming after {0}'.format(self.lfcs[0].id), log.getLogBuffer())
+        self.assertFalse(os.path.exists(recent_path))
+        self.assertEqual(
+            self.lfcs[-1].id, swift.read_checkpoint(checkpoint_path))
+
+    def test_worker_failure(self):
+        # A failed upload is reported, and the checkpoint stops short of
+        # it.
+        log = BufferLogger()
+        checkpoint_path = os.path.join(
+            self.useFixture(TempDir()).path, 'checkpoint')
+        real_to_swift_file = swift._to_swift_file
+
+        def fail_second(log, swift_connection, lfc_id, *args, **kwargs):
+            if lfc_id == self.lfcs[1].id:
+                raise swiftclient.ClientException('Boom', http_status=503)
+            return real_to_swift_file(
+                log, swift_connection, lfc_id, *args, **kwargs)
+
+        with patch.object(swift, '_to_swift_file', fail_second):
+            self.assertRaises(
+                swiftclient.ClientException, swift.to_swift, log,
+                workers=2, checkpoint_path=checkpoint_path)
+        self.assertEqual(
+            self.lfcs[0].id, swift.read_checkpoint(checkpoint_path))
+
     def test_multiple_feed_instances(self):
         log = BufferLogger()
 
@@ -368,6 +443,82 @@ class TestFeedSwift(TestCase):
                 swift_client.close()
 
 
+class FakeConnectionPool:
+
+    def __init__(self):
+        self.returned = []
+
+    def put(self, swift_connection):
+        self.returned.append(swift_connection)
+
+
+class FakeSwiftConnection:
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestSwiftStream(TestCase):
+    layer = BaseLayer
+
+    def makeStream(self, chunks):
+        self.connection_pool = FakeConnectionPool()
+        self.swift_connection = FakeSwiftConnection()
+        return swift.SwiftStream(
+            self.connection_pool, self.swift_connection, iter(chunks))
+
+    def test_read_whole_chunks(self):
+        # Reads that line up with chunks return the chunks themselves.
+        chunks = [b'abcd', b'efgh']
+        s = self.makeStream(chunks)
+        self.assertIs(chunks[0], s.read(4))
+        self.assertIs(chunks[1], s.read(10))
+        self.assertEqual(b'', s.read(4))
+        self.assertEqual(8, s.tell())
+        self.assertEqual(
+            [self.swift_connection], self.connection_pool.returned)
+
+    def test_read_within_and_across_chunks(self):
+        s = self.makeStream([b'abcd', b'efgh', b'ijkl'])
+        self.assertEqual(b'ab', s.read(2))
+        self.assertEqual(b'cdefghi', s.read(7))
+        self.assertEqual(b'jkl', s.read(100))
+        self.assertEqual(b'', s.read(100))
+        self.assertEqual(12, s.tell())
+
+    def test_readinto(self):
+        s = self.makeStream([b'abcd', b'efgh', b'ijkl'])
+        buf = bytearray(5)
+        self.assertEqual(5, s.readinto(buf))
+        self.assertEqual(b'abcde', bytes(buf))
+        self.assertEqual(5, s.readinto(buf))
+        self.assertEqual(b'fghij', bytes(buf))
+        self.assertEqual(2, s.readinto(buf))
+        self.assertEqual(b'kl', bytes(buf[:2]))
+        self.assertEqual(0, s.readinto(buf))
+        self.assertEqual(12, s.tell())
+        self.assertEqual(
+            [self.swift_connection], self.connection_pool.returned)
+
+    def test_seek(self):
+        s = self.makeStream([b'abcd', b'efgh', b'ijkl'])
+        s.seek(6)
+        self.assertEqual(6, s.tell())
+        self.assertEqual(b'ghij', s.read(4))
+        self.assertRaises(NotImplementedError, s.seek, 2)
+
+    def test_close(self):
+        s = self.makeStream([b'abcd', b'efgh'])
+        s.read(2)
+        s.close()
+        self.assertTrue(self.swift_connection.closed)
+        self.assertEqual([], self.connection_pool.returned)
+        self.assertRaises(ValueError, s.read, 2)
+        self.assertRaises(ValueError, s.readinto, bytearray(2))
+
+
 class TestHashStream(TestCase):
     layer = BaseLayer
 
@@ -0,0 +1,177 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the local cache of Swift objects."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+
+import os.path
+
+from fixtures import TempDir
+from testtools.twistedsupport import (
+    assert_fails_with,
+    AsynchronousDeferredRunTest,
+    )
+from twisted.internet import defer
+
+from lp.services.librarianserver.swiftcache import SwiftCache
+from lp.services.statsd.tests import StatsMixin
+from lp.testing import TestCase
+from lp.testing.layers import ZopelessLayer
+
+
+class FakeFill:
+    """A cache fill that completes when the test says so."""
+
+    def __init__(self, content):
+        self.content = content
+        self.calls = []
+        self.pending = []
+
+    def __call__(self, path):
+        self.calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def complete(self):
+        for d in self.pending:
+            d.callback(len(self.content))
+        self.pending = []
+
+
+class TestSwiftCache(StatsMixin, TestCase):
+
+    layer = ZopelessLayer
+    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=30)
+
+    def setUp(self):
+        super(TestSwiftCache, self).setUp()
+        self.setUpStats()
+        self.directory = self.useFixture(TempDir()).path
+
+    def fill_now(self, content):
+        def fill(path):
+            with open(path, 'wb') as f:
+                f.write(content)
+            return defer.succeed(len(content))
+
+        return fill
+
+    @defer.inlineCallbacks
+    def test_miss_then_hit(self):
+        # The first lookup fills the cache; later lookups are served from
+        # it.
+        cache = SwiftCache(self.directory, 1000)
+        stream = yield cache.get(1, self.fill_now(b'data'))
+        self.assertEqual(b'data', stream.read())
+        stream.close()
+        stream = yield cache.get(1, self.fill_now(b'other'))
+        self.assertEqual(b'data', stream.read())
+        stream.close()
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(4, cache.size)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory, '00/00/00/01')))
+        self.assertEqual(2, self.stats_client.incr.call_count)
+        self.stats_client.incr.assert_called_with(
+            'librarian.swift_cache.lookup,env=test,result=hit')
+
+    @defer.inlineCallbacks
+    def test_concurrent_fills_deduplicated(self):
+        # Concurrent lookups of the same missing file only fill it once.
+        cache = SwiftCache(self.directory, 1000)
+        fill = FakeFill(b'data')
+        deferreds = [cache.get(1, fill) for _ in range(3)]
+        self.assertEqual(1, len(fill.calls))
+        fill.complete()
+        streams = yield defer.gatherResults(deferreds)
+        self.assertEqual([b'data'] * 3, [stream.read() for stream in streams])
+        for stream in streams:
+            stream.close()
+        self.assertEqual((0, 1, 2), (cache.hits, cache.misses, cache.waits))
+
+    @defer.inlineCallbacks
+    def test_failed_fill(self):
+        # If a fill fails, waiters get None and nothing is cached.
+        cache = SwiftCache(self.directory, 1000)
+        d = defer.Deferred()
+        first = cache.get(1, lambda path: d)
+        second = cache.get(1, lambda path: self.fail("Filled twice"))
+        d.errback(ValueError("boom"))
+        yield assert_fails_with(first, ValueError)
+        stream = yield second
+        self.assertIsNone(stream)
+        self.assertNotIn(1, cache)
+        self.assertEqual([], os.listdir(cache.incoming))
+
+    @defer.inlineCallbacks
+    def test_uncacheable(self):
+        # A fill returning None, or a file too large to cache, leaves the
+        # cache unchanged.
+        cache = SwiftCache(self.directory, 10)
+        stream = yield cache.get(1, lambda path: defer.succeed(None))
+        self.assertIsNone(stream)
+        stream = yield cache.get(2, self.fill_now(b'x' * 6))
+        self.assertIsNone(stream)
+        self.assertEqual(0, cache.size)
+        self.assertEqual([], os.listdir(cache.incoming))
+
+    def test_fills(self):
+        # Only files small enough to fetch quickly are filled on a miss.
+        cache = SwiftCache(self.directory, 1000, fill_max_size=100)
+        self.assertTrue(cache.fills(100))
+        self.assertFalse(cache.fills(101))
+        self.assertTrue(cache.accepts(101))
+        # Without a fill limit, anything the cache accepts is filled.
+        cache = SwiftCache(self.directory, 1000)
+        self.assertTrue(cache.fills(500))
+        self.assertFalse(cache.fills(501))
+
+    @defer.inlineCallbacks
+    def test_eviction(self):
+        # The least recently used files are evicted to keep the cache
+        # within its size limit.
+        cache = SwiftCache(self.directory, 10)
+        for fileid in (1, 2, 3):
+            stream = yield cache.get(fileid, self.fill_now(b'x' * 3))
+            stream.close()
+        # Use file 1 again, so file 2 is now the least recently used.
+        cache.open(1).close()
+        stream = yield cache.get(4, self.fill_now(b'x' * 3))
+        stream.close()
+        self.assertNotIn(2, cache)
+        self.assertContentEqual([1, 3, 4], [
+            fileid for fileid in (1, 2, 3, 4) if fileid in cache])
+        self.assertEqual(9, cache.size)
+        self.assertEqual(1, cache.evictions)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory, '00/00/00/02')))
+
+    @defer.inlineCallbacks
+    def test_open_does_not_fill(self):
+        # open only returns files that are already cached.
+        cache = SwiftCache(self.directory, 1000)
+        self.assertIsNone(cache.open(1))
+        stream = yield cache.get(1, self.fill_now(b'data'))
+        stream.close()
+        stream = cache.open(1)
+        self.assertEqual(b'data', stream.read())
+        stream.close()
+
+    @defer.inlineCallbacks
+    def test_reload(self):
+        # A new cache picks up files left by a previous one.
+        cache = SwiftCache(self.directory, 1000)
+        stream = yield cache.get(0x1234, self.fill_now(b'data'))
+        stream.close()
+        with open(os.path.join(cache.incoming, 'partial'), 'wb') as f:
+            f.write(b'partial')
+        cache = SwiftCache(self.directory, 1000)
+        self.assertIn(0x1234, cache)
+        self.assertEqual(4, cache.size)
+        self.assertEqual([], os.listdir(cache.incoming))
@@ -12,6 +12,7 @@ from io import BytesIO
 import os
 import unittest
 
+from fixtures import TempDir
 from lazr.uri import URI
 import pytz
 import requests
@@ -43,8 +44,12 @@ from lp.services.librarian.model import (
     TimeLimitedToken,
     )
 from lp.services.librarianserver.storage import LibrarianStorage
+from lp.services.librarianserver.web import get_sendfile_header
 from lp.services.macaroons.interfaces import IMacaroonIssuer
-from lp.testing import TestCaseWithFactory
+from lp.testing import (
+    TestCase,
+    TestCaseWithFactory,
+    )
 from lp.testing.dbuser import (
     dbuser,
     switch_dbuser,
@@ -307,6 +312,97 @@ class LibrarianWebTestCase(LibrarianWebTestMixin, TestCaseWithFactory):
         self.assertEqual(
             last_modified_header, 'Tue, 30 Jan 2001 13:45:59 GMT')
 
+    def make_public_file(self, data):
+        client = LibrarianClient()
+        file_alias_id = client.addFile(
+            'sample', len(data), BytesIO(data), contentType='text/plain')
+        url = client.getURLForAlias(file_alias_id)
+        self.commit()
+        return url
+
+    def test_range(self):
+        # A single byte range is returned as a partial response.
+        data = b''.join(b'%04d' % i for i in range(1000))
+        url = self.make_public_file(data)
+        response = requests.get(url)
+        self.assertEqual('bytes', response.headers['Accept-Ranges'])
+        response = requests.get(url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(data[10:20], response.content)
+        self.assertEqual(
+            'bytes 10-19/%d' % len(data), response.headers['Content-Range'])
+        response = requests.get(url, headers={'Range': 'bytes=-8'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(data[-8:], response.content)
+        response = requests.get(url, headers={'Range': 'bytes=3990-'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(data[3990:], response.content)
+
+    def test_multiple_ranges(self):
+        # Multiple byte ranges are returned as a multipart response.
+        data = b''.join(b'%04d' % i for i in range(1000))
+        url = self.make_public_file(data)
+        response = requests.get(
+            url, headers={'Range': 'bytes=0-3,100-103,2-5'})
+        self.assertEqual(206, response.status_code)
+        content_type, boundary = response.headers['Content-Type'].split(
+            '; boundary=')
+        self.assertEqual('multipart/byteranges', content_type)
+        boundary = boundary.encode('ASCII')
+        self.assertEqual(
+            b'\r\n--' + boundary + b'\r\n'
+            b'Content-Type: text/plain\r\n'
+            b'Content-Range: bytes 0-5/4000\r\n\r\n' + data[0:6] +
+            b'\r\n--' + boundary + b'\r\n'
+            b'Content-Type: text/plain\r\n'
+            b'Content-Range: bytes 100-103/4000\r\n\r\n' + data[100:104] +
+            b'\r\n--' + boundary + b'--\r\n',
+            response.content)
+
+    def test_unsatisfiable_range(self):
+        data = b'x' * 100
+        url = self.make_public_file(data)
+        response = requests.get(url, headers={'Range': 'bytes=100-'})
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */100', response.headers['Content-Range'])
+
+    def test_if_range(self):
+        # A range request is only honoured if the If-Range precondition
+        # matches.
+        data = b'x' * 100
+        url = self.make_public_file(data)
+        etag = requests.get(url).headers['ETag']
+        response = requests.get(
+            url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        self.assertEqual(206, response.status_code)
+        response = requests.get(
+            url, headers={'Range': 'bytes=0-9', 'If-Range': '"nonsense"'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(data, response.content)
+
+    def test_conditional_requests(self):
+        data = b'x' * 100
+        url = self.make_public_file(data)
+        response = requests.get(url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        response = requests.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+        response = requests.get(
+            url, headers={'If-None-Match': '"other", W/%s' % etag})
+        self.assertEqual(304, response.status_code)
+        response = requests.get(url, headers={'If-None-Match': '"other"'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(data, response.content)
+        response = requests.get(
+            url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(304, response.status_code)
+        response = requests.get(
+            url,
+            headers={'If-Modified-Since': 'Mon, 01 Jan 1990 00:00:00 GMT'})
+        self.assertEqual(200, response.status_code)
+
     def test_missing_storage(self):
         # When a file exists in the DB but is missing from disk, a 404
         # is just confusing. It's an internal error, so 500 instead.
@@ -552,6 +648,53 @@ class LibrarianZopelessWebMacaroonTestCase(
     layer = ZopelessAppServerLayer
 
 
+class TestSendfileHeader(TestCase):
+
+    def setUp(self):
+        super(TestSendfileHeader, self).setUp()
+        self.root = self.useFixture(TempDir()).path
+        os.mkdir(os.path.join(self.root, '00'))
+        self.path = os.path.join(self.root, '00', '01')
+        with open(self.path, 'wb') as f:
+            f.write(b'data')
+
+    def open(self):
+        stream = open(self.path, 'rb')
+        self.addCleanup(stream.close)
+        return stream
+
+    def test_disabled(self):
+        self.pushConfig('librarian_server', root=self.root)
+        self.assertIsNone(get_sendfile_header(self.open()))
+
+    def test_absolute_path(self):
+        self.pushConfig(
+            'librarian_server', root=self.root, sendfile_header='X-Sendfile')
+        self.assertEqual(
+            (b'X-Sendfile', self.path.encode('UTF-8')),
+            get_sendfile_header(self.open()))
+
+    def test_prefix(self):
+        self.pushConfig(
+            'librarian_server', root=self.root,
+            sendfile_header='X-Accel-Redirect', sendfile_prefix='/internal/')
+        self.assertEqual(
+            (b'X-Accel-Redirect', b'/internal/00/01'),
+            get_sendfile_header(self.open()))
+
+    def test_not_on_disk(self):
+        # Streams from Swift must be sent by the librarian.
+        self.pushConfig(
+            'librarian_server', root=self.root, sendfile_header='X-Sendfile')
+        self.assertIsNone(get_sendfile_header(BytesIO(b'data')))
+
+    def test_outside_root(self):
+        self.pushConfig(
+            'librarian_server', root=os.path.join(self.root, '00', 'xx'),
+            sendfile_header='X-Sendfile')
+        self.assertIsNone(get_sendfile_header(self.open()))
+
+
 class DeletedContentTestCase(unittest.TestCase):
 
     layer = LaunchpadZopelessLayer
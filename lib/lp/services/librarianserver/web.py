@@ -6,6 +6,9 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 
 from datetime import datetime
+import functools
+import math
+import os
 import time
 
 from pymacaroons import Macaroon
@@ -150,7 +153,7 @@ class LibraryFileAliasResource(resource.Resource):
             alias = self.storage.getFileAlias(aliasID, token, path)
             return (alias.contentID, alias.filename,
                 alias.mimetype, alias.date_created, alias.content.filesize,
-                alias.restricted)
+                alias.restricted, alias.content.sha1)
         except LookupError:
             raise NotFound
 
@@ -168,7 +171,7 @@ class LibraryFileAliasResource(resource.Resource):
     @defer.inlineCallbacks
     def _cb_getFileAlias(self, results, filename, request):
         (dbcontentID, dbfilename, mimetype, date_created, size,
-         restricted) = results
+         restricted, sha1) = results
         # Return a 404 if the filename in the URL is incorrect. This offers
         # a crude form of access control (stuff we care about can have
         # unguessable names effectively using the filename as a secret).
@@ -178,12 +181,15 @@ class LibraryFileAliasResource(resource.Resource):
                 % (dbfilename.encode('utf-8'), filename))
             defer.returnValue(fourOhFour)
 
-        stream = yield self.storage.open(dbcontentID)
-        if stream is not None:
-            # XXX: Brad Crittenden 2007-12-05 bug=174204: When encodings are
-            # stored as part of a file's metadata this logic will be replaced.
-            encoding, mimetype = guess_librarian_encoding(dbfilename, mimetype)
-            file = File(mimetype, encoding, date_created, stream, size)
+        # XXX: Brad Crittenden 2007-12-05 bug=174204: When encodings are
+        # stored as part of a file's metadata this logic will be replaced.
+        encoding, mimetype = guess_librarian_encoding(dbfilename, mimetype)
+        file = File(
+            mimetype, encoding, date_created, size,
+            functools.partial(self.storage.open, dbcontentID, size=size),
+            etag=('"%s"' % sha1).encode('ASCII'))
+        found = yield file.prepare(request)
+        if found:
             # Set our caching headers. Public Librarian files can be
             # cached forever, while private ones mustn't be at all.
             request.setHeader(
@@ -203,10 +209,59 @@ class LibraryFileAliasResource(resource.Resource):
         return defaultResource.render(request)
 
 
+def get_sendfile_header(stream):
+    """Return a header asking a fronting web server to send `stream`.
+
+    If `config.librarian_server.sendfile_header` is set (for example to
+    "X-Accel-Redirect" for nginx, or "X-Sendfile" for Apache with
+    mod_xsendfile) and `stream` is a file in the local disk store, then the
+    fronting web server can send the file itself using sendfile(2), which
+    is much cheaper than copying it through the librarian.
+
+    :return: A (header, value) tuple, or None if the librarian must send
+        the file itself.
+    """
+    header = config.librarian_server.sendfile_header
+    # Only files opened from the local disk have names.
+    path = getattr(stream, 'name', None)
+    if not header or not isinstance(path, six.string_types):
+        return None
+    root = os.path.abspath(config.librarian_server.root)
+    path = os.path.abspath(path)
+    if not path.startswith(root + os.sep):
+        return None
+    prefix = config.librarian_server.sendfile_prefix
+    if prefix:
+        path = prefix.rstrip('/') + '/' + path[len(root) + 1:]
+    return (
+        six.ensure_binary(header, 'ASCII'), six.ensure_binary(path, 'UTF-8'))
+
+
 class File(resource.Resource):
+    """A librarian file, supporting conditional and byte-range requests.
+
+    This is a cut-down version of `static.File`'s HTTP support, adapted
+    for content that may be streamed from Swift rather than read from the
+    local disk.  Each byte range is fetched from storage separately, so
+    only the requested bytes are read.
+    """
     isLeaf = True
 
-    def __init__(self, contentType, encoding, modification_time, stream, size):
+    # Refuse to serve more than this many separate byte ranges in a
+    # single response; clients asking for more get the whole file.
+    max_ranges = 64
+
+    def __init__(self, contentType, encoding, modification_time, size,
+                 opener, etag=None):
+        """Construct a `File`.
+
+        :param opener: A callable taking an optional (first, last) tuple
+            of inclusive byte offsets and returning a Deferred that fires
+            with a stream positioned at the start of that range (or the
+            start of the file), or with None if the file is missing from
+            storage.
+        :param etag: An optional entity tag for the file's content.
+        """
         resource.Resource.__init__(self)
         # Have to convert the UTC datetime to POSIX timestamp (localtime)
         offset = datetime.utcnow() - datetime.now()
@@ -215,11 +270,134 @@ class File(resource.Resource):
             local_modification_time.timetuple())
         self.type = contentType
         self.encoding = encoding
-        self.stream = stream
         self.size = size
+        self.opener = opener
+        self.etag = etag
+        self.stream = None
+        self.not_modified = False
+        self.ranges = None
+
+    @property
+    def _last_modified(self):
+        return http.datetimeToString(int(math.ceil(self._modification_time)))
+
+    def _isNotModified(self, request):
+        """Would a conditional GET of this file yield 304 Not Modified?"""
+        if_none_match = request.getHeader(b'if-none-match')
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since.
+            tags = [tag.strip() for tag in if_none_match.split(b',')]
+            if b'*' in tags:
+                return True
+            if self.etag is None:
+                return False
+            # If-None-Match uses weak comparison.
+            return any(
+                (tag[2:] if tag.startswith(b'W/') else tag) == self.etag
+                for tag in tags)
+        if_modified_since = request.getHeader(b'if-modified-since')
+        if if_modified_since is not None:
+            try:
+                since = http.stringToDatetime(
+                    if_modified_since.split(b';', 1)[0])
+            except ValueError:
+                return False
+            return int(math.ceil(self._modification_time)) <= since
+        return False
+
+    def _rangeApplies(self, request):
+        """Check any If-Range precondition on a range request."""
+        if_range = request.getHeader(b'if-range')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(b'"') or if_range.startswith(b'W/'):
+            # If-Range uses strong comparison, so weak tags never match.
+            return self.etag is not None and if_range == self.etag
+        return if_range == self._last_modified
+
+    def _parseRanges(self, request):
+        """Parse the byte ranges requested, if any.
+
+        :return: None if the whole file should be sent, otherwise a sorted
+            list of non-overlapping (first, last) tuples of inclusive byte
+            offsets.  The list is empty if no requested range can be
+            satisfied.
+        """
+        header = request.getHeader(b'range')
+        if header is None or self.size == 0 or not self._rangeApplies(
+                request):
+            return None
+        unit, _, specs = header.partition(b'=')
+        if unit.strip().lower() != b'bytes':
+            return None
+        ranges = []
+        for spec in specs.split(b','):
+            spec = spec.strip()
+            if not spec:
+                continue
+            first, sep, last = spec.partition(b'-')
+            if not sep:
+                # Syntactically invalid range headers are ignored.
+                return None
+            try:
+                if not first:
+                    suffix_length = int(last)
+                    if suffix_length > 0:
+                        ranges.append(
+                            (max(0, self.size - suffix_length),
+                             self.size - 1))
+                    continue
+                first = int(first)
+                last = int(last) if last else None
+            except ValueError:
+                return None
+            if first < 0 or (last is not None and last < first):
+                return None
+            if first < self.size:
+                if last is None or last >= self.size:
+                    last = self.size - 1
+                ranges.append((first, last))
+        # Coalesce overlapping or adjacent ranges.
+        coalesced = []
+        for first, last in sorted(ranges):
+            if coalesced and first <= coalesced[-1][1] + 1:
+                coalesced[-1] = (
+                    coalesced[-1][0], max(coalesced[-1][1], last))
+            else:
+                coalesced.append((first, last))
+        if len(coalesced) > self.max_ranges:
+            return None
+        return coalesced
 
-    def _setContentHeaders(self, request):
-        request.setHeader(b'content-length', intToBytes(self.size))
+    @defer.inlineCallbacks
+    def prepare(self, request):
+        """Prepare to render this file for `request`.
+
+        This evaluates conditional and range request headers and opens the
+        file if any of its content is needed.
+
+        :return: A Deferred that fires with False if the file is missing
+            from storage, otherwise True.
+        """
+        self.not_modified = self._isNotModified(request)
+        if self.not_modified:
+            defer.returnValue(True)
+        self.ranges = self._parseRanges(request)
+        if self.ranges == []:
+            defer.returnValue(True)
+        self.stream = yield self.opener(
+            self.ranges[0] if self.ranges else None)
+        defer.returnValue(self.stream is not None)
+
+    def _closeStream(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def _setContentHeaders(self, request, size=None):
+        if size is None:
+            size = self.size
+        request.setHeader(b'content-length', intToBytes(size))
         if self.type:
             request.setHeader(
                 b'content-type', six.ensure_binary(self.type, 'ASCII'))
@@ -227,49 +405,99 @@ class File(resource.Resource):
             request.setHeader(
                 b'content-encoding', six.ensure_binary(self.encoding, 'ASCII'))
 
+    def _contentRange(self, first, last):
+        return ('bytes %d-%d/%d' % (first, last, self.size)).encode('ASCII')
+
     def render_GET(self, request):
         """See `Resource`."""
-        request.setHeader(b'accept-ranges', b'none')
+        request.setHeader(b'accept-ranges', b'bytes')
+        request.setHeader(b'last-modified', self._last_modified)
+        if self.etag is not None:
+            request.setHeader(b'etag', self.etag)
+
+        if self.not_modified:
+            request.setResponseCode(http.NOT_MODIFIED)
+            self._closeStream()
+            return b''
 
-        if request.setLastModified(self._modification_time) is http.CACHED:
-            # `setLastModified` also sets the response code for us, so if
-            # the request is cached, we close the file now that we've made
-            # sure that the request would otherwise succeed and return an
-            # empty body.
-            self.stream.close()
+        if self.ranges == []:
+            request.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            request.setHeader(
+                b'content-range', ('bytes */%d' % self.size).encode('ASCII'))
+            request.setHeader(b'content-length', b'0')
             return b''
 
-        if request.method == b'HEAD':
-            # Set the content headers here, rather than making a producer.
+        if self.ranges is None:
+            sendfile = get_sendfile_header(self.stream)
+            if sendfile is not None and request.method == b'GET':
+                # Hand the file off to the fronting web server, which can
+                # send it without copying it through userspace.
+                header, value = sendfile
+                self._setContentHeaders(request, 0)
+                request.setHeader(header, value)
+                request.setResponseCode(http.OK)
+                self._closeStream()
+                return b''
             self._setContentHeaders(request)
-            self.stream.close()
+            request.setResponseCode(http.OK)
+            producer = FileProducer(request, self.stream)
+        elif len(self.ranges) == 1:
+            [(first, last)] = self.ranges
+            self._setContentHeaders(request, last - first + 1)
+            request.setHeader(
+                b'content-range', self._contentRange(first, last))
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            producer = FileProducer(
+                request, self.stream, length=last - first + 1)
+        else:
+            boundary = ('%x%x' % (
+                int(time.time() * 1000000), os.getpid())).encode('ASCII')
+            parts = []
+            for first, last in self.ranges:
+                part_header = [b'\r\n--' + boundary]
+                if self.type:
+                    part_header.append(
+                        b'Content-Type: ' +
+                        six.ensure_binary(self.type, 'ASCII'))
+                part_header.append(
+                    b'Content-Range: ' + self._contentRange(first, last))
+                parts.append(
+                    ((first, last), b'\r\n'.join(part_header) + b'\r\n\r\n'))
+            trailer = b'\r\n--' + boundary + b'--\r\n'
+            request.setHeader(
+                b'content-length', intToBytes(
+                    sum(len(part_header) + last - first + 1
+                        for (first, last), part_header in parts) +
+                    len(trailer)))
+            request.setHeader(
+                b'content-type',
+                b'multipart/byteranges; boundary=' + boundary)
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            producer = MultipleRangeProducer(
+                request, self.stream, self.opener, parts, trailer)
+
+        if request.method == b'HEAD':
+            # We've set the content headers; don't make a producer.
+            self._closeStream()
             return b''
 
-        # static.File has HTTP range support, which would be nice to have.
-        # Unfortunately, static.File isn't a good match for producing data
-        # dynamically by fetching it from Swift. The librarian used to sit
-        # behind Squid, which took care of this, but it no longer does. I
-        # think we will need to cargo-cult the byte-range support and three
-        # Producer implementations from static.File, making the small
-        # modifications to cope with self.fileObject.read maybe returning a
-        # Deferred, and the static.File.makeProducer method to return the
-        # correct producer.
-        self._setContentHeaders(request)
-        request.setResponseCode(http.OK)
-        producer = FileProducer(request, self.stream)
         producer.start()
-
         return server.NOT_DONE_YET
 
 
 @implementer(IPushProducer)
 class FileProducer(object):
 
+    # This matches the size of the chunks that LibrarianStorage fetches
+    # from Swift, so TxSwiftStream can hand each chunk over without copying
+    # it.
     buffer_size = abstract.FileDescriptor.bufferSize
 
-    def __init__(self, request, stream):
+    def __init__(self, request, stream, length=None):
         self.request = request
         self.stream = stream
+        # If not None, only send this many more bytes from the stream.
+        self.remaining = length
         self.producing = True
 
     def start(self):
@@ -280,21 +508,41 @@ class FileProducer(object):
         """See `IPushProducer`."""
         self.producing = False
 
+    def _nextStream(self):
+        """Move on to the next stream once this one is exhausted.
+
+        :return: True (or a Deferred firing with True) if there is more to
+            send, otherwise False.
+        """
+        return False
+
     @defer.inlineCallbacks
     def _produceFromStream(self):
         """Read data from our stream and write it to our consumer."""
         while self.request and self.producing:
-            data = yield self.stream.read(self.buffer_size)
+            if self.remaining is None:
+                data = yield self.stream.read(self.buffer_size)
+            elif self.remaining > 0:
+                data = yield self.stream.read(
+                    min(self.buffer_size, self.remaining))
+            else:
+                data = b''
             # pauseProducing or stopProducing may have been called while we
             # were waiting.
             if not self.producing:
                 return
             if data:
+                if self.remaining is not None:
+                    self.remaining -= len(data)
                 self.request.write(data)
             else:
-                self.request.unregisterProducer()
-                self.request.finish()
-                self.stopProducing()
+                more = yield self._nextStream()
+                if not self.request:
+                    return
+                if not more:
+                    self.request.unregisterProducer()
+                    self.request.finish()
+                    self.stopProducing()
 
     def resumeProducing(self):
         """See `IPushProducer`."""
@@ -305,10 +553,66 @@ class FileProducer(object):
     def stopProducing(self):
         """See `IProducer`."""
         self.producing = False
-        self.stream.close()
+        if self.stream is not None:
+            self.stream.close()
         self.request = None
 
 
+class MultipleRangeProducer(FileProducer):
+    """Produce a multipart/byteranges response.
+
+    Each range is read from a separate stream, opened when the previous
+    range has been sent.
+    """
+
+    def __init__(self, request, stream, opener, parts, trailer):
+        """Construct a `MultipleRangeProducer`.
+
+        :param stream: A stream positioned at the start of the first range.
+        :param opener: A callable returning a Deferred that fires with a
+            stream for a given (first, last) byte range.
+        :param parts: A list of ((first, last), part_header) tuples.
+        :param trailer: The closing multipart boundary.
+        """
+        super(MultipleRangeProducer, self).__init__(request, stream)
+        self.opener = opener
+        self.parts = list(parts)
+        self.trailer = trailer
+
+    def _startPart(self):
+        (first, last), part_header = self.parts.pop(0)
+        self.request.write(part_header)
+        self.remaining = last - first + 1
+        return first, last
+
+    def start(self):
+        self._startPart()
+        super(MultipleRangeProducer, self).start()
+
+    @defer.inlineCallbacks
+    def _nextStream(self):
+        """See `FileProducer`."""
+        self.stream.close()
+        self.stream = None
+        if not self.parts:
+            self.request.write(self.trailer)
+            defer.returnValue(False)
+        byte_range = self._startPart()
+        stream = yield self.opener(byte_range)
+        if self.request is None:
+            # We were stopped while opening the stream.
+            if stream is not None:
+                stream.close()
+            defer.returnValue(False)
+        if stream is None:
+            log.msg("Content missing from storage during range request.")
+            self.request.loseConnection()
+            self.stopProducing()
+            defer.returnValue(False)
+        self.stream = stream
+        defer.returnValue(True)
+
+
 class DigestSearchResource(resource.Resource):
     def __init__(self, storage):
         self.storage = storage
@@ -7,15 +7,26 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'bounded_memoize',
     'memoize',
     ]
 
+from collections import OrderedDict
+import threading
+import time
+
+import transaction
+
 
 class memoize:
     """Simple memoize decorator that vary on arguments.
 
     This decorator doesn't work with kwargs, nor mutable objects like lists
     or dicts as arguments.
+
+    Results are kept forever, so this is only suitable for functions that
+    are called with a small, fixed set of arguments.  Use `bounded_memoize`
+    otherwise.
     """
     def __init__(self, function):
         self.memo = {}
@@ -28,3 +39,81 @@ class memoize:
 
     def clean_memo(self):
         self.memo = {}
+
+
+class BoundedMemoize:
+    """A memoize decorator with size and age limits.
+
+    See `bounded_memoize`.
+    """
+
+    def __init__(self, function, max_size, ttl, per_transaction):
+        self.function = function
+        self.max_size = max_size
+        self.ttl = ttl
+        self.per_transaction = per_transaction
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._memo = OrderedDict()
+
+    @property
+    def memo(self):
+        """The current memo, mapping arguments to (result, expiry time).
+
+        If results are scoped to transactions, this is specific to the
+        current thread's transaction.
+        """
+        if not self.per_transaction:
+            return self._memo
+        current = transaction.get()
+        if getattr(self._local, 'transaction', None) is not current:
+            self._local.transaction = current
+            self._local.memo = OrderedDict()
+        return self._local.memo
+
+    def __call__(self, *args):
+        memo = self.memo
+        now = time.time()
+        with self._lock:
+            entry = memo.pop(args, None)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                # Mark this entry as the most recently used.
+                memo[args] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Call the function without holding the lock, since it may be slow
+        # or even call back into this memoizer.
+        result = self.function(*args)
+        expires = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            memo[args] = (result, expires)
+            while len(memo) > self.max_size:
+                memo.popitem(last=False)
+        return result
+
+    def clean_memo(self):
+        with self._lock:
+            self.memo.clear()
+
+
+def bounded_memoize(max_size=128, ttl=None, per_transaction=False):
+    """Memoize a function, keeping a limited number of recent results.
+
+    Like `memoize`, this doesn't work with kwargs, nor mutable objects like
+    lists or dicts as arguments.  It is safe to use from multiple threads,
+    although concurrent calls with the same arguments may each call the
+    function.
+
+    :param max_size: The maximum number of results to keep.  The least
+        recently used results are discarded first.
+    :param ttl: If not None, discard results after this many seconds.
+    :param per_transaction: If True, only keep results until the end of
+        the current transaction; each thread then has its own results.
+    """
+    def decorator(function):
+        return BoundedMemoize(function, max_size, ttl, per_transaction)
+
+    return decorator
@@ -20,7 +20,6 @@ from storm.locals import (
     )
 from zope.interface import implementer
 
-from lp.app.browser.tales import DateTimeFormatterAPI
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.interfaces import IStore
 from lp.services.database.stormbase import StormBase
@@ -90,6 +89,7 @@ class MessageRevision(StormBase):
 
     @property
     def date_created_display(self):
+        from lp.app.browser.tales import DateTimeFormatterAPI
         return DateTimeFormatterAPI(self.date_created).datetime()
 
     def deleteContent(self):
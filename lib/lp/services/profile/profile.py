@@ -45,6 +45,7 @@ from lp.services.profile.mem import (
     memory,
     resident,
     )
+from lp.services.profile.sampling import get_sampling_profiler
 import lp.services.webapp.adapter as da
 
 
@@ -182,6 +183,9 @@ def before_traverse(event):
 @adapter(IStartRequestEvent)
 def start_request(event):
     """Handle profiling when configured as permitted."""
+    sampler = get_sampling_profiler()
+    if sampler is not None:
+        sampler.startRequest(event.request)
     if not config.profiling.profiling_allowed:
         return
     _maybe_profile(event)
@@ -277,6 +281,9 @@ def profiling():
 @adapter(IEndRequestEvent)
 def end_request(event):
     """If profiling is turned on, save profile data for the request."""
+    sampler = get_sampling_profiler()
+    if sampler is not None:
+        sampler.endRequest()
     try:
         if not _profilers.profiling:
             return
@@ -0,0 +1,173 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Statistical profiling of all requests handled by a process.
+
+Unlike the per-request profilers in `lp.services.profile.profile`, this is
+cheap enough to leave running on production appservers.  A timer
+interrupts the process after every `config.profiling.sampling_interval`
+milliseconds of CPU time that it uses, and the Python stacks of all the
+threads that are handling requests at that moment are recorded against
+the request's page ID.
+
+Samples are aggregated in windows of `config.profiling.sampling_window`
+seconds.  Sending SIGDUMPSAMPLES to the process writes the recent windows
+to `config.profiling.profile_dir` in the "collapsed stacks" format read
+by flamegraph.pl and similar tools, with the page ID as the root frame.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'get_sampling_profiler',
+    'SamplingProfiler',
+    'setup_sampling_profiler',
+    'SIGDUMPSAMPLES',
+    ]
+
+from collections import (
+    Counter,
+    deque,
+    )
+from datetime import datetime
+import os
+import signal
+import sys
+import threading
+import time
+
+from lp.services.config import config
+
+
+SIGDUMPSAMPLES = signal.SIGRTMIN + 11
+
+
+class SamplingProfiler:
+    """Sample the stacks of the threads handling requests."""
+
+    def __init__(self, interval, window, max_windows, dump_path,
+                 time=time.time):
+        """Create a sampling profiler.
+
+        :param interval: Take samples after this many seconds of CPU time.
+        :param window: Aggregate samples over windows of this many seconds.
+        :param max_windows: Keep this many completed windows.
+        :param dump_path: Directory to write dumped windows to.
+        :param time: A callable returning the current time.
+        """
+        self.interval = interval
+        self.window = window
+        self.dump_path = dump_path
+        self.time = time
+        # Maps thread identifiers to the requests they are handling.
+        self.requests = {}
+        self.windows = deque(maxlen=max_windows)
+        self._startWindow()
+
+    def _startWindow(self):
+        self.window_start = self.time()
+        self.samples = Counter()
+
+    def start(self):
+        """Start sampling.
+
+        This must be called from the main thread, which is the thread that
+        Python runs signal handlers in.
+        """
+        signal.signal(signal.SIGPROF, self.sample)
+        # Python 2 makes signals interrupt system calls once a handler is
+        # installed, which would make request threads see EINTR errors
+        # from socket and file operations every few milliseconds.
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.signal(SIGDUMPSAMPLES, self.dump)
+        signal.siginterrupt(SIGDUMPSAMPLES, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stop sampling."""
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        signal.signal(SIGDUMPSAMPLES, signal.SIG_DFL)
+
+    def startRequest(self, request):
+        """Attribute samples of the current thread to `request`."""
+        self.requests[threading.current_thread().ident] = request
+
+    def endRequest(self):
+        """Stop taking samples of the current thread."""
+        self.requests.pop(threading.current_thread().ident, None)
+
+    def sample(self, signum=None, frame=None):
+        """Record the stacks of the threads that are handling requests."""
+        now = self.time()
+        if now >= self.window_start + self.window:
+            self.windows.append((self.window_start, self.samples))
+            self._startWindow()
+        frames = sys._current_frames()
+        # Copy the requests, as threads may start or finish handling
+        # requests while we sample them.
+        for ident, request in list(self.requests.items()):
+            thread_frame = frames.get(ident)
+            if thread_frame is None:
+                continue
+            stack = []
+            while thread_frame is not None:
+                code = thread_frame.f_code
+                stack.append('%s:%s' % (
+                    thread_frame.f_globals.get('__name__', code.co_filename),
+                    code.co_name))
+                thread_frame = thread_frame.f_back
+            stack.append(
+                request._orig_env.get('launchpad.pageid') or 'Unknown')
+            stack.reverse()
+            self.samples[';'.join(stack)] += 1
+
+    def dump(self, signum=None, frame=None):
+        """Write the recent windows of samples to files.
+
+        Each window is written to its own file, named after the time the
+        window started and the process ID.  The current window is
+        included, but is not ended.
+
+        As the SIGDUMPSAMPLES handler, this does file I/O in a signal
+        handler on the main thread, blocking it until the files have been
+        written.  That is tolerable for an operator-triggered dump, and
+        is what the SIGDUMPMEM handler already does.
+
+        :return: A list of the names of the files written.
+        """
+        filenames = []
+        windows = list(self.windows)
+        windows.append((self.window_start, self.samples))
+        for start, samples in windows:
+            filename = os.path.join(
+                self.dump_path, 'samples.%s-%d.folded' % (
+                    datetime.fromtimestamp(start).strftime(
+                        '%Y-%m-%d_%H:%M:%S'),
+                    os.getpid()))
+            with open(filename, 'w') as f:
+                for stack, count in sorted(samples.items()):
+                    f.write('%s %d\n' % (stack, count))
+            filenames.append(filename)
+        return filenames
+
+
+_sampler = None
+
+
+def get_sampling_profiler():
+    """Return the process's sampling profiler, or None if it is disabled."""
+    return _sampler
+
+
+def setup_sampling_profiler(event):
+    """Start sampling if configured to do so."""
+    global _sampler
+    interval = config.profiling.sampling_interval
+    if not interval or _sampler is not None:
+        return
+    _sampler = SamplingProfiler(
+        interval / 1000.0, config.profiling.sampling_window,
+        config.profiling.sampling_windows, config.profiling.profile_dir)
+    _sampler.start()
@@ -12,6 +12,7 @@ import glob
 import logging
 import os
 import random
+import signal
 import unittest
 
 from zope.component import (
@@ -26,7 +27,10 @@ from zope.publisher.interfaces import (
 from zope.traversing.interfaces import BeforeTraverseEvent
 
 from lp.services.features.testing import FeatureFixture
-from lp.services.profile import profile
+from lp.services.profile import (
+    profile,
+    sampling,
+    )
 import lp.services.webapp.adapter as da
 from lp.services.webapp.errorlog import ErrorReportingUtility
 from lp.services.webapp.servers import LaunchpadTestRequest
@@ -792,6 +796,113 @@ class TestSqlLogging(TestCaseWithFactory, BaseRequestEndHandlerTest):
         self.assertIn(__file__.replace('.pyc', '.py'), response)
 
 
+class FakeTime:
+
+    def __init__(self, now=1000000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestSamplingProfiler(BaseTest):
+
+    def setUp(self):
+        super(TestSamplingProfiler, self).setUp()
+        self.profile_dir = self.makeTemporaryDirectory()
+        self.time = FakeTime()
+        self.sampler = sampling.SamplingProfiler(
+            0.01, 60, 2, self.profile_dir, time=self.time)
+
+    def makeRequest(self, pageid):
+        request = self._get_request()
+        request.setInWSGIEnvironment('launchpad.pageid', pageid)
+        return request
+
+    def test_samples_requests(self):
+        # Threads handling requests are sampled against the page ID.
+        self.sampler.startRequest(self.makeRequest('Foo:+index'))
+        self.sampler.sample()
+        self.sampler.sample()
+        [(stack, count)] = self.sampler.samples.items()
+        self.assertEqual(2, count)
+        frames = stack.split(';')
+        self.assertEqual('Foo:+index', frames[0])
+        self.assertIn('%s:test_samples_requests' % __name__, frames)
+        self.assertEqual('lp.services.profile.sampling:sample', frames[-1])
+
+    def test_ignores_threads_not_handling_requests(self):
+        self.sampler.startRequest(self.makeRequest('Foo:+index'))
+        self.sampler.endRequest()
+        self.sampler.sample()
+        self.assertEqual({}, self.sampler.samples)
+
+    def test_windows(self):
+        # Samples are aggregated over windows, and old windows are
+        # discarded.
+        self.sampler.startRequest(self.makeRequest('Foo:+index'))
+        starts = []
+        for i in range(4):
+            starts.append(self.time.now)
+            self.sampler.sample()
+            self.time.now += 60
+        self.assertEqual(
+            starts[1:3], [start for start, _ in self.sampler.windows])
+        self.assertEqual(starts[3], self.sampler.window_start)
+
+    def test_dump(self):
+        # Windows are dumped in the collapsed stacks format.
+        self.sampler.startRequest(self.makeRequest('Foo:+index'))
+        self.sampler.sample()
+        self.time.now += 60
+        self.sampler.sample()
+        self.sampler.sample()
+        filenames = self.sampler.dump()
+        self.assertEqual(2, len(filenames))
+        for filename, count in zip(filenames, (1, 2)):
+            self.assertTrue(filename.startswith(self.profile_dir))
+            with open(filename) as f:
+                [line] = f.read().splitlines()
+            stack, sample_count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('Foo:+index;'))
+            self.assertEqual(count, int(sample_count))
+
+    def test_request_events(self):
+        # The request event handlers tell the sampling profiler which
+        # threads are handling requests, whether or not other profiling is
+        # allowed.
+        self.pushProfilingConfig(profiling_allowed='False')
+        self.patch(sampling, '_sampler', self.sampler)
+        start_event = self._get_start_event()
+        profile.start_request(start_event)
+        self.assertEqual(
+            [start_event.request], list(self.sampler.requests.values()))
+        profile.end_request(EndRequestEvent(object(), start_event.request))
+        self.assertEqual({}, self.sampler.requests)
+
+    def test_start_does_not_interrupt_system_calls(self):
+        siginterrupt_calls = []
+        self.patch(
+            sampling.signal, 'siginterrupt',
+            lambda signum, flag: siginterrupt_calls.append((signum, flag)))
+        self.patch(sampling.signal, 'setitimer', lambda *args: None)
+        self.addCleanup(
+            signal.signal, signal.SIGPROF, signal.getsignal(signal.SIGPROF))
+        self.addCleanup(
+            signal.signal, sampling.SIGDUMPSAMPLES,
+            signal.getsignal(sampling.SIGDUMPSAMPLES))
+        self.sampler.start()
+        self.assertEqual(
+            [(signal.SIGPROF, False), (sampling.SIGDUMPSAMPLES, False)],
+            siginterrupt_calls)
+
+    def test_setup_disabled(self):
+        self.patch(sampling, '_sampler', None)
+        self.pushConfig('profiling', sampling_interval=0)
+        sampling.setup_sampling_profiler(None)
+        self.assertIsNone(sampling.get_sampling_profiler())
+
+
 def test_suite():
     """Return the `IBugTarget` TestSuite."""
     suite = unittest.TestSuite()
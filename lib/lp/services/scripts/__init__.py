@@ -19,6 +19,7 @@ import atexit
 import os
 import sys
 import threading
+import time
 
 import zope.component.hooks
 from zope.configuration.config import ConfigurationMachine
@@ -44,12 +45,17 @@ from lp.services.webapp.interaction import (
     )
 
 
-def execute_zcml_for_scripts(use_web_security=False):
+def execute_zcml_for_scripts(use_web_security=False, profile=None):
     """Execute the zcml rooted at launchpad/script.zcml
 
     If use_web_security is True, the same security policy as the web
     application uses will be used. Otherwise everything protected by a
     permission is allowed, and everything else denied.
+
+    If profile is not None, execute zcml/script-<profile>.zcml instead
+    (or zcml/script-<profile>-testing.zcml under the test runner).  This
+    lets scripts that only need some of Launchpad's components avoid the
+    cost of configuring all of them.
     """
 
     # When in testing mode, prevent some cases of erroneous layer usage.
@@ -65,10 +71,12 @@ def execute_zcml_for_scripts(use_web_security=False):
                 Instead, your test should use the Zopeless layer.
             """
 
+    scriptzcmlfilename = 'script'
+    if profile is not None:
+        scriptzcmlfilename += '-%s' % profile
     if config.isTestRunner():
-        scriptzcmlfilename = 'script-testing.zcml'
-    else:
-        scriptzcmlfilename = 'script.zcml'
+        scriptzcmlfilename += '-testing'
+    scriptzcmlfilename += '.zcml'
 
     scriptzcmlfilename = os.path.abspath(
         os.path.join(config.root, 'zcml', scriptzcmlfilename))
@@ -79,10 +87,14 @@ def execute_zcml_for_scripts(use_web_security=False):
     zope.component.hooks.setHooks()
 
     # Load server-independent site config
+    start = time.time()
     context = ConfigurationMachine()
     xmlconfig.registerCommonDirectives(context)
     context = xmlconfig.file(
         scriptzcmlfilename, execute=True, context=context)
+    log.debug(
+        "Executed %s in %.2fs", os.path.basename(scriptzcmlfilename),
+        time.time() - start)
 
     if use_web_security:
         setSecurityPolicy(LaunchpadSecurityPolicy)
@@ -153,6 +153,9 @@ class LaunchpadScript:
     description = None
     lockfilepath = None
     loglevel = logging.INFO
+    # The name of a slimmer ZCML profile to execute instead of
+    # zcml/script.zcml; see `execute_zcml_for_scripts`.
+    zcml_profile = None
 
     # State for the log_unhandled_exceptions decorator.
     _log_unhandled_exceptions_level = 0
@@ -343,7 +346,8 @@ class LaunchpadScript:
 
     def _init_zca(self, use_web_security):
         """Initialize the ZCA, this can be overridden for testing purposes."""
-        scripts.execute_zcml_for_scripts(use_web_security=use_web_security)
+        scripts.execute_zcml_for_scripts(
+            use_web_security=use_web_security, profile=self.zcml_profile)
 
     def _init_db(self, isolation):
         """Initialize the database transaction.
@@ -0,0 +1,46 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Keep the cost of importing frequently-run scripts under control."""
+
+__metaclass__ = type
+
+from testscenarios import (
+    load_tests_apply_scenarios,
+    WithScenarios,
+    )
+
+from lp.services.scripts.tests import run_script
+from lp.testing import TestCase
+
+
+# Modules that scripts which never render web pages should not need.
+WEB_MODULES = [
+    'lp.app.browser.tales',
+    'lp.app.widgets',
+    ]
+
+
+class TestImportBudget(WithScenarios, TestCase):
+    """Scripts must import quickly and avoid the web UI stack.
+
+    The budgets are generous, so that they are only exceeded by a real
+    regression rather than a slow test machine.  Run
+    utilities/import-profile.py on a script to see where its time goes.
+    """
+
+    scenarios = [
+        ('garbo-frequently', {
+            'script': 'cronscripts/garbo-frequently.py', 'budget': 15.0}),
+        ('process-job-source', {
+            'script': 'cronscripts/process-job-source.py', 'budget': 10.0}),
+        ]
+
+    def test_import_budget(self):
+        args = ['--limit', '10', '--budget', str(self.budget)]
+        for name in WEB_MODULES:
+            args.extend(['--forbid', name])
+        run_script('utilities/import-profile.py', args + [self.script])
+
+
+load_tests = load_tests_apply_scenarios
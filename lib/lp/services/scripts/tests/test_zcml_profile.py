@@ -0,0 +1,33 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test the slimmer ZCML profiles available to scripts."""
+
+__metaclass__ = type
+
+from lp.scripts.garbo import FrequentDatabaseGarbageCollector
+from lp.services.scripts.tests import run_script
+from lp.testing import TestCase
+
+
+class TestZCMLProfile(TestCase):
+    """Each profile runs in a fresh process, as the component architecture
+    can only be configured once per process.
+    """
+
+    def run_profile(self, *args):
+        _, stdout, _ = run_script(
+            'lib/lp/services/scripts/tests/zcml-profile.py', list(args))
+        return stdout.splitlines()
+
+    def test_full(self):
+        self.assertEqual(['utility: True', 'url: True'], self.run_profile())
+
+    def test_db(self):
+        # The "db" profile registers model components but skips browser
+        # registrations such as canonical URLs.
+        self.assertEqual(
+            ['utility: True', 'url: False'], self.run_profile('db'))
+
+    def test_garbo_frequently_uses_db(self):
+        self.assertEqual('db', FrequentDatabaseGarbageCollector.zcml_profile)
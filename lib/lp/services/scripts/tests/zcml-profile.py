@@ -0,0 +1,37 @@
+#!/usr/bin/python2 -S
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Execute a script ZCML profile and report what it registered.
+
+Used by test_zcml_profile.  Pass the profile name, or nothing for the full
+script.zcml.
+"""
+
+__metaclass__ = type
+__all__ = []
+
+import _pythonpath  # noqa: F401
+
+import sys
+
+from zope.component import (
+    getSiteManager,
+    queryUtility,
+    )
+
+from lp.registry.interfaces.person import (
+    IPerson,
+    IPersonSet,
+    )
+from lp.services.scripts import execute_zcml_for_scripts
+from lp.services.webapp.interfaces import ICanonicalUrlData
+
+
+if __name__ == '__main__':
+    execute_zcml_for_scripts(
+        profile=sys.argv[1] if len(sys.argv) > 1 else None)
+    print('utility: %s' % (queryUtility(IPersonSet) is not None))
+    print('url: %s' % (
+        getSiteManager().adapters.lookup(
+            (IPerson,), ICanonicalUrlData) is not None))
@@ -0,0 +1,66 @@
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for lp.services.importprofile."""
+
+__metaclass__ = type
+
+import os.path
+import sys
+
+from fixtures import TempDir
+
+from lp.services.importprofile import ImportProfiler
+from lp.testing import TestCase
+
+
+class TestImportProfiler(TestCase):
+
+    def setUp(self):
+        super(TestImportProfiler, self).setUp()
+        self.directory = self.useFixture(TempDir()).path
+        sys.path.insert(0, self.directory)
+        self.addCleanup(sys.path.remove, self.directory)
+
+    def makeModule(self, name, source=''):
+        with open(os.path.join(self.directory, name + '.py'), 'w') as f:
+            f.write(source)
+        self.addCleanup(sys.modules.pop, name, None)
+
+    def test_nested_imports(self):
+        # Time spent in nested imports counts towards the cumulative time
+        # of the importing module, but not its self time.
+        self.makeModule('lpimportouter', 'import lpimportinner\n')
+        self.makeModule('lpimportinner', 'import time\ntime.sleep(0.05)\n')
+        with ImportProfiler() as profiler:
+            import lpimportouter  # noqa: F401
+        self.assertGreaterEqual(profiler.cumulative['lpimportinner'], 0.05)
+        self.assertGreaterEqual(
+            profiler.cumulative['lpimportouter'],
+            profiler.cumulative['lpimportinner'])
+        self.assertLess(profiler.self_time['lpimportouter'], 0.05)
+        self.assertEqual(profiler.cumulative['lpimportouter'], profiler.total)
+
+    def test_loaded_modules_ignored(self):
+        # Imports of modules that have already been loaded are not recorded.
+        self.makeModule('lpimportloaded')
+        import lpimportloaded  # noqa: F401
+        with ImportProfiler() as profiler:
+            import lpimportloaded  # noqa: F401,F811
+        self.assertEqual({}, profiler.cumulative)
+        self.assertEqual(0.0, profiler.total)
+
+    def test_uninstall(self):
+        builtin_import = __import__
+        with ImportProfiler():
+            self.assertNotEqual(builtin_import, __import__)
+        self.assertEqual(builtin_import, __import__)
+
+    def test_format(self):
+        self.makeModule('lpimportformat')
+        with ImportProfiler() as profiler:
+            import lpimportformat  # noqa: F401
+        lines = profiler.format().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].endswith('  lpimportformat'))
+        self.assertTrue(lines[2].endswith('importing 1 modules'))
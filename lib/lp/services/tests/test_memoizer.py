@@ -5,8 +5,13 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import transaction
+
 from lp.services.compat import mock
-from lp.services.memoizer import memoize
+from lp.services.memoizer import (
+    bounded_memoize,
+    memoize,
+    )
 from lp.testing import TestCase
 
 
@@ -49,3 +54,77 @@ class TestMemoizeDecorator(TestCase):
         self.assertEqual(do_expensive_thing.memo, {})
         do_expensive_thing(heavy_obj)
         self.assertEqual(2, heavy_obj.some_method.call_count)
+
+
+class TestBoundedMemoizeDecorator(TestCase):
+
+    def test_memoizes(self):
+        calls = []
+
+        @bounded_memoize()
+        def double(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual([2, 2, 4], [double(1), double(1), double(2)])
+        self.assertEqual([1, 2], calls)
+        self.assertEqual((1, 2), (double.hits, double.misses))
+
+    def test_bounded(self):
+        # However many distinct arguments it sees, the memo never holds
+        # more than max_size results, dropping the least recently used.
+        @bounded_memoize(max_size=10)
+        def identity(value):
+            return value
+
+        identity(0)
+        for value in range(1, 10000):
+            identity(value)
+            identity(0)
+        self.assertEqual(10, len(identity.memo))
+        self.assertIn((0,), identity.memo)
+        self.assertIn((9999,), identity.memo)
+        self.assertNotIn((1,), identity.memo)
+
+    def test_ttl(self):
+        heavy_obj = mock.Mock()
+
+        @bounded_memoize(ttl=60)
+        def do_expensive_thing(obj):
+            return obj.some_method()
+
+        with mock.patch('time.time', return_value=1000):
+            do_expensive_thing(heavy_obj)
+        with mock.patch('time.time', return_value=1059):
+            do_expensive_thing(heavy_obj)
+        self.assertEqual(1, heavy_obj.some_method.call_count)
+        with mock.patch('time.time', return_value=1060):
+            do_expensive_thing(heavy_obj)
+        self.assertEqual(2, heavy_obj.some_method.call_count)
+
+    def test_per_transaction(self):
+        heavy_obj = mock.Mock()
+
+        @bounded_memoize(per_transaction=True)
+        def do_expensive_thing(obj):
+            return obj.some_method()
+
+        do_expensive_thing(heavy_obj)
+        do_expensive_thing(heavy_obj)
+        self.assertEqual(1, heavy_obj.some_method.call_count)
+        transaction.abort()
+        do_expensive_thing(heavy_obj)
+        self.assertEqual(2, heavy_obj.some_method.call_count)
+
+    def test_clean_memo(self):
+        heavy_obj = mock.Mock()
+
+        @bounded_memoize()
+        def do_expensive_thing(obj):
+            return obj.some_method()
+
+        do_expensive_thing(heavy_obj)
+        do_expensive_thing.clean_memo()
+        self.assertEqual(0, len(do_expensive_thing.memo))
+        do_expensive_thing(heavy_obj)
+        self.assertEqual(2, heavy_obj.some_method.call_count)
@@ -3,7 +3,9 @@
 
 __metaclass__ = type
 
+from collections import Counter
 from functools import partial
+import hashlib
 import logging
 import os
 import re
@@ -65,6 +67,7 @@ from lp.services.database.interfaces import (
 from lp.services.database.policy import MasterDatabasePolicy
 from lp.services.database.postgresql import ConnectionString
 from lp.services.log.loglevels import DEBUG2
+from lp.services.memoizer import bounded_memoize
 from lp.services.stacktrace import (
     extract_stack,
     extract_tb,
@@ -83,6 +86,10 @@ __all__ = [
     'RequestExpired',
     'set_request_started',
     'clear_request_started',
+    'fingerprint_id',
+    'fingerprint_statement',
+    'get_repeated_statements',
+    'get_request_fingerprints',
     'get_request_remaining_seconds',
     'get_request_statements',
     'get_request_start_time',
@@ -214,6 +221,7 @@ def set_request_started(
         set_request_timeline(request, timeline_factory())
     _local.current_statement_timeout = None
     _local.enable_timeout = enable_timeout
+    _local.statement_fingerprints = Counter()
     _local.commit_logger = CommitLogger(transaction)
     transaction.manager.registerSynch(_local.commit_logger)
 
@@ -229,6 +237,7 @@ def clear_request_started():
     _local.sql_logging = None
     _local.sql_logging_start = None
     _local.sql_logging_tracebacks_if = None
+    _local.statement_fingerprints = None
     request = get_current_browser_request()
     set_request_timeline(request, Timeline())
     if getattr(_local, 'commit_logger', None) is not None:
@@ -286,6 +295,71 @@ def get_request_statements():
     return result
 
 
+_fingerprint_substitutions = [
+    (re.compile(r"(?:\bE)?'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%s|\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\(\?(?:, ?\?)+\)"), "(?)"),
+    (re.compile(r"\bARRAY\[\?(?:, ?\?)*\]"), "ARRAY[?]"),
+    ]
+
+
+@bounded_memoize(max_size=1000)
+def fingerprint_statement(statement):
+    """Reduce an SQL statement to a fingerprint of its structure.
+
+    Literal values and parameter markers are replaced with "?", lists of
+    values are collapsed, and whitespace is normalized, so that statements
+    that differ only in their parameters have the same fingerprint.
+    """
+    if isinstance(statement, bytes):
+        statement = statement.decode('UTF-8', errors='replace')
+    fingerprint = statement.strip()
+    for pattern, replacement in _fingerprint_substitutions:
+        fingerprint = pattern.sub(replacement, fingerprint)
+    return fingerprint
+
+
+def fingerprint_id(fingerprint):
+    """Return a short identifier for a statement fingerprint.
+
+    This is suitable for use in metric labels, where the fingerprint
+    itself would be too long.
+    """
+    return hashlib.sha1(fingerprint.encode('UTF-8')).hexdigest()[:8]
+
+
+def get_request_fingerprints():
+    """Get the statement fingerprints executed in the current request.
+
+    :return: A `Counter` mapping fingerprints to the number of times they
+        have been executed, or None outside a request.
+    """
+    return getattr(_local, 'statement_fingerprints', None)
+
+
+def get_repeated_statements(threshold=None):
+    """Get the statements executed repeatedly in the current request.
+
+    A fingerprint executed many times in one request usually means that
+    objects are being loaded one at a time in a loop (the "N+1 queries"
+    pattern) and that the page would benefit from preloading them.
+
+    :param threshold: Return fingerprints executed more than this many
+        times; defaults to `config.launchpad.repeated_statement_threshold`.
+    :return: A list of (fingerprint, count) pairs, most repeated first.
+    """
+    if threshold is None:
+        threshold = config.launchpad.repeated_statement_threshold
+    fingerprints = get_request_fingerprints()
+    if not fingerprints or not threshold:
+        return []
+    return [
+        (fingerprint, count)
+        for fingerprint, count in fingerprints.most_common()
+        if count > threshold]
+
+
 def get_request_start_time():
     """Get the time at which the request started."""
     return getattr(_local, 'request_start_time', None)
@@ -665,6 +739,9 @@ class LaunchpadStatementTracer:
                     statement_to_log)
                 connection._lp_statement_action = None
             return
+        fingerprints = getattr(_local, 'statement_fingerprints', None)
+        if fingerprints is not None:
+            fingerprints[fingerprint_statement(statement)] += 1
         action = get_request_timeline(get_current_browser_request()).start(
             u'SQL-%s' % connection._database.name, statement_to_log)
         connection._lp_statement_action = action
@@ -5,14 +5,15 @@ __metaclass__ = type
 
 from datetime import datetime
 from functools import reduce
-import re
 
 from iso8601 import (
     parse_date,
     ParseError,
     )
 import lazr.batchnavigator
+from lazr.batchnavigator import ListRangeFactory
 from lazr.batchnavigator.interfaces import IRangeFactory
+from lazr.restful.utils import get_current_browser_request
 import simplejson
 from six.moves.collections_abc import Sequence
 from storm import Undef
@@ -37,12 +38,13 @@ from zope.security.proxy import (
 
 from lp.app.browser.launchpad import iter_view_registrations
 from lp.services.config import config
-from lp.services.database.decoratedresultset import DecoratedResultSet
-from lp.services.database.interfaces import ISlaveStore
-from lp.services.database.sqlbase import (
-    convert_storm_clause_to_string,
-    sqlvalues,
+from lp.services.database.approximatecount import (
+    approximate_count,
+    estimate_count,
     )
+from lp.services.database.decoratedresultset import DecoratedResultSet
+from lp.services.database.interfaces import IApproximatelyCountedResultSet
+from lp.services.database.sqlbase import sqlvalues
 from lp.services.propertycache import cachedproperty
 from lp.services.webapp.interfaces import (
     ITableBatchNavigator,
@@ -95,6 +97,23 @@ class FiniteSequenceAdapter:
         return self.context.count()
 
 
+@adapter(IApproximatelyCountedResultSet)
+@implementer(IFiniteSequence)
+class ApproximateFiniteSequenceAdapter(FiniteSequenceAdapter):
+    """Adapt result sets that have opted in to approximate counts.
+
+    lazr.restful uses this to find the total size of webservice
+    collections.  The size is only counted exactly if the client asks for
+    it with "ws.show=total_size".
+    """
+
+    def __len__(self):
+        request = get_current_browser_request()
+        if request is not None and request.get('ws.show') == 'total_size':
+            return self.context.count()
+        return approximate_count(self.context)
+
+
 @implementer(IFiniteSequence)
 class BoundReferenceSetAdapter:
     """Adaptor for `BoundReferenceSet` implementations in Storm."""
@@ -131,7 +150,21 @@ class BatchNavigator(lazr.batchnavigator.BatchNavigator):
 
     def __init__(self, results, request, start=0, size=None, callback=None,
                  transient_parameters=None, force_start=False,
-                 range_factory=None, hide_counts=False):
+                 range_factory=None, hide_counts=False,
+                 approximate_counts=False):
+        """See `lazr.batchnavigator.BatchNavigator`.
+
+        :param hide_counts: If True, don't show the size of the results.
+        :param approximate_counts: If True and `results` is a result set,
+            show an estimate of its size if it is large rather than
+            counting it.  This is implied if `results` provides
+            `IApproximatelyCountedResultSet`.
+        """
+        self.approximate_counts = IResultSet.providedBy(results) and (
+            approximate_counts or
+            IApproximatelyCountedResultSet.providedBy(results))
+        if self.approximate_counts and range_factory is None:
+            range_factory = ApproximateCountRangeFactory(results)
         super(BatchNavigator, self).__init__(results, request,
             start=start, size=size, callback=callback,
             transient_parameters=transient_parameters,
@@ -156,6 +189,17 @@ class BatchNavigator(lazr.batchnavigator.BatchNavigator):
         """
         return self.batch.total() > self.batch.size
 
+    @property
+    def total_is_approximate(self):
+        """Whether the total size is an estimate.
+
+        Totals are only estimated for large results, and are always exact
+        for the last batch.
+        """
+        return (
+            self.approximate_counts and self.batch.has_next_batch and
+            self.batch.total() >= config.launchpad.approximate_count_threshold)
+
 
 class ActiveBatchNavigator(BatchNavigator):
     """A paginator for active items.
@@ -178,8 +222,11 @@ class TableBatchNavigator(BatchNavigator):
     """See lp.services.webapp.interfaces.ITableBatchNavigator."""
 
     def __init__(self, results, request, start=0, size=None,
-                 columns_to_show=None, callback=None):
-        BatchNavigator.__init__(self, results, request, start, size, callback)
+                 columns_to_show=None, callback=None,
+                 approximate_counts=False):
+        BatchNavigator.__init__(
+            self, results, request, start, size, callback,
+            approximate_counts=approximate_counts)
 
         self.show_column = {}
         if columns_to_show:
@@ -298,7 +345,7 @@ class StormRangeFactory:
     distinct for each result row.
     """
 
-    def __init__(self, resultset, error_cb=None):
+    def __init__(self, resultset, error_cb=None, approximate_counts=False):
         """Create a new StormRangeFactory instance.
 
         :param resultset: A Storm ResultSet instance or a DecoratedResultSet
@@ -306,8 +353,12 @@ class StormRangeFactory:
         :param error_cb: A function which takes one string as a parameter.
             It is called when the parameter endpoint_memo of getSlice()
             does not match the order settings of a resultset.
+        :param approximate_counts: If True, count the result set exactly
+            if it is small rather than always estimating its size; see
+            `approximate_count`.
         """
         self.resultset = resultset
+        self.approximate_counts = approximate_counts
         if zope_isinstance(resultset, DecoratedResultSet):
             self.plain_resultset = resultset.get_plain_result_set()
         else:
@@ -610,23 +661,25 @@ class StormRangeFactory:
     @cachedproperty
     def rough_length(self):
         """See `IRangeFactory."""
-        from lp.services.librarian.model import LibraryFileAlias
-        # get_select_expr() requires at least one column as a parameter.
-        # getorderBy() already knows about columns that can appear
+        # getOrderBy() already knows about columns that can appear
         # in the result set, so let's use them. Moreover, for SELECT
         # DISTINCT queries, each column used for sorting must appear
         # in the result.
         if self.empty_resultset:
             return 0
         columns = [plain_expression(column) for column in self.getOrderBy()]
-        select = removeSecurityProxy(self.plain_resultset).get_select_expr(
-            *columns)
-        explain = 'EXPLAIN ' + convert_storm_clause_to_string(select)
-        result = ISlaveStore(LibraryFileAlias).execute(explain)
-        _rows_re = re.compile(r"rows=(\d+)\swidth=")
-        first_line = result.get_one()[0]
-        match = _rows_re.search(first_line)
-        if match is None:
-            raise RuntimeError(
-                "Unexpected EXPLAIN output %s" % repr(first_line))
-        return int(match.group(1))
+        if self.approximate_counts:
+            return approximate_count(self.plain_resultset, columns=columns)
+        return estimate_count(self.plain_resultset, columns=columns)
+
+
+class ApproximateCountRangeFactory(ListRangeFactory):
+    """A range factory that estimates the length of large result sets.
+
+    See `approximate_count`.
+    """
+
+    @cachedproperty
+    def rough_length(self):
+        """See `IRangeFactory`."""
+        return approximate_count(self.results)
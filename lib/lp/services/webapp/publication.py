@@ -520,6 +520,23 @@ class LaunchpadBrowserPublication(
         logging_context.push(
             sql_statements=len(sql_statements), sql_ms=sql_milliseconds)
 
+        # Report statements that were repeated often enough that they
+        # probably come from loading objects one at a time in a loop.
+        repeated_statements = da.get_repeated_statements()
+        if repeated_statements:
+            logging_context.push(sql_repeated_statements=' '.join(
+                '%s=%d' % (da.fingerprint_id(fingerprint), count)
+                for fingerprint, count in repeated_statements))
+            pageid = self._prepPageIDForMetrics(
+                request._orig_env.get('launchpad.pageid'))
+            for fingerprint, count in repeated_statements:
+                getUtility(IStatsdClient).incr(
+                    'sql_repeated_statements', count,
+                    labels={
+                        'pageid': pageid,
+                        'fingerprint': da.fingerprint_id(fingerprint),
+                        })
+
         # Annotate the transaction with user data. That was done by
         # zope.app.publication.zopepublication.ZopePublication.
         txn = transaction.get()
@@ -21,9 +21,15 @@ from zope.security.proxy import isinstance as zope_isinstance
 
 from lp.bugs.model.bugtask import BugTaskSet
 from lp.registry.model.person import Person
+from lp.services.database.approximatecount import (
+    approximately_counted,
+    estimate_count,
+    )
 from lp.services.database.decoratedresultset import DecoratedResultSet
+from lp.services.database.interfaces import IStore
 from lp.services.librarian.model import LibraryFileAlias
 from lp.services.webapp.batching import (
+    ApproximateCountRangeFactory,
     BatchNavigator,
     DateTimeJSONEncoder,
     ShadowedList,
@@ -823,3 +829,76 @@ class TestStormRangeFactory(TestCaseWithFactory):
         # is not always precise.
         self.assertThat(range_factory.rough_length, LessThan(10))
         self.assertEmptyResultSetsWorking(range_factory)
+
+
+class TestBatchNavigatorApproximateCounts(TestCaseWithFactory):
+    """Tests for batch navigators that opt in to approximate counts."""
+
+    layer = LaunchpadFunctionalLayer
+
+    def makeResultSet(self):
+        for _ in range(5):
+            self.factory.makePerson()
+        return IStore(Person).find(Person).order_by(Person.id)
+
+    def test_approximate_counts(self):
+        # Large results are estimated rather than counted, and the total
+        # is marked as approximate.
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=0)
+        batchnav = BatchNavigator(
+            resultset, LaunchpadTestRequest(), size=2,
+            approximate_counts=True)
+        self.assertIsInstance(
+            batchnav.batch.range_factory, ApproximateCountRangeFactory)
+        self.assertEqual(estimate_count(resultset), batchnav.batch.total())
+        self.assertTrue(batchnav.total_is_approximate)
+
+    def test_approximate_counts_small(self):
+        # Small results are counted exactly.
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=10 ** 9)
+        batchnav = BatchNavigator(
+            resultset, LaunchpadTestRequest(), size=2,
+            approximate_counts=True)
+        self.assertEqual(resultset.count(), batchnav.batch.total())
+        self.assertFalse(batchnav.total_is_approximate)
+
+    def test_storm_range_factory_small(self):
+        # StormRangeFactory counts small results exactly if asked to.
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=10 ** 9)
+        batchnav = BatchNavigator(
+            resultset, LaunchpadTestRequest(), size=2,
+            range_factory=StormRangeFactory(
+                resultset, approximate_counts=True),
+            approximate_counts=True)
+        self.assertEqual(resultset.count(), batchnav.batch.total())
+        self.assertFalse(batchnav.total_is_approximate)
+
+    def test_storm_range_factory_large(self):
+        resultset = self.makeResultSet()
+        self.pushConfig('launchpad', approximate_count_threshold=0)
+        batchnav = BatchNavigator(
+            resultset, LaunchpadTestRequest(), size=2,
+            range_factory=StormRangeFactory(
+                resultset, approximate_counts=True),
+            approximate_counts=True)
+        self.assertEqual(
+            estimate_count(resultset, columns=[Person.id]),
+            batchnav.batch.total())
+        self.assertTrue(batchnav.total_is_approximate)
+
+    def test_approximately_counted_result_set(self):
+        # Result sets can opt in to approximate counts themselves.
+        resultset = approximately_counted(self.makeResultSet())
+        batchnav = BatchNavigator(resultset, LaunchpadTestRequest())
+        self.assertTrue(batchnav.approximate_counts)
+
+    def test_approximate_counts_list(self):
+        # Other sequences are always counted exactly.
+        batchnav = BatchNavigator(
+            list(range(5)), LaunchpadTestRequest(), size=2,
+            approximate_counts=True)
+        self.assertFalse(batchnav.approximate_counts)
+        self.assertEqual(5, batchnav.batch.total())
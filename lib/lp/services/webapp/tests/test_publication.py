@@ -395,6 +395,21 @@ class TestPublisherStats(StatsMixin, TestCaseWithFactory):
                       'pageid=RootObject-index-html,success=False'),
                       GreaterThan(0)))]))
 
+    def test_repeated_statements_stats(self):
+        # Repeated statements are counted for each page and fingerprint.
+        self.useFixture(FakeLogger())
+        self.patch(
+            dbadapter, 'get_repeated_statements',
+            FakeMethod(result=[('SELECT 1', 42)]))
+        browser = self.getUserBrowser()
+        browser.open('http://launchpad.test')
+        self.assertEqual(
+            [(('sql_repeated_statements,env=test,fingerprint=%s,'
+               'pageid=RootObject-index-html' %
+               dbadapter.fingerprint_id('SELECT 1'), 42),)],
+            [call[:1] for call in self.stats_client.incr.call_args_list
+             if call[0][0].startswith('sql_repeated_statements')])
+
     def test_prepPageIDForMetrics_none(self):
         # Sometimes we have no pageid
         publication = LaunchpadBrowserPublication(None)
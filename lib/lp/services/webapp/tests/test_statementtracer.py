@@ -388,3 +388,67 @@ class TestLoggingWithinRequest(TestCaseWithFactory):
                     self.connection, None, 'SELECT * FROM one', (),
                     Exception())
                 self.assertIsNone(self.connection._lp_statement_action)
+
+    def test_fingerprints(self):
+        # Statements are counted by fingerprint while handling a request.
+        tracer = da.LaunchpadStatementTracer()
+        with person_logged_in(self.person):
+            # Ignore any statements executed by logging in.
+            da.get_request_fingerprints().clear()
+            for statement in (
+                    'SELECT * FROM bar WHERE bing = 42',
+                    'SELECT * FROM bar WHERE bing = 43',
+                    'SELECT * FROM baz'):
+                tracer.connection_raw_execute(
+                    self.connection, None, statement, ())
+                tracer.connection_raw_execute_success(
+                    self.connection, None, statement, ())
+            fingerprints = dict(da.get_request_fingerprints())
+        self.assertEqual(
+            {'SELECT * FROM bar WHERE bing = ?': 2, 'SELECT * FROM baz': 1},
+            fingerprints)
+        self.assertEqual(
+            [('SELECT * FROM bar WHERE bing = ?', 2)],
+            da.get_repeated_statements(threshold=1))
+        self.pushConfig('launchpad', repeated_statement_threshold=2)
+        self.assertEqual([], da.get_repeated_statements())
+        da.clear_request_started()
+        self.assertIsNone(da.get_request_fingerprints())
+        self.assertEqual([], da.get_repeated_statements(threshold=1))
+        da.set_request_started()
+        self.assertEqual({}, da.get_request_fingerprints())
+
+
+class TestFingerprintStatement(TestCase):
+
+    def test_literals(self):
+        self.assertEqual(
+            'SELECT * FROM bar WHERE bing = ? AND bong = ? AND x1 = ?',
+            da.fingerprint_statement(
+                "SELECT * FROM bar WHERE bing = 42 AND bong = 'it''s' "
+                "AND x1 = 1.5"))
+
+    def test_parameters(self):
+        self.assertEqual(
+            'SELECT * FROM bar WHERE bing = ?',
+            da.fingerprint_statement('SELECT * FROM bar WHERE bing = %s'))
+
+    def test_lists(self):
+        self.assertEqual(
+            'SELECT * FROM bar WHERE bing IN (?) AND bong = ANY(ARRAY[?])',
+            da.fingerprint_statement(
+                'SELECT * FROM bar WHERE bing IN (1, 2, 3) '
+                'AND bong = ANY(ARRAY[%s,%s])'))
+
+    def test_whitespace(self):
+        self.assertEqual(
+            'SELECT * FROM bar WHERE bing = ?',
+            da.fingerprint_statement(
+                ' SELECT *\n  FROM bar\n WHERE bing = %s\n'))
+
+    def test_fingerprint_id(self):
+        self.assertEqual(
+            da.fingerprint_id('SELECT * FROM bar WHERE bing = ?'),
+            da.fingerprint_id(
+                da.fingerprint_statement('SELECT * FROM bar WHERE bing = 1')))
+        self.assertEqual(8, len(da.fingerprint_id('SELECT 1')))
@@ -11,6 +11,7 @@ __all__ = [
     ]
 
 import logging
+import time
 
 from zope.app.appsetup import appsetup
 from zope.app.wsgi import WSGIPublisherApplication
@@ -28,7 +29,9 @@ def get_wsgi_application():
             "Developer mode is enabled: this is a security risk and should "
             "NOT be enabled on production servers. Developer mode can be "
             "turned off in launchpad-lazr.conf.")
+    start = time.time()
     appsetup.config("zcml/webapp.zcml", features=features)
+    logging.info("Executed webapp.zcml in %.2fs", time.time() - start)
 
     # We don't use ZODB, but the webapp subscribes to IDatabaseOpened to
     # perform some post-configuration tasks, so emit that event manually.
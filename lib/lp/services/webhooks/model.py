@@ -65,7 +65,7 @@ from lp.services.job.model.job import (
     Job,
     )
 from lp.services.job.runner import BaseRunnableJob
-from lp.services.memoizer import memoize
+from lp.services.memoizer import bounded_memoize
 from lp.services.scripts import log
 from lp.services.webapp.authorization import iter_authorization
 from lp.services.webhooks.interfaces import (
@@ -465,7 +465,7 @@ class WebhookDeliveryJob(WebhookJobDerived):
         return job
 
     @classmethod
-    @memoize
+    @bounded_memoize(ttl=60 * 60)
     def _get_broadcast_addresses(cls):
         addrs = []
         for net, addresses in psutil.net_if_addrs().items():
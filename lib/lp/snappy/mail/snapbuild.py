@@ -8,7 +8,6 @@ __all__ = [
     'SnapBuildMailer',
     ]
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.services.config import config
 from lp.services.mail.basemailer import (
     BaseMailer,
@@ -135,6 +134,7 @@ class SnapBuildMailer(BaseMailer):
             "store_url": store_url,
             })
         if build.duration is not None:
+            from lp.app.browser.tales import DurationFormatterAPI
             duration_formatter = DurationFormatterAPI(build.duration)
             params["build_duration"] = duration_formatter.approximateduration()
         if build.log is not None:
@@ -58,10 +58,6 @@ from zope.interface import (
 from zope.security.interfaces import Unauthorized
 from zope.security.proxy import removeSecurityProxy
 
-from lp.app.browser.tales import (
-    ArchiveFormatterAPI,
-    DateTimeFormatterAPI,
-    )
 from lp.app.enums import (
     FREE_INFORMATION_TYPES,
     InformationType,
@@ -1007,6 +1003,8 @@ class Snap(Storm, WebhookTargetMixin):
 
     def getBuildSummariesForSnapBuildIds(self, snap_build_ids):
         """See `ISnap`."""
+        from lp.app.browser.tales import DateTimeFormatterAPI
+
         result = {}
         if snap_build_ids is None:
             return result
@@ -1045,6 +1043,8 @@ class Snap(Storm, WebhookTargetMixin):
 
     def getBuildSummaries(self, request_ids=None, build_ids=None, user=None):
         """See `ISnap`."""
+        from lp.app.browser.tales import ArchiveFormatterAPI
+
         all_build_ids = []
         result = {"requests": {}, "builds": {}}
 
@@ -10,7 +10,6 @@ from collections import OrderedDict
 
 from zope.component import getUtility
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.app.interfaces.launchpad import ILaunchpadCelebrities
 from lp.archivepublisher.utils import get_ppa_reference
 from lp.buildmaster.enums import BuildStatus
@@ -205,6 +204,7 @@ class BinaryPackageBuildMailer(BaseMailer):
             builder_url = canonical_url(build.buildqueue_record.builder)
         else:
             # completed states (success and failure)
+            from lp.app.browser.tales import DurationFormatterAPI
             buildduration = DurationFormatterAPI(
                 build.duration).approximateduration()
             buildlog_url = build.log_url
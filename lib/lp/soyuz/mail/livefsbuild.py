@@ -6,7 +6,6 @@ __all__ = [
     'LiveFSBuildMailer',
     ]
 
-from lp.app.browser.tales import DurationFormatterAPI
 from lp.services.config import config
 from lp.services.mail.basemailer import (
     BaseMailer,
@@ -67,6 +66,7 @@ class LiveFSBuildMailer(BaseMailer):
             "build_url": canonical_url(self.build),
             })
         if build.duration is not None:
+            from lp.app.browser.tales import DurationFormatterAPI
             duration_formatter = DurationFormatterAPI(build.duration)
             params["build_duration"] = duration_formatter.approximateduration()
         if build.log is not None:
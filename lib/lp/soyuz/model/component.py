@@ -15,6 +15,7 @@ from sqlobject import (
 from zope.interface import implementer
 
 from lp.app.errors import NotFoundError
+from lp.services.database.referencecache import ReferenceCache
 from lp.services.database.sqlbase import SQLBase
 from lp.soyuz.interfaces.component import (
     IComponent,
@@ -51,13 +52,15 @@ class ComponentSelection(SQLBase):
 class ComponentSet:
     """See IComponentSet."""
 
+    _cache = ReferenceCache(Component, 'name')
+
     def __iter__(self):
         """See IComponentSet."""
         return iter(Component.select())
 
     def __getitem__(self, name):
         """See IComponentSet."""
-        component = Component.selectOneBy(name=name)
+        component = self._cache.get(name)
         if component is not None:
             return component
         raise NotFoundError(name)
@@ -68,7 +71,7 @@ class ComponentSet:
 
     def ensure(self, name):
         """See IComponentSet."""
-        component = Component.selectOneBy(name=name)
+        component = self._cache.get(name)
         if component is not None:
             return component
         return self.new(name)
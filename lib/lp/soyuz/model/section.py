@@ -15,6 +15,7 @@ from sqlobject import (
 from zope.interface import implementer
 
 from lp.app.errors import NotFoundError
+from lp.services.database.referencecache import ReferenceCache
 from lp.services.database.sqlbase import SQLBase
 from lp.soyuz.interfaces.section import (
     ISection,
@@ -48,13 +49,15 @@ class SectionSelection(SQLBase):
 class SectionSet:
     """See ISectionSet."""
 
+    _cache = ReferenceCache(Section, 'name')
+
     def __iter__(self):
         """See ISectionSet."""
         return iter(Section.select())
 
     def __getitem__(self, name):
         """See ISectionSet."""
-        section = Section.selectOneBy(name=name)
+        section = self._cache.get(name)
         if section is not None:
             return section
         raise NotFoundError(name)
@@ -65,7 +68,7 @@ class SectionSet:
 
     def ensure(self, name):
         """See ISectionSet."""
-        section = Section.selectOneBy(name=name)
+        section = self._cache.get(name)
         if section is not None:
             return section
         return self.new(name)
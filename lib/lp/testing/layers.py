@@ -114,6 +114,7 @@ from lp.services.config.fixture import (
     ConfigUseFixture,
     )
 from lp.services.database.interfaces import IStore
+from lp.services.database.referencecache import invalidate_reference_caches
 from lp.services.database.sqlbase import (
     disconnect_stores,
     session_store,
@@ -742,6 +743,9 @@ class DatabaseLayer(BaseLayer):
     @profiled
     def testTearDown(cls):
         cls._db_fixture.tearDown()
+        # The database is about to be reset, so IDs cached by name from
+        # this test mustn't leak into query counts in the next one.
+        invalidate_reference_caches()
 
         # Fail tests that forget to uninstall their database policies.
         from lp.services.webapp.adapter import StoreSelector
@@ -245,7 +245,7 @@ class TestTranslationTemplatesBuildBehaviour(
         queue_item.markAsBuilding(self.factory.makeBuilder())
         slave = behaviour._slave
 
-        def fake_getFile(sum, path):
+        def fake_getFile(sum, path, compress=False):
             dummy_tar = os.path.join(
                 os.path.dirname(__file__), 'dummy_templates.tar.gz')
             tar_file = open(dummy_tar, 'rb')
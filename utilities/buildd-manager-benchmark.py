@@ -0,0 +1,116 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Run buildd-manager against a simulated build farm and report on it.
+
+DO NOT RUN ON PRODUCTION SYSTEMS.  This creates builders and builds in
+the database, and takes all other builders out of service while it runs.
+The simulated builders are left behind, marked as not OK.
+"""
+
+import _pythonpath  # noqa: F401
+
+from twisted.internet import (
+    defer,
+    reactor,
+    )
+from twisted.python.failure import Failure
+from zope.component import getUtility
+
+from lp.buildmaster.interactor import shut_down_default_process_pool
+from lp.buildmaster.interfaces.builder import IBuilderSet
+from lp.buildmaster.tests.simulator import (
+    BuilddManagerBenchmark,
+    make_build_queue,
+    SimulatedBuildFarm,
+    skip_uploads,
+    )
+from lp.services.scripts.base import LaunchpadScript
+from lp.testing.factory import LaunchpadObjectFactory
+
+
+class BuilddManagerBenchmarkScript(LaunchpadScript):
+
+    description = "Benchmark buildd-manager against simulated builders."
+
+    def add_my_options(self):
+        self.parser.add_option(
+            "-b", "--builders", type="int", default=10,
+            help="Number of builders to simulate (default: %default).")
+        self.parser.add_option(
+            "-n", "--builds", type="int", default=50,
+            help="Number of builds to queue (default: %default).")
+        self.parser.add_option(
+            "--min-duration", type="float", default=1,
+            help="Minimum build duration in seconds (default: %default).")
+        self.parser.add_option(
+            "--max-duration", type="float", default=10,
+            help="Maximum build duration in seconds (default: %default).")
+        self.parser.add_option(
+            "--failure-rate", type="float", default=0.1,
+            help="Proportion of builds that fail (default: %default).")
+        self.parser.add_option(
+            "--scan-interval", type="float", default=1,
+            help="Builder scan interval in seconds (default: %default).")
+        self.parser.add_option(
+            "--timeout", type="float", default=600,
+            help="Give up after this many seconds (default: %default).")
+        self.parser.add_option(
+            "--seed", type="int",
+            help="Random seed, for repeatable simulations.")
+
+    @defer.inlineCallbacks
+    def benchmark(self):
+        options = self.options
+        other_builders = [
+            builder for builder in getUtility(IBuilderSet)
+            if builder.builderok]
+        farm = SimulatedBuildFarm(
+            options.builders,
+            durations=(options.min_duration, options.max_duration),
+            failure_rate=options.failure_rate, seed=options.seed,
+            name_prefix='benchmark')
+        with farm, skip_uploads():
+            try:
+                for builder in other_builders:
+                    builder.builderok = False
+                builds = make_build_queue(
+                    LaunchpadObjectFactory(), farm, options.builds)
+                benchmark = BuilddManagerBenchmark(
+                    farm, scan_interval=options.scan_interval,
+                    logger=self.logger)
+                report = yield benchmark.run(
+                    len(builds), timeout=options.timeout)
+            finally:
+                self.txn.abort()
+                for builder in other_builders:
+                    builder.builderok = True
+                for simulated in farm.builders:
+                    builder = getUtility(IBuilderSet).getByName(
+                        simulated.name)
+                    if builder is not None:
+                        builder.builderok = False
+                self.txn.commit()
+                yield shut_down_default_process_pool()
+        defer.returnValue(report)
+
+    def main(self):
+        results = []
+
+        def run():
+            d = self.benchmark()
+            d.addBoth(results.append)
+            d.addBoth(lambda _: reactor.stop())
+
+        reactor.callWhenRunning(run)
+        reactor.run()
+        [result] = results
+        if isinstance(result, Failure):
+            result.raiseException()
+        print(result.format())
+
+
+if __name__ == '__main__':
+    BuilddManagerBenchmarkScript('buildd-manager-benchmark').run()
@@ -0,0 +1,92 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Measure the cost of evaluating feature flags in a request.
+
+Simulate requests that each build a FeatureController and look up a number
+of flags, with rules that are either compiled afresh for each request or
+shared between requests as they are by the web application.  No database
+is needed: the rules are generated in memory.
+"""
+
+import _pythonpath  # noqa: F401
+
+from optparse import OptionParser
+import sys
+import time
+
+from lp.services.features.flags import FeatureController
+from lp.services.features.rulesource import (
+    compile_rules,
+    MemoryFeatureRuleSource,
+    )
+
+
+class SharedMemoryFeatureRuleSource(MemoryFeatureRuleSource):
+    """Compile the rules once, as `CachingStormFeatureRuleSource` does."""
+
+    def setAllRules(self, new_rules):
+        super(SharedMemoryFeatureRuleSource, self).setAllRules(new_rules)
+        self.compiled = compile_rules(self.getAllRulesAsDict())
+
+    def getCompiledRules(self):
+        return self.compiled
+
+
+def make_rules(flags, rules_per_flag, scopes):
+    """Make rules for each flag, falling back to the default scope."""
+    rules = []
+    for flag in range(flags):
+        for rule in range(rules_per_flag - 1):
+            scope = 'team:team-%d' % ((flag + rule) % scopes)
+            rules.append(('flag.%d' % flag, scope, 100 - rule, u'on'))
+        rules.append(('flag.%d' % flag, 'default', 0, u''))
+    return rules
+
+
+def run(rule_source, requests, flags):
+    active_scopes = {'default', 'team:team-0'}
+    names = ['flag.%d' % flag for flag in range(flags)]
+    for _ in range(requests):
+        controller = FeatureController(
+            lambda scope: scope in active_scopes, rule_source)
+        for name in names:
+            controller.getFlag(name)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-n", "--requests", type="int", default=10000,
+        help="Number of requests to simulate (default: %default).")
+    parser.add_option(
+        "-f", "--flags", type="int", default=60,
+        help="Number of flags looked up per request (default: %default).")
+    parser.add_option(
+        "-r", "--rules", type="int", default=4,
+        help="Number of rules per flag (default: %default).")
+    parser.add_option(
+        "-s", "--scopes", type="int", default=10,
+        help="Number of distinct non-default scopes (default: %default).")
+    options, args = parser.parse_args()
+
+    rules = make_rules(options.flags, options.rules, options.scopes)
+    runs = [
+        ("per-request", MemoryFeatureRuleSource()),
+        ("shared", SharedMemoryFeatureRuleSource()),
+        ]
+    for name, rule_source in runs:
+        rule_source.setAllRules(rules)
+        start = time.time()
+        run(rule_source, options.requests, options.flags)
+        elapsed = time.time() - start
+        print("%-12s %d requests in %.2fs: %.1f us/request" % (
+            name, options.requests, elapsed,
+            elapsed / options.requests * 1000000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
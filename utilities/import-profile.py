@@ -0,0 +1,62 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Report how long a script spends importing modules.
+
+The script's module-level code is run, but not its main program, so this
+is safe to use on any script that guards its entry point with
+``if __name__ == '__main__'``.
+"""
+
+import _pythonpath  # noqa: F401
+
+from optparse import OptionParser
+import os.path
+import runpy
+import sys
+
+from lp.services.importprofile import ImportProfiler
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] SCRIPT")
+    parser.add_option(
+        "-n", "--limit", type="int", default=30,
+        help="Number of modules to list, or 0 for all (default: %default).")
+    parser.add_option(
+        "--sort", choices=["cumulative", "self"], default="cumulative",
+        help="Sort by cumulative or self time (default: %default).")
+    parser.add_option(
+        "--budget", type="float",
+        help="Fail if importing takes longer than this many seconds.")
+    parser.add_option(
+        "--forbid", action="append", default=[], metavar="MODULE",
+        help="Fail if MODULE is imported.  May be repeated.")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Need exactly one script.")
+    [script] = args
+
+    script = os.path.abspath(script)
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script]
+    with ImportProfiler() as profiler:
+        runpy.run_path(script, run_name="__import_profile__")
+    print(profiler.format(limit=options.limit or None, sort_key=options.sort))
+
+    failed = False
+    if options.budget is not None and profiler.total > options.budget:
+        print("Imports took %.3fs, over the budget of %.3fs." % (
+            profiler.total, options.budget))
+        failed = True
+    for name in options.forbid:
+        if name in sys.modules:
+            print("Forbidden module %s was imported." % name)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
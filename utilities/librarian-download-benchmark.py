@@ -0,0 +1,70 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Measure librarian download throughput.
+
+Repeatedly download a librarian URL using a number of concurrent clients,
+and report the aggregate throughput.  To compare the librarian's own file
+producer with a sendfile(2) handoff, run this once against the librarian
+directly and once against a fronting web server configured to honour
+librarian_server.sendfile_header.
+"""
+
+import _pythonpath  # noqa: F401
+
+from concurrent import futures
+from optparse import OptionParser
+import sys
+import time
+
+import requests
+
+
+def download(session, url, chunk_size):
+    size = 0
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+    return size
+
+
+def client(url, count, chunk_size):
+    session = requests.Session()
+    return sum(download(session, url, chunk_size) for _ in range(count))
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] URL")
+    parser.add_option(
+        "-c", "--concurrency", type="int", default=8,
+        help="Number of concurrent clients (default: %default).")
+    parser.add_option(
+        "-n", "--requests", type="int", default=10,
+        help="Number of downloads per client (default: %default).")
+    parser.add_option(
+        "--chunk-size", type="int", default=1024 * 1024,
+        help="Client read size in bytes (default: %default).")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Need exactly one URL.")
+    [url] = args
+
+    start = time.time()
+    with futures.ThreadPoolExecutor(options.concurrency) as executor:
+        sizes = list(executor.map(
+            lambda _: client(url, options.requests, options.chunk_size),
+            range(options.concurrency)))
+    elapsed = time.time() - start
+    total = sum(sizes)
+    print("%d downloads, %d bytes in %.2fs: %.1f MB/s, %.1f requests/s" % (
+        options.concurrency * options.requests, total, elapsed,
+        total / elapsed / 1000000, options.concurrency * options.requests /
+        elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compare one-at-a-time and batched uploads of small files to the librarian.
+
+The uploaded files expire after an hour, so this is safe to run against
+any librarian that can be smoke-tested.
+"""
+
+import _pythonpath  # noqa: F401
+
+import datetime
+import io
+from optparse import OptionParser
+import sys
+import time
+
+import pytz
+import transaction
+from zope.component import getUtility
+
+from lp.services.librarian.interfaces.client import ILibrarianClient
+from lp.services.scripts import execute_zcml_for_scripts
+
+
+FILE_LIFETIME = datetime.timedelta(hours=1)
+
+
+def make_files(count, size, expires):
+    return [
+        {'name': 'benchmark-%d.txt' % i, 'size': size,
+         'file': io.BytesIO(b'x' * size), 'contentType': 'text/plain',
+         'expires': expires}
+        for i in range(count)]
+
+
+def upload_singly(client, files):
+    for spec in files:
+        client.addFile(**spec)
+
+
+def upload_batches(client, files, batch_size):
+    for start in range(0, len(files), batch_size):
+        client.addFiles(files[start:start + batch_size])
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-n", "--files", type="int", default=1000,
+        help="Number of files to upload (default: %default).")
+    parser.add_option(
+        "-s", "--size", type="int", default=1024,
+        help="Size of each file in bytes (default: %default).")
+    parser.add_option(
+        "-b", "--batch-size", type="int", default=100,
+        help="Number of files in each batch (default: %default).")
+    options, args = parser.parse_args()
+
+    execute_zcml_for_scripts()
+    client = getUtility(ILibrarianClient)
+    expires = datetime.datetime.now(pytz.UTC) + FILE_LIFETIME
+    runs = [
+        ("addFile", upload_singly),
+        ("addFiles", lambda client, files: upload_batches(
+            client, files, options.batch_size)),
+        ]
+    for name, upload in runs:
+        files = make_files(options.files, options.size, expires)
+        start = time.time()
+        upload(client, files)
+        transaction.commit()
+        elapsed = time.time() - start
+        print("%-8s %d files in %.2fs: %.1f files/s" % (
+            name, options.files, elapsed, options.files / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Measure the CPU cost of reading from a SwiftStream.
+
+Feed a SwiftStream with in-memory chunks, as swiftclient would, and report
+the throughput of read() and readinto() at a range of read sizes.  The
+slicing reader that SwiftStream used to implement is included as a
+baseline.
+"""
+
+import _pythonpath  # noqa: F401
+
+from optparse import OptionParser
+import sys
+import time
+
+from lp.services.librarianserver.swift import SwiftStream
+
+
+class FakeConnectionPool:
+
+    def put(self, swift_connection):
+        pass
+
+
+def make_stream(chunk, count):
+    return SwiftStream(
+        FakeConnectionPool(), object(), (chunk for _ in range(count)))
+
+
+def slicing_read(chunks, size):
+    """Read like the original SwiftStream.read: slice off what we return."""
+    current = b''
+    while True:
+        return_chunks = []
+        return_size = 0
+        while return_size < size:
+            if not current:
+                current = next(chunks, None)
+                if not current:
+                    break
+            split = size - return_size
+            return_chunks.append(current[:split])
+            current = current[split:]
+            return_size += len(return_chunks[-1])
+        if not return_size:
+            return
+        yield b''.join(return_chunks)
+
+
+def bench_slicing(chunk, count, size):
+    for _ in slicing_read((chunk for _ in range(count)), size):
+        pass
+
+
+def bench_read(chunk, count, size):
+    stream = make_stream(chunk, count)
+    while stream.read(size):
+        pass
+
+
+def bench_readinto(chunk, count, size):
+    stream = make_stream(chunk, count)
+    buf = bytearray(size)
+    while stream.readinto(buf):
+        pass
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "--chunk-size", type="int", default=64 * 1024,
+        help="Size of chunks from Swift (default: %default).")
+    parser.add_option(
+        "--total", type="int", default=256,
+        help="Megabytes to read in each run (default: %default).")
+    parser.add_option(
+        "--read-sizes", default="512,4096,65536,1048576",
+        help="Comma-separated read sizes (default: %default).")
+    options, args = parser.parse_args()
+
+    chunk = b"x" * options.chunk_size
+    count = options.total * 1024 * 1024 // options.chunk_size
+    benchmarks = [
+        ("slicing", bench_slicing),
+        ("read", bench_read),
+        ("readinto", bench_readinto),
+        ]
+    print("%10s %10s %10s" % ("read size", "method", "MB/s"))
+    for size in [int(size) for size in options.read_sizes.split(",")]:
+        for name, benchmark in benchmarks:
+            start = time.time()
+            benchmark(chunk, count, size)
+            elapsed = time.time() - start
+            print("%10d %10s %10.1f" % (
+                size, name, options.total / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#! /usr/bin/python2 -S
+#
+# Copyright 2021 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Measure how long scripts take to configure the component architecture.
+
+Each run executes the script ZCML in a fresh process, so that imports are
+counted too.  Pass --profile to measure a slimmer profile such as
+zcml/script-<profile>.zcml.
+"""
+
+import _pythonpath  # noqa: F401
+
+from optparse import OptionParser
+import subprocess
+import sys
+import time
+
+
+def configure(profile):
+    from lp.services.scripts import execute_zcml_for_scripts
+    execute_zcml_for_scripts(profile=profile)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option(
+        "-n", "--runs", type="int", default=5,
+        help="Number of runs (default: %default).")
+    parser.add_option(
+        "--profile", help="Name of the ZCML profile to execute.")
+    parser.add_option("--child", action="store_true", help="(internal)")
+    options, args = parser.parse_args()
+
+    if options.child:
+        configure(options.profile)
+        return 0
+
+    command = [sys.executable, "-S", __file__, "--child"]
+    if options.profile is not None:
+        command.extend(["--profile", options.profile])
+    times = []
+    for _ in range(options.runs):
+        start = time.time()
+        subprocess.check_call(command)
+        times.append(time.time() - start)
+    print("%s: min %.2fs, max %.2fs, mean %.2fs over %d runs" % (
+        options.profile or "script", min(times), max(times),
+        sum(times) / len(times), len(times)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())